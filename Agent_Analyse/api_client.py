@@ -8,8 +8,24 @@ Ce script montre comment utiliser l'API depuis votre application.
 
 import requests
 import argparse
+import asyncio
 import json
+import math
+import random
+import threading
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+# httpx n'est nécessaire que pour le client asynchrone
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Réponses pour lesquelles la requête est renvoyée (surcharge ou indisponibilité passagère)
+RETRY_STATUS_CODES = (429, 502, 503, 504)
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Client pour l'API Mistral 7B Fine-tuné")
@@ -25,6 +41,25 @@ def parse_args():
                       help="Top-p pour la génération")
     parser.add_argument("--top_k", type=int, default=50,
                       help="Top-k pour la génération")
+    parser.add_argument("--stream", action="store_true",
+                      help="Afficher la réponse au fur et à mesure (endpoint /generate_stream)")
+    
+    # Test de charge de l'endpoint /generate
+    parser.add_argument("--load_test", action="store_true",
+                      help="Lancer un test de charge de /generate au lieu d'une requête unique")
+    parser.add_argument("--prompts_file", type=str, default=None,
+                      help="Fichier JSONL des prompts rejoués ({\"prompt\": ...} ou {\"messages\": [...]}), --prompt sinon")
+    parser.add_argument("--num_requests", type=int, default=100,
+                      help="Nombre de requêtes envoyées pendant le test de charge")
+    parser.add_argument("--concurrency", type=int, default=4,
+                      help="Nombre maximum de requêtes simultanées")
+    parser.add_argument("--rate", type=float, default=None,
+                      help="Débit d'arrivée en requêtes/s (boucle ouverte, arrivées de Poisson) ; "
+                           "sans cette option, chaque client renvoie une requête dès la réponse reçue (boucle fermée)")
+    parser.add_argument("--timeout", type=float, default=300,
+                      help="Timeout d'une requête (secondes)")
+    parser.add_argument("--report", type=str, default=None,
+                      help="Fichier JSON où écrire le rapport du test de charge")
     return parser.parse_args()
 
 def check_api_health(api_url):
@@ -42,9 +77,10 @@ def check_api_health(api_url):
         print(f"Erreur lors de la vérification de l'état de l'API : {e}")
         return False
 
-def generate_text(api_url, prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, top_k=50):
+def generate_text(api_url, prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, top_k=50, session=None):
     """
     Envoie une requête à l'API pour générer du texte
+    (avec `session`, la connexion est réutilisée d'un appel à l'autre)
     """
     url = f"{api_url}/generate"
     
@@ -64,7 +100,7 @@ def generate_text(api_url, prompt, max_new_tokens=512, temperature=0.7, top_p=0.
         print("Envoi de la requête à l'API...")
         start_time = time.time()
         
-        response = requests.post(url, json=payload, headers=headers)
+        response = (session or requests).post(url, json=payload, headers=headers)
         
         if response.status_code == 200:
             result = response.json()
@@ -82,6 +118,209 @@ def generate_text(api_url, prompt, max_new_tokens=512, temperature=0.7, top_p=0.
         print(f"Erreur lors de la génération de texte: {e}")
         return None
 
+def stream_text(api_url, prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, top_k=50, session=None):
+    """
+    Envoie une requête à l'endpoint de streaming et retourne un générateur des morceaux de texte.
+    Interrompre l'itération ferme la connexion, ce qui arrête la génération côté serveur.
+    """
+    url = f"{api_url}/generate_stream"
+    
+    payload = {
+        "prompt": prompt,
+        "max_new_tokens": max_new_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+        "top_k": top_k
+    }
+    
+    with (session or requests).post(url, json=payload, stream=True) as response:
+        response.raise_for_status()
+        event = None
+        
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                event = None
+                continue
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+                continue
+            if not line.startswith("data:"):
+                continue
+            
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            if event == "error":
+                raise RuntimeError(f"Erreur lors de la génération: {json.loads(data)['detail']}")
+            yield json.loads(data)["text"]
+
+def print_stream(api_url, prompt, **generation_kwargs):
+    """
+    Affiche la réponse en streaming avec le temps jusqu'au premier token
+    """
+    start_time = time.time()
+    first_token_time = None
+    chunks = []
+    
+    try:
+        for text in stream_text(api_url, prompt, **generation_kwargs):
+            if first_token_time is None:
+                first_token_time = time.time() - start_time
+            chunks.append(text)
+            print(text, end="", flush=True)
+    except (requests.RequestException, RuntimeError) as e:
+        print(f"\nErreur lors de la génération de texte: {e}")
+        return None
+    
+    total_time = time.time() - start_time
+    if first_token_time is not None:
+        print(f"\n\nPremier token après {first_token_time:.2f} s, réponse complète en {total_time:.2f} s")
+    return "".join(chunks)
+
+def load_prompts(prompts_file):
+    """
+    Prompts d'un fichier JSONL : champ "prompt" (avec éventuellement ses propres
+    paramètres de génération) ou dernier message utilisateur d'une conversation
+    """
+    prompts = []
+    with open(prompts_file, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"{prompts_file}:{line_number}: erreur de parsing ({e})")
+                continue
+            if "prompt" in record:
+                prompts.append(record)
+                continue
+            users = [msg["content"] for msg in record.get("messages", []) if msg.get("role") == "user"]
+            if users:
+                prompts.append({"prompt": users[-1]})
+            else:
+                print(f"{prompts_file}:{line_number}: ni 'prompt' ni message utilisateur")
+    return prompts
+
+def percentile(values, q):
+    """Percentile par interpolation linéaire"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def latency_histogram(latencies, buckets_per_decade=4):
+    """Histogramme des latences (secondes) en classes logarithmiques : [(borne supérieure, nombre)]"""
+    counts = Counter(math.ceil(math.log10(max(latency, 1e-4)) * buckets_per_decade) for latency in latencies)
+    return [(10 ** (bucket / buckets_per_decade), counts[bucket]) for bucket in range(min(counts), max(counts) + 1)] if counts else []
+
+def run_load_test(api_url, prompts, num_requests=100, concurrency=4, rate=None, timeout=300, **generation_kwargs):
+    """
+    Envoie `num_requests` requêtes à /generate et retourne le rapport du test.
+    
+    En boucle fermée (`rate` absent), `concurrency` clients renvoient une requête
+    dès la réponse reçue. En boucle ouverte, les requêtes arrivent selon un
+    processus de Poisson de débit `rate`, quelle que soit la vitesse du serveur,
+    avec au plus `concurrency` requêtes en vol ; la latence est alors mesurée
+    depuis l'heure d'arrivée prévue, attente côté client comprise.
+    """
+    url = f"{api_url}/generate"
+    local = threading.local()
+    
+    def session():
+        # Une session par thread : connexions gardées ouvertes entre les requêtes
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.mount(api_url, HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        return local.session
+    
+    def send(index, scheduled):
+        record = prompts[index % len(prompts)]
+        payload = {**generation_kwargs, **record}
+        result = {"status": None, "error": None}
+        try:
+            response = session().post(url, json=payload, timeout=timeout)
+            result["status"] = response.status_code
+            if response.status_code == 200:
+                result["processing_time_ms"] = response.json().get("processing_time_ms")
+            else:
+                result["error"] = f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            result["error"] = type(e).__name__
+        result["latency"] = time.perf_counter() - scheduled
+        return result
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if rate is None:
+            counter = iter(range(num_requests))
+            counter_lock = threading.Lock()
+            
+            def client():
+                results = []
+                while True:
+                    with counter_lock:
+                        index = next(counter, None)
+                    if index is None:
+                        return results
+                    results.append(send(index, time.perf_counter()))
+            
+            results = [result for results in pool.map(lambda _: client(), range(concurrency)) for result in results]
+        else:
+            futures = []
+            scheduled = start
+            for index in range(num_requests):
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(pool.submit(send, index, scheduled))
+                scheduled += random.expovariate(rate)
+            results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+    
+    ok = [result for result in results if result["error"] is None]
+    latencies = [result["latency"] for result in ok]
+    processing = [result["processing_time_ms"] / 1000 for result in ok if result.get("processing_time_ms") is not None]
+    report = {
+        "mode": "boucle fermée" if rate is None else "boucle ouverte",
+        "requests": len(results),
+        "concurrency": concurrency,
+        "target_rate": rate,
+        "duration": elapsed,
+        "throughput": len(results) / elapsed,
+        "success_throughput": len(ok) / elapsed,
+        "error_rate": 1 - len(ok) / len(results) if results else 0.0,
+        "errors": dict(Counter(result["error"] for result in results if result["error"] is not None)),
+        "latency_max": max(latencies, default=None),
+        "histogram": latency_histogram(latencies),
+    }
+    for q in (50, 90, 95, 99):
+        report[f"latency_p{q}"] = percentile(latencies, q)
+        report[f"processing_p{q}"] = percentile(processing, q)
+    return report
+
+def print_load_report(report):
+    def seconds(value):
+        return "n/a" if value is None else f"{value:.3f}"
+    
+    print(f"\nTest de charge ({report['mode']}, concurrence {report['concurrency']}"
+          + (f", {report['target_rate']:.1f} req/s visées" if report["target_rate"] else "") + ")")
+    print(f"Requêtes: {report['requests']} en {report['duration']:.1f} s, "
+          f"débit {report['throughput']:.2f} req/s ({report['success_throughput']:.2f} req/s réussies)")
+    print(f"Taux d'erreur: {report['error_rate']:.1%}" + (f" {report['errors']}" if report["errors"] else ""))
+    print("Latence (s): " + ", ".join(f"p{q} {seconds(report[f'latency_p{q}'])}" for q in (50, 90, 95, 99))
+          + f", max {seconds(report['latency_max'])}")
+    print("Temps modèle (s): " + ", ".join(f"p{q} {seconds(report[f'processing_p{q}'])}" for q in (50, 90, 95, 99)))
+    
+    if report["histogram"]:
+        print("\nRépartition des latences:")
+        largest = max(count for _, count in report["histogram"])
+        for upper, count in report["histogram"]:
+            print(f"  <= {upper:8.3f} s | {'#' * math.ceil(40 * count / largest):<40} {count}")
+
 def main():
     args = parse_args()
     
@@ -89,7 +328,31 @@ def main():
         print("L'API n'est pas disponible. Assurez-vous que le serveur est en cours d'exécution.")
         return
     
-    generate_text(
+    if args.load_test:
+        prompts = load_prompts(args.prompts_file) if args.prompts_file else [{"prompt": args.prompt}]
+        if not prompts:
+            print(f"Aucun prompt trouvé dans {args.prompts_file}")
+            return
+        report = run_load_test(
+            args.api_url,
+            prompts,
+            num_requests=args.num_requests,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            timeout=args.timeout,
+            max_new_tokens=args.max_new_tokens,
+            temperature=args.temperature,
+            top_p=args.top_p,
+            top_k=args.top_k
+        )
+        print_load_report(report)
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+        return
+    
+    generate = print_stream if args.stream else generate_text
+    generate(
         args.api_url,
         args.prompt,
         max_new_tokens=args.max_new_tokens,
@@ -106,6 +369,8 @@ class MistralClient:
     
     def __init__(self, api_url="http://localhost:8000"):
         self.api_url = api_url
+        # Connexion gardée ouverte entre les appels
+        self.session = requests.Session()
         
     def is_healthy(self):
         """
@@ -123,9 +388,169 @@ class MistralClient:
             max_new_tokens=max_new_tokens,
             temperature=temperature,
             top_p=top_p,
-            top_k=top_k
+            top_k=top_k,
+            session=self.session
         )
 
+    def generate_stream(self, prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, top_k=50):
+        """
+        Génère du texte en streaming ; arrêter l'itération annule la génération côté serveur
+        """
+        return stream_text(
+            self.api_url,
+            prompt,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            session=self.session
+        )
+
+class AsyncMistralClient:
+    """
+    Client asynchrone (asyncio) pour l'API Mistral 7B Fine-tuné.
+    
+    Les connexions sont mises en commun et gardées ouvertes entre les appels ;
+    les erreurs réseau et les réponses 429/502/503/504 sont retentées avec un
+    délai exponentiel aléatoire. À utiliser avec `async with` ou à fermer avec `aclose()`.
+    """
+    
+    def __init__(self, api_url="http://localhost:8000", timeout=300.0, connect_timeout=5.0,
+                 max_retries=3, backoff=0.5, max_backoff=10.0, max_concurrency=8,
+                 max_connections=32, keepalive_expiry=60.0):
+        if httpx is None:
+            raise ImportError("Le client asynchrone nécessite httpx (pip install httpx)")
+        self.api_url = api_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = httpx.AsyncClient(
+            base_url=api_url,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry
+            )
+        )
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+    
+    async def aclose(self):
+        await self.client.aclose()
+    
+    async def is_healthy(self):
+        """
+        Vérifie si l'API est disponible et en bon état
+        """
+        try:
+            response = await self.client.get("/health", timeout=5)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+    
+    def retry_delay(self, attempt, response=None):
+        """Délai avant la tentative suivante : Retry-After du serveur, sinon exponentiel avec gigue"""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+    
+    async def send(self, method, path, **kwargs):
+        """
+        Envoie une requête avec les tentatives supplémentaires ; avec stream=True,
+        la réponse est retournée ouverte et doit être fermée par l'appelant
+        """
+        stream = kwargs.pop("stream", False)
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                request = self.client.build_request(method, path, **kwargs)
+                response = await self.client.send(request, stream=stream)
+            except httpx.TransportError:
+                if last_attempt:
+                    raise
+                await asyncio.sleep(self.retry_delay(attempt))
+                continue
+            
+            if response.status_code in RETRY_STATUS_CODES and not last_attempt:
+                await response.aclose()
+                await asyncio.sleep(self.retry_delay(attempt, response))
+                continue
+            if response.is_error:
+                await response.aread()
+                await response.aclose()
+                response.raise_for_status()
+            return response
+    
+    async def generate(self, prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, top_k=50):
+        """
+        Génère du texte à partir d'un prompt
+        """
+        payload = {
+            "prompt": prompt,
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k
+        }
+        async with self.semaphore:
+            response = await self.send("POST", "/generate", json=payload)
+        return response.json()["generated_text"]
+    
+    async def generate_many(self, prompts, return_exceptions=False, **generation_kwargs):
+        """
+        Génère les réponses de plusieurs prompts en parallèle (au plus
+        `max_concurrency` requêtes en vol) et les retourne dans l'ordre des prompts.
+        Avec `return_exceptions`, une requête en échec donne son exception au lieu
+        de faire échouer l'ensemble.
+        """
+        return await asyncio.gather(
+            *(self.generate(prompt, **generation_kwargs) for prompt in prompts),
+            return_exceptions=return_exceptions
+        )
+    
+    async def generate_stream(self, prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, top_k=50):
+        """
+        Itérateur asynchrone des morceaux de texte générés ; arrêter l'itération
+        ferme la connexion, ce qui annule la génération côté serveur
+        """
+        payload = {
+            "prompt": prompt,
+            "max_new_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k
+        }
+        async with self.semaphore:
+            # Les tentatives ne portent que sur l'ouverture du flux, pas sur un flux déjà commencé
+            response = await self.send("POST", "/generate_stream", json=payload, stream=True)
+            try:
+                event = None
+                async for line in response.aiter_lines():
+                    if not line:
+                        event = None
+                        continue
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                        continue
+                    if not line.startswith("data:"):
+                        continue
+                    
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+                    if event == "error":
+                        raise RuntimeError(f"Erreur lors de la génération: {json.loads(data)['detail']}")
+                    yield json.loads(data)["text"]
+            finally:
+                await response.aclose()
+
 # Exemple d'utilisation de la classe client dans votre application
 def example_usage():
     """
@@ -160,9 +585,41 @@ def example_usage():
         print("Le sentiment est positif!")
     else:
         print("Le sentiment n'est pas positif.")
+    
+    # Streaming : s'arrêter dès que l'information recherchée est disponible
+    routed = ""
+    for text in client.generate_stream("kel devis son en aten?"):
+        routed += text
+        if "querybuilder" in routed or "elasticsearch" in routed or "workflow_agent" in routed:
+            break
+
+async def example_async_usage():
+    """
+    Exemple d'utilisation du client asynchrone, par exemple dans un orchestrateur
+    qui interroge le routeur pour chaque message utilisateur
+    """
+    async with AsyncMistralClient(api_url="http://localhost:8000", max_concurrency=8) as client:
+        if not await client.is_healthy():
+            print("L'API n'est pas disponible.")
+            return
+        
+        # Une requête, sur une connexion réutilisée aux appels suivants
+        response = await client.generate("kel devis son en aten?", temperature=0.1)
+        
+        # Plusieurs requêtes en parallèle, résultats dans l'ordre des prompts
+        responses = await client.generate_many(
+            ["kel client a le plus de projet?", "trouve moi les documents techniques pour isolation thermique"],
+            return_exceptions=True,
+            temperature=0.1
+        )
+        
+        # Streaming
+        async for text in client.generate_stream("je ve un devis pour refaire la toiture"):
+            print(text, end="", flush=True)
 
 if __name__ == "__main__":
     main()
     
     # Décommentez la ligne suivante pour voir l'exemple d'utilisation
-    # example_usage() 
\ No newline at end of file
+    # example_usage()
+    # asyncio.run(example_async_usage()) 
\ No newline at end of file
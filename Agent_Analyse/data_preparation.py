@@ -3,125 +3,196 @@
 
 """
 Script pour préparer les données d'entraînement pour le fine-tuning de Mistral 7B Instruct.
+
+Les fichiers JSONL au format conversationnel ({"messages": [...]}, une
+conversation par ligne) sont lus en flux. Chaque exemple est affecté au jeu
+d'entraînement ou de test selon une empreinte stable de son texte : le
+découpage est reproductible, un nouvel exemple ne déplace pas les anciens et
+les doublons tombent toujours du même côté. Les datasets Arrow produits sont
+lus par train.py avec `load_from_disk`.
 """
 
 import os
 import json
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from datasets import Dataset
+import hashlib
 import argparse
+from datasets import Dataset, Features, Value
+
+FEATURES = Features({"text": Value("string"), "prompt": Value("string"), "completion": Value("string")})
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Préparation des données pour le fine-tuning")
-    parser.add_argument("--data_dir", type=str, default="./data", 
+    parser.add_argument("--data_dir", type=str, default="./data",
                         help="Répertoire contenant les données brutes")
-    parser.add_argument("--output_dir", type=str, default="./data/processed", 
+    parser.add_argument("--output_dir", type=str, default="./data/processed",
                         help="Répertoire où sauvegarder les données traitées")
-    parser.add_argument("--test_size", type=float, default=0.1, 
+    parser.add_argument("--test_size", type=float, default=0.1,
                         help="Proportion de données pour le test (0.1 = 10%)")
+    parser.add_argument("--seed", type=str, default="42",
+                        help="Sel de l'empreinte utilisée pour le découpage train/test")
     return parser.parse_args()
 
-def convert_to_mistral_format(examples):
+def list_data_files(data_dir):
+    """Fichiers de données du répertoire : JSONL conversationnels et anciens fichiers JSON"""
+    return sorted(
+        os.path.join(data_dir, f) for f in os.listdir(data_dir)
+        if f.endswith('.jsonl') or f.endswith('.json')
+    )
+
+def iter_examples(file_paths):
+    """
+    Parcourt les exemples des fichiers sans les charger entièrement en mémoire.
+    Les fichiers .json (liste d'objets instruction/input/output) restent acceptés.
+    """
+    for file_path in file_paths:
+        if file_path.endswith('.json'):
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    file_data = json.load(f)
+            except Exception as e:
+                print(f"Erreur lors du chargement de {file_path}: {e}")
+                continue
+            yield from (file_data if isinstance(file_data, list) else [file_data])
+            continue
+
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    print(f"{file_path}:{line_number}: erreur de parsing ({e})")
+
+def to_messages(example):
+    """Ramène un exemple au format conversationnel"""
+    if isinstance(example.get("messages"), list):
+        return example["messages"]
+
+    # Ancien format instruction/input/output
+    instruction = example.get("instruction", "")
+    input_text = example.get("input", "")
+    prompt = f"{instruction}\n\n{input_text}" if input_text else instruction
+    return [
+        {"role": "user", "content": prompt},
+        {"role": "assistant", "content": example.get("output", "")}
+    ]
+
+def convert_to_mistral_format(example):
+    """
+    Convertit une conversation au format attendu par Mistral 7B Instruct
+    Format: <s>[INST] Question [/INST] Réponse</s>[INST] Question [/INST] Réponse</s>
+    Le system prompt est placé en tête du premier message utilisateur.
+    Retourne None si la conversation n'a pas de réponse de l'assistant.
+    """
+    system = ""
+    text = "<s>"
+    prompt = ""
+    completion = ""
+    pending_user = None
+
+    for msg in to_messages(example):
+        if not isinstance(msg, dict):
+            continue
+        role = msg.get("role")
+        content = str(msg.get("content", "")).strip()
+        if role == "system":
+            system = content
+        elif role == "user":
+            pending_user = f"{system}\n\n{content}" if system else content
+            system = ""
+        elif role == "assistant" and pending_user is not None and content:
+            # Le prompt et la réponse du dernier tour servent à l'évaluation
+            prompt = pending_user
+            completion = content
+            text += f"[INST] {pending_user} [/INST] {content}</s>"
+            pending_user = None
+
+    if not completion:
+        return None
+    return {"text": text, "prompt": prompt, "completion": completion}
+
+def in_test_split(text, test_size, seed):
+    """Affectation stable au jeu de test, d'après l'empreinte du texte de l'exemple"""
+    digest = hashlib.sha1(f"{seed}:{text}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 < test_size
+
+def generate_split(file_paths, file_stats, test_size, seed, test):
     """
-    Convertit les exemples au format attendu par Mistral 7B Instruct
-    Format: <s>[INST] Instruction ou question [/INST] Réponse attendue </s>
+    Générateur des exemples d'un des deux jeux. `file_stats` n'est utilisé que
+    par l'empreinte du cache de `datasets` : le dataset est régénéré dès qu'un
+    fichier change.
     """
-    formatted_examples = []
-    
-    for example in examples:
-        # Si vos données ont un format différent, adaptez ce code
-        instruction = example.get("instruction", "")
-        input_text = example.get("input", "")
-        output = example.get("output", "")
-        
-        # Combiner instruction et input si les deux sont présents
-        if input_text:
-            prompt = f"{instruction}\n\n{input_text}"
-        else:
-            prompt = instruction
-            
-        # Formater au format Mistral 7B Instruct
-        formatted_text = f"<s>[INST] {prompt} [/INST] {output} </s>"
-        
-        formatted_examples.append({
-            "text": formatted_text,
-            "prompt": prompt,
-            "completion": output
-        })
-    
-    return formatted_examples
+    for example in iter_examples(file_paths):
+        if not isinstance(example, dict):
+            continue
+        formatted = convert_to_mistral_format(example)
+        if formatted and in_test_split(formatted["text"], test_size, seed) == test:
+            yield formatted
+
+def build_split(file_paths, test_size, seed, test):
+    file_stats = [(path, os.path.getsize(path), os.path.getmtime(path)) for path in file_paths]
+    try:
+        return Dataset.from_generator(
+            generate_split,
+            features=FEATURES,
+            gen_kwargs={
+                "file_paths": file_paths,
+                "file_stats": file_stats,
+                "test_size": test_size,
+                "seed": seed,
+                "test": test,
+            },
+        )
+    except ValueError:
+        # Aucun exemple dans ce jeu (données vides ou test_size à 0)
+        return Dataset.from_dict({name: [] for name in FEATURES}, features=FEATURES)
 
 def main():
     args = parse_args()
-    
+
     # Créer le répertoire de sortie s'il n'existe pas
     os.makedirs(args.output_dir, exist_ok=True)
-    
+
     print(f"Chargement des données depuis {args.data_dir}...")
-    
-    # Charger les données brutes (à adapter selon votre format)
-    # Exemple avec des fichiers JSON
-    data = []
-    data_files = [f for f in os.listdir(args.data_dir) if f.endswith('.json')]
-    
+
+    data_files = list_data_files(args.data_dir)
+
     if not data_files:
-        print(f"Aucun fichier JSON trouvé dans {args.data_dir}. Veuillez y placer vos données.")
-        print("Format attendu: liste d'objets JSON avec des champs 'instruction', 'input' (optionnel) et 'output'")
+        print(f"Aucun fichier JSONL trouvé dans {args.data_dir}. Veuillez y placer vos données.")
+        print("Format attendu: une conversation par ligne, {\"messages\": [{\"role\": \"user\", \"content\": ...}, {\"role\": \"assistant\", \"content\": ...}]}")
         # Créer un exemple de fichier
-        example = [
-            {
-                "instruction": "Explique le concept de l'intelligence artificielle en termes simples.",
-                "input": "", 
-                "output": "L'intelligence artificielle est un domaine de l'informatique qui vise à créer des machines capables de simuler l'intelligence humaine. Cela inclut l'apprentissage, le raisonnement et l'auto-correction. En termes simples, c'est la création d'ordinateurs qui peuvent penser et apprendre comme les humains."
-            }
-        ]
-        with open(os.path.join(args.data_dir, "example.json"), "w", encoding="utf-8") as f:
-            json.dump(example, f, ensure_ascii=False, indent=2)
-        print(f"Un fichier d'exemple a été créé: {os.path.join(args.data_dir, 'example.json')}")
+        example = {
+            "messages": [
+                {"role": "user", "content": "Explique le concept de l'intelligence artificielle en termes simples."},
+                {"role": "assistant", "content": "L'intelligence artificielle est un domaine de l'informatique qui vise à créer des machines capables de simuler l'intelligence humaine. Cela inclut l'apprentissage, le raisonnement et l'auto-correction. En termes simples, c'est la création d'ordinateurs qui peuvent penser et apprendre comme les humains."}
+            ]
+        }
+        with open(os.path.join(args.data_dir, "example.jsonl"), "w", encoding="utf-8") as f:
+            f.write(json.dumps(example, ensure_ascii=False) + "\n")
+        print(f"Un fichier d'exemple a été créé: {os.path.join(args.data_dir, 'example.jsonl')}")
         return
-        
-    for file in data_files:
-        file_path = os.path.join(args.data_dir, file)
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                file_data = json.load(f)
-                if isinstance(file_data, list):
-                    data.extend(file_data)
-                else:
-                    data.append(file_data)
-        except Exception as e:
-            print(f"Erreur lors du chargement de {file_path}: {e}")
-    
-    if not data:
+
+    print(f"Fichiers trouvés: {', '.join(os.path.basename(path) for path in data_files)}")
+
+    # Construire les deux jeux en flux, sans copie intermédiaire en mémoire
+    train_dataset = build_split(data_files, args.test_size, args.seed, test=False)
+    test_dataset = build_split(data_files, args.test_size, args.seed, test=True)
+
+    if len(train_dataset) + len(test_dataset) == 0:
         print("Aucune donnée n'a pu être chargée. Vérifiez le format de vos fichiers.")
         return
-        
-    print(f"Nombre d'exemples chargés: {len(data)}")
-    
-    # Convertir au format attendu par Mistral
-    formatted_data = convert_to_mistral_format(data)
-    
-    # Créer un DataFrame pour une manipulation plus facile
-    df = pd.DataFrame(formatted_data)
-    
-    # Diviser en ensembles d'entraînement et de test
-    train_df, test_df = train_test_split(df, test_size=args.test_size, random_state=42)
-    
-    print(f"Ensemble d'entraînement: {len(train_df)} exemples")
-    print(f"Ensemble de test: {len(test_df)} exemples")
-    
-    # Convertir en format datasets de Hugging Face
-    train_dataset = Dataset.from_pandas(train_df)
-    test_dataset = Dataset.from_pandas(test_df)
-    
+
+    print(f"Ensemble d'entraînement: {len(train_dataset)} exemples")
+    print(f"Ensemble de test: {len(test_dataset)} exemples")
+
     # Sauvegarder les datasets
     train_dataset.save_to_disk(os.path.join(args.output_dir, "train"))
     test_dataset.save_to_disk(os.path.join(args.output_dir, "test"))
-    
+
     print(f"Données traitées sauvegardées dans {args.output_dir}")
     print("Exemple de format de données:")
-    print(df["text"].iloc[0])
+    print((train_dataset if len(train_dataset) else test_dataset)[0]["text"])
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -8,14 +8,31 @@ Script pour déployer le modèle Mistral 7B Instruct fine-tuné sur un endpoint
 import os
 import torch
 import argparse
+import asyncio
+import threading
 import uvicorn
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from typing import List, Optional, Union
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    BitsAndBytesConfig,
+    StoppingCriteriaList,
+    TextIteratorStreamer
+)
 from peft import PeftModel
+import json
 import logging
 
+# File d'inférence, génération par lots et arrêt des flux partagés avec les API
+# de python/ (paquet analyse-agent-common, installé par requirements.txt)
+from batch_generation import generate_isolated, group_by_params, padded_generate
+from inference_executor import InferenceExecutor, QueueFullError
+from streaming import CancelledCriteria
+
 # Configuration du logging
 logging.basicConfig(
     level=logging.INFO,
@@ -39,18 +56,50 @@ class GenerationResponse(BaseModel):
     generated_text: str
     processing_time_ms: float
 
+class BatchItem(BaseModel):
+    """Prompt d'un lot ; les paramètres absents sont ceux du lot"""
+    prompt: str
+    max_new_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    top_k: Optional[int] = None
+
+class BatchGenerationRequest(BaseModel):
+    prompts: List[Union[str, BatchItem]]
+    # Paramètres partagés par les prompts du lot (valeurs de GenerationRequest si absents)
+    max_new_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    top_k: Optional[int] = None
+
+class BatchResult(BaseModel):
+    generated_text: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchGenerationResponse(BaseModel):
+    results: List[BatchResult]
+    processing_time_ms: float
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Déploiement du modèle Mistral 7B Instruct fine-tuné")
     parser.add_argument("--base_model", type=str, default="mistralai/Mistral-7B-Instruct-v0.2",
                       help="Modèle de base utilisé pour le fine-tuning")
     parser.add_argument("--adapter_path", type=str, default="./output/final",
                       help="Chemin vers le modèle fine-tuné (adaptateur LoRA)")
+    parser.add_argument("--merged_model", type=str, default=None,
+                      help="Modèle dont l'adaptateur est déjà fusionné (safetensors), remplace --base_model/--adapter_path")
     parser.add_argument("--use_4bit", action="store_true",
                       help="Utiliser la quantification 4-bit pour l'inférence")
     parser.add_argument("--port", type=int, default=8000,
                       help="Port sur lequel déployer l'API")
     parser.add_argument("--host", type=str, default="0.0.0.0",
                       help="Host sur lequel déployer l'API")
+    parser.add_argument("--max_queue_size", type=int, default=32,
+                      help="Nombre maximum de requêtes en attente de génération")
+    parser.add_argument("--max_batch_size", type=int, default=8,
+                      help="Nombre de prompts générés ensemble par /generate_batch")
+    parser.add_argument("--max_batch_prompts", type=int, default=1024,
+                      help="Nombre maximum de prompts par requête /generate_batch")
     return parser.parse_args()
 
 def format_prompt(prompt):
@@ -59,7 +108,8 @@ def format_prompt(prompt):
     """
     return f"<s>[INST] {prompt} [/INST]"
 
-def generate_response(prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, top_k=50):
+def generate_response(prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, top_k=50,
+                      streamer=None, stopping_criteria=None):
     """
     Generate a response from the model given a prompt
     """
@@ -82,7 +132,9 @@ def generate_response(prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, to
             top_p=top_p,
             top_k=top_k,
             do_sample=True,
-            pad_token_id=TOKENIZER.eos_token_id
+            pad_token_id=TOKENIZER.eos_token_id,
+            streamer=streamer,
+            stopping_criteria=stopping_criteria
         )
     
     # Decode the response, skip the prompt
@@ -91,12 +143,49 @@ def generate_response(prompt, max_new_tokens=512, temperature=0.7, top_p=0.9, to
     
     return response
 
+def generate_batch_responses(params, prompts):
+    """
+    Generate the responses of several prompts sharing the same generation
+    parameters (max_new_tokens, temperature, top_p, top_k) in one padded batch
+    """
+    if MODEL is None or TOKENIZER is None:
+        raise ValueError("Le modèle et le tokenizer n'ont pas été chargés")
+    
+    max_new_tokens, temperature, top_p, top_k = params
+    generated = padded_generate(
+        MODEL,
+        TOKENIZER,
+        [format_prompt(prompt) for prompt in prompts],
+        max_new_tokens=max_new_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        top_k=top_k,
+        do_sample=True
+    )
+    return [response.strip() for response in TOKENIZER.batch_decode(generated, skip_special_tokens=True)]
+
 def load_model(args):
     """
     Load the fine-tuned model
     """
     global MODEL, TOKENIZER
     
+    # Modèle déjà fusionné avec son adaptateur : chargement direct des shards safetensors
+    if args.merged_model:
+        logger.info(f"Chargement du modèle fusionné: {args.merged_model}")
+        MODEL = AutoModelForCausalLM.from_pretrained(
+            args.merged_model,
+            device_map="auto",
+            torch_dtype="auto",
+            use_safetensors=True,
+            low_cpu_mem_usage=True,
+            trust_remote_code=True
+        )
+        TOKENIZER = AutoTokenizer.from_pretrained(args.merged_model)
+        MODEL.eval()
+        logger.info("Modèle chargé avec succès!")
+        return
+    
     logger.info(f"Chargement du modèle de base: {args.base_model}")
     
     # Configuration de quantification si nécessaire
@@ -142,10 +231,12 @@ def load_model(args):
     
     logger.info("Modèle chargé avec succès!")
 
-def create_app():
+def create_app(max_queue_size=32, max_batch_size=8, max_batch_prompts=1024):
     """
     Create the FastAPI app
     """
+    inference_queue = InferenceExecutor(max_queue_size=max_queue_size)
+    
     app = FastAPI(
         title="API Mistral 7B Fine-tuné",
         description="API pour le modèle Mistral 7B Instruct fine-tuné",
@@ -172,7 +263,8 @@ def create_app():
         try:
             start_time = time.time()
             
-            response = generate_response(
+            response = await inference_queue.run(
+                generate_response,
                 request.prompt,
                 max_new_tokens=request.max_new_tokens,
                 temperature=request.temperature,
@@ -186,15 +278,119 @@ def create_app():
                 generated_text=response,
                 processing_time_ms=processing_time
             )
+        except QueueFullError as e:
+            logger.warning(str(e))
+            raise HTTPException(status_code=503, detail=str(e))
         except Exception as e:
             logger.error(f"Erreur lors de la génération: {e}")
             raise HTTPException(status_code=500, detail=str(e))
     
+    @app.post("/generate_batch", response_model=BatchGenerationResponse)
+    async def generate_batch(request: BatchGenerationRequest):
+        """
+        Generate the responses of a list of prompts, in order. Prompts with the
+        same generation parameters are generated together in padded batches;
+        an error on one prompt is reported in its result only.
+        """
+        import time
+        
+        if len(request.prompts) > max_batch_prompts:
+            raise HTTPException(status_code=413, detail=f"Trop de prompts dans le lot (maximum {max_batch_prompts})")
+        
+        start_time = time.time()
+        defaults = GenerationRequest(prompt="").model_dump(exclude={"prompt"})
+        shared = {**defaults, **request.model_dump(exclude={"prompts"}, exclude_none=True)}
+        items = [
+            {**shared, "prompt": item} if isinstance(item, str)
+            else {**shared, **item.model_dump(exclude_none=True)}
+            for item in request.prompts
+        ]
+        
+        # Regrouper les prompts par paramètres de génération, en sous-batches de max_batch_size
+        sub_batches = group_by_params(
+            items, lambda item: (item["max_new_tokens"], item["temperature"], item["top_p"], item["top_k"]), max_batch_size
+        )
+        
+        results = [None] * len(items)
+        for params, chunk in sub_batches:
+            # Un passage dans la file par sous-batch : les autres requêtes passent entre deux
+            try:
+                outcomes = await inference_queue.run(
+                    generate_isolated, generate_batch_responses, params, [items[index]["prompt"] for index in chunk]
+                )
+            except QueueFullError as e:
+                outcomes = [(None, str(e))] * len(chunk)
+            for index, (text, error) in zip(chunk, outcomes):
+                if error is not None:
+                    logger.warning(f"Erreur sur le prompt {index} du lot: {error}")
+                results[index] = BatchResult(generated_text=text, error=error)
+        
+        return BatchGenerationResponse(
+            results=results,
+            processing_time_ms=(time.time() - start_time) * 1000
+        )
+    
+    @app.post("/generate_stream")
+    async def generate_stream(request: GenerationRequest):
+        """
+        Stream the generated text token by token (Server-Sent Events)
+        """
+        if MODEL is None or TOKENIZER is None:
+            raise HTTPException(status_code=503, detail="Le modèle n'est pas chargé")
+        
+        cancelled = threading.Event()
+        streamer = TextIteratorStreamer(TOKENIZER, skip_prompt=True, skip_special_tokens=True)
+        
+        def run_generation():
+            try:
+                generate_response(
+                    request.prompt,
+                    max_new_tokens=request.max_new_tokens,
+                    temperature=request.temperature,
+                    top_p=request.top_p,
+                    top_k=request.top_k,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([CancelledCriteria(cancelled)])
+                )
+            except Exception:
+                streamer.end()
+                raise
+        
+        try:
+            future = inference_queue.submit(run_generation)
+        except QueueFullError as e:
+            logger.warning(str(e))
+            raise HTTPException(status_code=503, detail=str(e))
+        
+        async def events():
+            stop = object()
+            started = False
+            try:
+                while True:
+                    text = await asyncio.to_thread(next, streamer, stop)
+                    if text is stop:
+                        break
+                    # Supprimer les espaces en tête de réponse, comme pour /generate
+                    if not started:
+                        text = text.lstrip()
+                        started = bool(text)
+                    if text:
+                        yield f"data: {json.dumps({'text': text}, ensure_ascii=False)}\n\n"
+                await asyncio.wrap_future(future)
+                yield "data: [DONE]\n\n"
+            except Exception as e:
+                logger.error(f"Erreur lors de la génération en streaming: {e}")
+                yield f"event: error\ndata: {json.dumps({'detail': str(e)}, ensure_ascii=False)}\n\n"
+            finally:
+                cancelled.set()
+        
+        return StreamingResponse(events(), media_type="text/event-stream")
+    
     @app.get("/health")
     async def health_check():
         if MODEL is None or TOKENIZER is None:
             raise HTTPException(status_code=503, detail="Le modèle n'est pas chargé")
-        return {"status": "healthy"}
+        return {"status": "healthy", **inference_queue.stats()}
     
     return app
 
@@ -205,7 +401,11 @@ def main():
     load_model(args)
     
     # Créer l'application FastAPI
-    app = create_app()
+    app = create_app(
+        max_queue_size=args.max_queue_size,
+        max_batch_size=args.max_batch_size,
+        max_batch_prompts=args.max_batch_prompts
+    )
     
     # Lancer le serveur
     logger.info(f"Démarrage du serveur sur {args.host}:{args.port}")
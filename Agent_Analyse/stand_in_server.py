@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Serveur de substitution de l'API de deploy.py, sans modèle.
+
+Il expose les mêmes endpoints (/generate, /generate_stream, /health), avec les
+mêmes schémas et la même file d'inférence à un seul thread que deploy.py, mais
+la génération est simulée par une attente : temps jusqu'au premier token puis
+un délai fixe par token. Il permet de tester le client de charge
+(api_client.py --load_test) et les changements côté service sans GPU.
+"""
+
+import json
+import time
+import asyncio
+import argparse
+import logging
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+
+from deploy import GenerationRequest, GenerationResponse
+from inference_executor import InferenceExecutor, QueueFullError
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+RESPONSE = ("Vous souhaitez connaître la liste des devis actuellement en attente ?\n\n"
+            "Intention identifiée : Gestion administrative - Suivi des devis\n\n"
+            "Agent à utiliser : querybuilder\n\n"
+            "Type de requête : \nSELECT q.id, q.reference, q.created_date, q.total FROM quotations q "
+            "WHERE q.status = 'en_attente' ORDER BY q.created_date DESC")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serveur de substitution de l'API, génération simulée")
+    parser.add_argument("--port", type=int, default=8000,
+                      help="Port sur lequel déployer l'API")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                      help="Host sur lequel déployer l'API")
+    parser.add_argument("--max_queue_size", type=int, default=32,
+                      help="Nombre maximum de requêtes en attente de génération")
+    parser.add_argument("--ttft_ms", type=float, default=50,
+                      help="Temps simulé jusqu'au premier token (prefill), en ms")
+    parser.add_argument("--token_ms", type=float, default=20,
+                      help="Temps simulé par token généré, en ms")
+    parser.add_argument("--response_tokens", type=int, default=64,
+                      help="Nombre de tokens de la réponse simulée (borné par max_new_tokens)")
+    return parser.parse_args()
+
+def simulated_tokens(request, response_tokens):
+    """Morceaux de la réponse simulée, un par token"""
+    words = RESPONSE.split(" ")
+    count = max(1, min(request.max_new_tokens, response_tokens))
+    return [words[i % len(words)] + " " for i in range(count)]
+
+def create_app(ttft_ms=50, token_ms=20, response_tokens=64, max_queue_size=32):
+    """
+    Create the FastAPI app
+    """
+    inference_queue = InferenceExecutor(max_queue_size=max_queue_size)
+    app = FastAPI(title="API de substitution", version="1.0.0")
+
+    def generate_response(request, on_token=None):
+        # Occupe le thread d'inférence comme le ferait MODEL.generate
+        tokens = simulated_tokens(request, response_tokens)
+        time.sleep(ttft_ms / 1000)
+        for token in tokens:
+            if on_token is not None and not on_token(token):
+                break
+            time.sleep(token_ms / 1000)
+        return "".join(tokens).strip()
+
+    @app.get("/")
+    async def root():
+        return {"message": "API de substitution (génération simulée)", "status": "active"}
+
+    @app.post("/generate", response_model=GenerationResponse)
+    async def generate(request: GenerationRequest):
+        start_time = time.time()
+        try:
+            response = await inference_queue.run(generate_response, request)
+        except QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        return GenerationResponse(
+            generated_text=response,
+            processing_time_ms=(time.time() - start_time) * 1000
+        )
+
+    @app.post("/generate_stream")
+    async def generate_stream(request: GenerationRequest):
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+        cancelled = False
+
+        def on_token(token):
+            loop.call_soon_threadsafe(tokens.put_nowait, token)
+            return not cancelled
+
+        try:
+            future = inference_queue.submit(generate_response, request, on_token)
+        except QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(tokens.put_nowait, None))
+
+        async def events():
+            nonlocal cancelled
+            try:
+                while (token := await tokens.get()) is not None:
+                    yield f"data: {json.dumps({'text': token}, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                cancelled = True
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/health")
+    async def health_check():
+        return {"status": "healthy", **inference_queue.stats()}
+
+    return app
+
+def main():
+    args = parse_args()
+    app = create_app(args.ttft_ms, args.token_ms, args.response_tokens, args.max_queue_size)
+    logger.info(f"Démarrage du serveur de substitution sur {args.host}:{args.port}")
+    uvicorn.run(app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,9 @@ from transformers import (
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 from trl import SFTTrainer
 
+# Mesure du débit partagée avec le fine-tuning de python/ (paquet analyse-agent-common)
+from training_metrics import ThroughputCallback
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Fine-tuning de Mistral 7B Instruct avec LoRA/QLoRA")
     parser.add_argument("--base_model", type=str, default="mistralai/Mistral-7B-Instruct-v0.2",
@@ -150,6 +153,9 @@ def main():
         packing=True,
     )
     
+    # Mesurer le débit (tokens réels/avec padding), le temps par phase et le pic mémoire
+    ThroughputCallback.attach(trainer, output_file=os.path.join(args.output_dir, "logs", "throughput.jsonl"))
+    
     # Lancer l'entraînement
     print("Début de l'entraînement...")
     trainer.train()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Génération par batches complétés à gauche, pour les endpoints /generate_batch.
+
+Les prompts d'une requête sont regroupés par paramètres de génération puis
+générés par sous-batches. Quand un sous-batch échoue, ses prompts sont
+régénérés un par un : l'erreur ne touche que les prompts fautifs.
+"""
+
+import torch
+
+
+def group_by_params(items, key, batch_size):
+    """(paramètres, indices) des éléments regroupés par `key(item)`, en sous-batches de `batch_size` au plus"""
+    groups = {}
+    for index, item in enumerate(items):
+        groups.setdefault(key(item), []).append(index)
+    for params, indices in groups.items():
+        for start in range(0, len(indices), batch_size):
+            yield params, indices[start:start + batch_size]
+
+
+def padded_generate(model, tokenizer, prompts, max_lengths=None, max_new_tokens=None, **generation_kwargs):
+    """
+    Générer un batch de prompts formatés, complétés à gauche pour que la
+    génération reprenne à la même position pour tous. `max_lengths` donne la
+    longueur maximale (prompt compris) de chaque prompt : le batch génère
+    jusqu'à la plus grande et chaque sortie est tronquée à sa propre limite.
+    Sans `max_lengths`, chaque prompt génère `max_new_tokens` tokens au plus.
+    Retourne les tokens générés de chaque prompt.
+
+    Le padding est fait ici plutôt que par le tokenizer, partagé avec les
+    autres requêtes : ni son pad_token ni son padding_side ne sont modifiés.
+    """
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    encoded = tokenizer(prompts).input_ids
+    width = max(len(ids) for ids in encoded)
+    input_ids = torch.tensor([[pad_token_id] * (width - len(ids)) + ids for ids in encoded], device=model.device)
+    attention_mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids in encoded], device=model.device)
+
+    if max_lengths is None:
+        budgets = [max_new_tokens] * len(prompts)
+    else:
+        budgets = [max(max_length - len(ids), 1) for max_length, ids in zip(max_lengths, encoded)]
+
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=max(budgets),
+            pad_token_id=pad_token_id,
+            **generation_kwargs
+        )
+
+    generated = outputs[:, width:]
+    return [row[:budget].tolist() for row, budget in zip(generated, budgets)]
+
+
+def generate_isolated(generate_group, params, items):
+    """
+    Appeler `generate_group(params, items)` (une réponse par élément) et
+    retourner (réponse, None) ou (None, message d'erreur) pour chaque élément.
+    """
+    try:
+        return [(response, None) for response in generate_group(params, items)]
+    except Exception as e:
+        if len(items) == 1:
+            return [(None, str(e))]
+
+    results = []
+    for item in items:
+        try:
+            results.append((generate_group(params, [item])[0], None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Ordonnanceur à batching continu pour la génération de texte.
+
+Les requêtes concurrentes sont regroupées dans une boucle de décodage
+partagée : les nouvelles séquences sont admises entre deux étapes de
+décodage et les séquences terminées sont retirées immédiatement, sans
+attendre la plus longue du batch.
+"""
+
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+import torch
+
+from kv_cache import from_legacy_cache, to_legacy_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _left_pad(tensor, length, dim, value=0):
+    """Compléter un tenseur à gauche sur la dimension `dim` jusqu'à `length`"""
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    pad_shape = list(tensor.shape)
+    pad_shape[dim] = missing
+    padding = tensor.new_full(pad_shape, value)
+    return torch.cat([padding, tensor], dim=dim)
+
+
+class GenerationSequence:
+    """État d'une requête en cours de génération"""
+
+    def __init__(self, request_id, input_ids, max_new_tokens=256, temperature=0.7,
+                 do_sample=True, top_p=0.95, top_k=50, repetition_penalty=1.0,
+                 min_new_tokens=0, no_repeat_ngram_size=0, eos_token_id=None, token_callback=None,
+                 prefix_length=0, adapter_name=None):
+        self.request_id = request_id
+        self.input_ids = list(input_ids)
+        self.prefix_length = prefix_length
+        self.adapter_name = adapter_name
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.do_sample = do_sample and temperature > 0
+        self.top_p = top_p
+        self.top_k = top_k
+        self.repetition_penalty = repetition_penalty
+        self.min_new_tokens = min_new_tokens
+        self.no_repeat_ngram_size = no_repeat_ngram_size
+        self.eos_token_id = eos_token_id
+        self.token_callback = token_callback
+        self.generated_ids = []
+        self.stopped = False
+        self.future = Future()
+
+    @property
+    def is_finished(self):
+        if self.stopped or len(self.generated_ids) >= self.max_new_tokens:
+            return True
+        return bool(self.generated_ids) and self.generated_ids[-1] == self.eos_token_id
+
+    def next_token(self, logits):
+        """Choisir le prochain token à partir des logits de la dernière position"""
+        logits = logits.float()
+
+        if self.repetition_penalty != 1.0:
+            seen = torch.tensor(self.input_ids + self.generated_ids, device=logits.device).unique()
+            scores = logits[seen]
+            logits[seen] = torch.where(scores < 0, scores * self.repetition_penalty, scores / self.repetition_penalty)
+
+        if self.eos_token_id is not None and len(self.generated_ids) < self.min_new_tokens:
+            logits[self.eos_token_id] = -float("inf")
+
+        banned = self._banned_ngram_tokens()
+        if banned:
+            logits[banned] = -float("inf")
+
+        if not self.do_sample:
+            return int(torch.argmax(logits))
+
+        logits = logits / self.temperature
+
+        if self.top_k and self.top_k > 0:
+            top_k = min(self.top_k, logits.shape[-1])
+            threshold = torch.topk(logits, top_k).values[-1]
+            logits[logits < threshold] = -float("inf")
+
+        if self.top_p is not None and self.top_p < 1.0:
+            sorted_logits, sorted_indices = torch.sort(logits, descending=True)
+            cumulative = torch.softmax(sorted_logits, dim=-1).cumsum(dim=-1)
+            # Garder au moins le token le plus probable
+            to_remove = cumulative - torch.softmax(sorted_logits, dim=-1) > self.top_p
+            logits[sorted_indices[to_remove]] = -float("inf")
+
+        probs = torch.softmax(logits, dim=-1)
+        return int(torch.multinomial(probs, num_samples=1))
+
+    def append_token(self, token):
+        """Enregistrer un token généré et le transmettre au callback de streaming"""
+        self.generated_ids.append(token)
+        if self.token_callback is not None and token != self.eos_token_id:
+            # Le callback retourne False pour interrompre la génération (client déconnecté)
+            if self.token_callback(token) is False:
+                self.stopped = True
+
+    def _banned_ngram_tokens(self):
+        """Tokens qui répéteraient un n-gramme déjà présent (équivalent de no_repeat_ngram_size)"""
+        n = self.no_repeat_ngram_size
+        tokens = self.input_ids + self.generated_ids
+        if not n or len(tokens) < n:
+            return []
+        prefix = tokens[len(tokens) - n + 1:]
+        return [
+            tokens[i + n - 1]
+            for i in range(len(tokens) - n + 1)
+            if tokens[i:i + n - 1] == prefix
+        ]
+
+
+class ContinuousBatchScheduler:
+    """
+    Boucle de décodage partagée entre toutes les requêtes en vol.
+
+    Chaque nouvelle requête est pré-remplie (prefill) seule, puis son cache KV
+    est fusionné, avec un padding à gauche, dans le cache du batch actif.
+    Les séquences terminées sont retirées après chaque étape de décodage.
+
+    Si un `PrefixCache` est fourni, les `prefix_length` premiers tokens d'une
+    requête (le system prompt) sont repris du cache au lieu d'être ré-encodés.
+
+    Avec un PeftModel portant plusieurs adaptateurs LoRA, chaque séquence peut
+    indiquer son `adapter_name` : les séquences de différents adaptateurs
+    partagent la même étape de décodage (paramètre `adapter_names` de PEFT).
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=16, prefix_cache=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = prefix_cache
+        self.eos_token_id = tokenizer.eos_token_id
+
+        self._waiting = queue.Queue()
+        self._commands = queue.Queue()
+        self._ids = itertools.count()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+        # État du batch actif
+        self._active = []
+        self._cache = None
+        self._attention_mask = None
+        self._positions = None
+        self._last_tokens = None
+
+    @property
+    def device(self):
+        return self.model.device
+
+    @property
+    def active_count(self):
+        return len(self._active)
+
+    @property
+    def waiting_count(self):
+        return self._waiting.qsize()
+
+    def start(self):
+        """Démarrer le thread de décodage"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="continuous-batching", daemon=True)
+        self._thread.start()
+        logger.info(f"Ordonnanceur de batching continu démarré (batch max: {self.max_batch_size})")
+
+    def stop(self):
+        """Arrêter le thread de décodage et annuler les requêtes restantes"""
+        self._stop_event.set()
+        self._waiting.put(None)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, input_ids, token_callback=None, **generation_kwargs):
+        """
+        Ajouter une requête à la file d'attente et retourner un Future des tokens générés.
+
+        `token_callback`, s'il est fourni, est appelé depuis le thread de décodage
+        pour chaque nouveau token ; il peut retourner False pour arrêter la génération.
+        """
+        sequence = GenerationSequence(
+            next(self._ids),
+            input_ids,
+            eos_token_id=self.eos_token_id,
+            token_callback=token_callback,
+            **generation_kwargs
+        )
+        self._waiting.put(sequence)
+        return sequence.future
+
+    def generate(self, input_ids, **generation_kwargs):
+        """Version bloquante de `submit`"""
+        return self.submit(input_ids, **generation_kwargs).result()
+
+    def run_exclusive(self, fn, *args, **kwargs):
+        """
+        Exécuter `fn` dans le thread de décodage, entre deux étapes, par exemple
+        pour charger ou décharger un adaptateur sans course avec la génération.
+        """
+        future = Future()
+        self._commands.put((future, fn, args, kwargs))
+        self._waiting.put(None)  # Réveiller la boucle si elle attend des requêtes
+        return future
+
+    def uses_adapter(self, adapter_name):
+        """Indique si une séquence active ou en attente utilise cet adaptateur"""
+        with self._waiting.mutex:
+            waiting = [s for s in self._waiting.queue if s is not None]
+        return any(s.adapter_name == adapter_name for s in self._active + waiting)
+
+    def _run_commands(self):
+        while not self._commands.empty():
+            future, fn, args, kwargs = self._commands.get_nowait()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _adapter_kwargs(self, sequences):
+        """Paramètre `adapter_names` de PEFT pour un batch de séquences"""
+        if all(s.adapter_name is None for s in sequences):
+            return {}
+        default = getattr(self.model, "active_adapter", None)
+        return {"adapter_names": [s.adapter_name or default for s in sequences]}
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._run_commands()
+                self._admit_waiting(block=not self._active)
+                if self._active:
+                    self._decode_step()
+            except Exception as e:
+                logger.error(f"Erreur dans la boucle de décodage: {e}")
+                self._fail_active(e)
+
+        self._fail_active(RuntimeError("L'ordonnanceur a été arrêté"))
+        while not self._waiting.empty():
+            sequence = self._waiting.get_nowait()
+            if sequence is not None:
+                sequence.future.set_exception(RuntimeError("L'ordonnanceur a été arrêté"))
+
+    def _admit_waiting(self, block):
+        """Admettre des requêtes en attente tant que le batch n'est pas plein"""
+        while len(self._active) < self.max_batch_size:
+            try:
+                sequence = self._waiting.get(block=block)
+            except queue.Empty:
+                return
+            block = False
+
+            if sequence is None:
+                return
+            if not sequence.future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                self._prefill(sequence)
+            except Exception as e:
+                logger.error(f"Erreur lors du prefill de la requête {sequence.request_id}: {e}")
+                sequence.future.set_exception(e)
+
+    @torch.no_grad()
+    def _prefill(self, sequence):
+        """Encoder le prompt d'une nouvelle séquence et l'ajouter au batch actif"""
+        input_ids = torch.tensor([sequence.input_ids], device=self.device)
+
+        if self.prefix_cache is not None and sequence.prefix_length > 0:
+            # Reprendre le system prompt déjà encodé et n'encoder que la suite
+            prefix_cache = self.prefix_cache.get(
+                sequence.input_ids[:sequence.prefix_length],
+                adapter_name=sequence.adapter_name
+            )
+            outputs = self.model(
+                input_ids=input_ids[:, sequence.prefix_length:],
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=from_legacy_cache(prefix_cache),
+                use_cache=True,
+                **self._adapter_kwargs([sequence])
+            )
+        else:
+            outputs = self.model(input_ids=input_ids, use_cache=True, **self._adapter_kwargs([sequence]))
+
+        token = sequence.next_token(outputs.logits[0, -1])
+        sequence.append_token(token)
+
+        if sequence.is_finished:
+            self._finish(sequence)
+            return
+
+        cache = to_legacy_cache(outputs.past_key_values)
+        attention_mask = torch.ones((1, input_ids.shape[1]), dtype=torch.long, device=self.device)
+        positions = torch.tensor([input_ids.shape[1]], dtype=torch.long, device=self.device)
+        last_tokens = torch.tensor([[token]], dtype=torch.long, device=self.device)
+
+        if not self._active:
+            self._cache = cache
+            self._attention_mask = attention_mask
+            self._positions = positions
+            self._last_tokens = last_tokens
+        else:
+            length = max(self._attention_mask.shape[1], attention_mask.shape[1])
+            self._cache = tuple(
+                (
+                    torch.cat([_left_pad(k, length, dim=2), _left_pad(new_k, length, dim=2)], dim=0),
+                    torch.cat([_left_pad(v, length, dim=2), _left_pad(new_v, length, dim=2)], dim=0),
+                )
+                for (k, v), (new_k, new_v) in zip(self._cache, cache)
+            )
+            self._attention_mask = torch.cat(
+                [_left_pad(self._attention_mask, length, dim=1), _left_pad(attention_mask, length, dim=1)],
+                dim=0
+            )
+            self._positions = torch.cat([self._positions, positions])
+            self._last_tokens = torch.cat([self._last_tokens, last_tokens])
+
+        self._active.append(sequence)
+
+    @torch.no_grad()
+    def _decode_step(self):
+        """Générer un token pour toutes les séquences actives puis retirer celles qui ont fini"""
+        attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((len(self._active), 1))],
+            dim=1
+        )
+        outputs = self.model(
+            input_ids=self._last_tokens,
+            attention_mask=attention_mask,
+            position_ids=self._positions.unsqueeze(1),
+            past_key_values=from_legacy_cache(self._cache),
+            use_cache=True,
+            **self._adapter_kwargs(self._active)
+        )
+
+        self._cache = to_legacy_cache(outputs.past_key_values)
+        self._attention_mask = attention_mask
+        self._positions = self._positions + 1
+
+        keep = []
+        for index, sequence in enumerate(self._active):
+            token = sequence.next_token(outputs.logits[index, -1])
+            sequence.append_token(token)
+            self._last_tokens[index, 0] = token
+            if sequence.is_finished:
+                self._finish(sequence)
+            else:
+                keep.append(index)
+
+        if len(keep) < len(self._active):
+            self._retire(keep)
+
+    def _retire(self, keep):
+        """Retirer du batch les séquences terminées et supprimer le padding devenu inutile"""
+        self._active = [self._active[i] for i in keep]
+        if not self._active:
+            self._cache = None
+            self._attention_mask = None
+            self._positions = None
+            self._last_tokens = None
+            return
+
+        index = torch.tensor(keep, device=self.device)
+        attention_mask = self._attention_mask.index_select(0, index)
+
+        # Colonnes de padding communes à toutes les séquences restantes
+        real_lengths = attention_mask.sum(dim=1)
+        offset = int(attention_mask.shape[1] - real_lengths.max())
+
+        self._attention_mask = attention_mask[:, offset:]
+        self._cache = tuple(
+            (k.index_select(0, index)[:, :, offset:], v.index_select(0, index)[:, :, offset:])
+            for k, v in self._cache
+        )
+        self._positions = self._positions.index_select(0, index)
+        self._last_tokens = self._last_tokens.index_select(0, index)
+
+    def _finish(self, sequence):
+        generated = sequence.generated_ids
+        if generated and generated[-1] == self.eos_token_id:
+            generated = generated[:-1]
+        sequence.future.set_result(generated)
+
+    def _fail_active(self, error):
+        for sequence in self._active:
+            if not sequence.future.done():
+                sequence.future.set_exception(error)
+        self._active = []
+        self._cache = None
+        self._attention_mask = None
+        self._positions = None
+        self._last_tokens = None
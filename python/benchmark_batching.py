@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark du débit de génération en fonction du nombre de requêtes concurrentes.
+
+Compare le service actuel (un appel `model.generate` à la fois) avec
+l'ordonnanceur à batching continu, sur un petit modèle local (CPU).
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from batch_scheduler import ContinuousBatchScheduler
+
+PROMPTS = [
+    "kel devis son en aten?",
+    "Quels sont les chantiers prévus pour la semaine prochaine?",
+    "Liste des factures impayées du client Dupont",
+    "Trouve les documents techniques sur l'isolation thermique",
+    "Crée un devis pour la rénovation d'une salle de bain de 8m2",
+    "Combien de sacs de ciment reste-t-il en stock?",
+]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark débit vs concurrence pour /generate")
+    parser.add_argument("--model", type=str, default="hf-internal-testing/tiny-random-MistralForCausalLM",
+                        help="Petit modèle local utilisé pour le benchmark")
+    parser.add_argument("--concurrency", type=str, default="1,2,4,8,16",
+                        help="Niveaux de concurrence à tester (séparés par des virgules)")
+    parser.add_argument("--requests_per_client", type=int, default=4,
+                        help="Nombre de requêtes envoyées par client")
+    parser.add_argument("--max_new_tokens", type=int, default=64,
+                        help="Nombre de tokens générés par requête")
+    parser.add_argument("--max_batch_size", type=int, default=16,
+                        help="Taille maximale du batch de l'ordonnanceur")
+    return parser.parse_args()
+
+def run_clients(concurrency, requests_per_client, send):
+    """Lancer `concurrency` clients qui envoient chacun `requests_per_client` requêtes"""
+    def client(client_id):
+        tokens = 0
+        for i in range(requests_per_client):
+            tokens += send(PROMPTS[(client_id + i) % len(PROMPTS)])
+        return tokens
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        tokens = sum(pool.map(client, range(concurrency)))
+    return tokens, time.perf_counter() - start
+
+def main():
+    args = parse_args()
+    torch.manual_seed(0)
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32)
+    model.eval()
+
+    # Générer exactement max_new_tokens par requête pour comparer à travail égal
+    generation_kwargs = {
+        "max_new_tokens": args.max_new_tokens,
+        "min_new_tokens": args.max_new_tokens,
+        "do_sample": False,
+    }
+
+    # Référence : un seul model.generate à la fois, comme l'endpoint actuel
+    generate_lock = threading.Lock()
+
+    def send_sequential(prompt):
+        inputs = tokenizer(prompt, return_tensors="pt")
+        with generate_lock, torch.no_grad():
+            outputs = model.generate(
+                inputs.input_ids,
+                attention_mask=inputs.attention_mask,
+                pad_token_id=tokenizer.eos_token_id,
+                **generation_kwargs
+            )
+        return outputs.shape[1] - inputs.input_ids.shape[1]
+
+    scheduler = ContinuousBatchScheduler(model, tokenizer, max_batch_size=args.max_batch_size)
+    scheduler.start()
+
+    def send_batched(prompt):
+        return len(scheduler.generate(tokenizer(prompt).input_ids, **generation_kwargs))
+
+    # Préchauffage
+    send_sequential(PROMPTS[0])
+    send_batched(PROMPTS[0])
+
+    print(f"{'clients':>8} | {'séquentiel (tok/s)':>19} | {'batching continu (tok/s)':>25} | {'gain':>6}")
+    print("-" * 70)
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        seq_tokens, seq_time = run_clients(concurrency, args.requests_per_client, send_sequential)
+        batch_tokens, batch_time = run_clients(concurrency, args.requests_per_client, send_batched)
+
+        seq_throughput = seq_tokens / seq_time
+        batch_throughput = batch_tokens / batch_time
+        print(f"{concurrency:>8} | {seq_throughput:>19.1f} | {batch_throughput:>25.1f} | "
+              f"{batch_throughput / seq_throughput:>5.2f}x")
+
+    scheduler.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark modèle fusionné vs modèle de base + adaptateur LoRA (`PeftModel`).
+
+Mesure le temps de chargement à froid et la latence par token sur un petit
+modèle local (CPU), et vérifie que les deux modèles produisent les mêmes logits.
+Sans --adapter_path, un adaptateur LoRA aléatoire est créé pour le test.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from peft import LoraConfig, PeftModel, get_peft_model
+
+from merge_adapter import merge_adapter
+
+PROMPT = "<s>[INST] kel devis son en aten? [/INST]"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark modèle fusionné vs adaptateur LoRA")
+    parser.add_argument("--base_model", type=str, default="hf-internal-testing/tiny-random-MistralForCausalLM",
+                        help="Petit modèle local utilisé pour le benchmark")
+    parser.add_argument("--adapter_path", type=str, default=None,
+                        help="Adaptateur LoRA à tester (créé aléatoirement si absent)")
+    parser.add_argument("--max_new_tokens", type=int, default=64,
+                        help="Nombre de tokens générés par mesure")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="Nombre de mesures (la médiane est retenue)")
+    return parser.parse_args()
+
+def create_random_adapter(base_model, output_dir):
+    """Créer un adaptateur LoRA aux poids non nuls sur toutes les projections d'attention et du MLP"""
+    model = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=torch.float32)
+    lora_config = LoraConfig(
+        r=16,
+        lora_alpha=32,
+        target_modules=["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
+        init_lora_weights=False,
+        task_type="CAUSAL_LM"
+    )
+    get_peft_model(model, lora_config).save_pretrained(output_dir)
+    return output_dir
+
+def load_unmerged(base_model, adapter_path):
+    model = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=torch.float32)
+    model = PeftModel.from_pretrained(model, adapter_path)
+    return model.eval()
+
+def load_merged(merged_path):
+    model = AutoModelForCausalLM.from_pretrained(
+        merged_path,
+        torch_dtype="auto",
+        use_safetensors=True,
+        low_cpu_mem_usage=True
+    )
+    return model.eval()
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def time_load(load, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model = load()
+        durations.append(time.perf_counter() - start)
+    return model, median(durations)
+
+@torch.no_grad()
+def time_per_token(model, input_ids, max_new_tokens, repeats):
+    """Latence médiane par token généré (décodage glouton, longueur fixe)"""
+    model.generate(input_ids, max_new_tokens=4, do_sample=False)  # Préchauffage
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.generate(
+            input_ids,
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=max_new_tokens,
+            do_sample=False
+        )
+        durations.append(time.perf_counter() - start)
+    return median(durations) / max_new_tokens
+
+def main():
+    args = parse_args()
+    torch.manual_seed(0)
+    tokenizer = AutoTokenizer.from_pretrained(args.base_model)
+    input_ids = tokenizer(PROMPT, return_tensors="pt").input_ids
+
+    with tempfile.TemporaryDirectory() as workdir:
+        adapter_path = args.adapter_path or create_random_adapter(args.base_model, os.path.join(workdir, "adapter"))
+        merged_path = merge_adapter(
+            adapter_path, os.path.join(workdir, "merged"), base_model=args.base_model, dtype="float32"
+        )
+
+        unmerged, unmerged_load = time_load(lambda: load_unmerged(args.base_model, adapter_path), args.repeats)
+        merged, merged_load = time_load(lambda: load_merged(merged_path), args.repeats)
+
+        with torch.no_grad():
+            max_diff = (unmerged(input_ids).logits - merged(input_ids).logits).abs().max().item()
+
+        unmerged_token = time_per_token(unmerged, input_ids, args.max_new_tokens, args.repeats)
+        merged_token = time_per_token(merged, input_ids, args.max_new_tokens, args.repeats)
+
+    print(f"\n{'':>22} | {'base + LoRA':>12} | {'fusionné':>12} | {'gain':>6}")
+    print("-" * 62)
+    print(f"{'chargement (s)':>22} | {unmerged_load:>12.3f} | {merged_load:>12.3f} | "
+          f"{unmerged_load / merged_load:>5.2f}x")
+    print(f"{'latence/token (ms)':>22} | {unmerged_token * 1000:>12.2f} | {merged_token * 1000:>12.2f} | "
+          f"{unmerged_token / merged_token:>5.2f}x")
+    print(f"\nÉcart maximal des logits: {max_diff:.2e}")
+
+if __name__ == "__main__":
+    main()
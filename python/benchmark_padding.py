@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark du débit d'entraînement selon la stratégie de padding.
+
+Compare, sur les fichiers d'entraînement de huggingface_finetune.py et un petit
+modèle local (CPU), le padding fixe à MAX_LENGTH, le padding dynamique, le
+padding dynamique avec regroupement des exemples par longueur et le packing.
+"""
+
+import argparse
+import tempfile
+
+import torch
+from datasets import Dataset
+from transformers import AutoModelForCausalLM, AutoTokenizer, DataCollatorForSeq2Seq, Trainer, TrainingArguments
+from peft import LoraConfig, get_peft_model
+
+from huggingface_finetune import (
+    TRAINING_FILES,
+    PackedDataCollator,
+    format_data_for_training,
+    length_grouping_args,
+    load_training_data,
+    pack_dataset,
+    tokenize_dataset,
+)
+
+# (nom, padding dynamique, regroupement par longueur, packing)
+STRATEGIES = [
+    ("padding fixe", False, False, False),
+    ("padding dynamique", True, False, False),
+    ("dynamique + longueur", True, True, False),
+    ("packing", True, False, True),
+]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark des stratégies de padding et du packing")
+    parser.add_argument("--model", type=str, default="hf-internal-testing/tiny-random-MistralForCausalLM",
+                        help="Petit modèle local utilisé pour le benchmark")
+    parser.add_argument("--batch_size", type=int, default=8, help="Taille des batches d'entraînement")
+    parser.add_argument("--max_length", type=int, default=1024, help="Longueur maximale des exemples")
+    parser.add_argument("--max_examples", type=int, default=0, help="Limiter le nombre d'exemples (0 = tous)")
+    return parser.parse_args()
+
+def padding_ratio(trainer, tokenized_dataset):
+    """Part des tokens de padding dans les batches d'une époque"""
+    total = sum(batch["input_ids"].numel() for batch in trainer.get_train_dataloader())
+    return 1 - sum(tokenized_dataset["length"]) / total
+
+def run(args, dataset, tokenizer, dynamic_padding, group_by_length, packing):
+    torch.manual_seed(0)
+    tokenized_dataset = tokenize_dataset(dataset, tokenizer, args.max_length, dynamic_padding)
+    if packing:
+        tokenized_dataset = pack_dataset(tokenized_dataset, args.max_length)
+        data_collator = PackedDataCollator(tokenizer.pad_token_id)
+    else:
+        data_collator = DataCollatorForSeq2Seq(tokenizer=tokenizer, pad_to_multiple_of=8, label_pad_token_id=-100)
+
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32)
+    model = get_peft_model(model, LoraConfig(
+        r=8, lora_alpha=16, lora_dropout=0.05, bias="none", task_type="CAUSAL_LM",
+        target_modules=["q_proj", "v_proj", "k_proj", "o_proj"]
+    ))
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        training_args = TrainingArguments(
+            output_dir=output_dir,
+            per_device_train_batch_size=args.batch_size,
+            num_train_epochs=1,
+            learning_rate=2e-4,
+            logging_steps=1000,
+            save_strategy="no",
+            report_to=[],
+            use_cpu=True,
+            remove_unused_columns=not packing,
+            **length_grouping_args(group_by_length),
+        )
+        trainer = Trainer(
+            model=model,
+            args=training_args,
+            train_dataset=tokenized_dataset,
+            data_collator=data_collator,
+        )
+        ratio = padding_ratio(trainer, tokenized_dataset)
+        runtime = trainer.train().metrics["train_runtime"]
+
+    return sum(tokenized_dataset["length"]) / runtime, ratio, runtime
+
+def main():
+    args = parse_args()
+
+    formatted_data = format_data_for_training(load_training_data(TRAINING_FILES))
+    if args.max_examples:
+        formatted_data = formatted_data[:args.max_examples]
+    dataset = Dataset.from_list(formatted_data)
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    tokenizer.pad_token = tokenizer.eos_token
+
+    results = [(name, *run(args, dataset, tokenizer, *options)) for name, *options in STRATEGIES]
+
+    baseline = results[0][1]
+    print(f"\n{'stratégie':>22} | {'tokens/s':>10} | {'padding':>8} | {'durée (s)':>9} | {'gain':>6}")
+    print("-" * 68)
+    for name, tokens_per_second, ratio, runtime in results:
+        print(f"{name:>22} | {tokens_per_second:>10.1f} | {ratio:>7.1%} | {runtime:>9.1f} | "
+              f"{tokens_per_second / baseline:>5.2f}x")
+
+if __name__ == "__main__":
+    main()
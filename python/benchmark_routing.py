@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Évaluation du routage et benchmark de latence du modèle fine-tuné.
+
+Rejoue les exemples mis de côté des fichiers d'entraînement JSONL, soit en
+local via `generate_response`, soit via l'API HTTP (/generate_stream), et
+mesure :
+- la validité du format imposé par le Modelfile (reformulation, intention,
+  agent parmi querybuilder/elasticsearch/workflow_agent, puis la requête) ;
+- la précision du choix de l'agent par rapport à la réponse attendue ;
+- la latence (p50/p95/p99), le temps jusqu'au premier token et les tokens/s.
+
+Les exemples mis de côté sont choisis par une empreinte stable de la question :
+la même fraction est rejouée d'une exécution à l'autre. Avec `--baseline`, les
+résultats sont comparés à un rapport précédent et le script échoue en cas de
+régression, pour un suivi en local à chaque changement avec un petit modèle CPU.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+
+import torch
+from transformers.generation.streamers import BaseStreamer
+
+from inference import load_model, generate_response, record_prompt
+
+AGENTS = ("querybuilder", "elasticsearch", "workflow_agent")
+TRAINING_FILES = [
+    "data/training/analyse_agent_data.jsonl",
+    "data/training/analyse_agent_data-set2.jsonl",
+    "data/training/data3.jsonl",
+    "data/training/data3_bis.jsonl",
+]
+DEFAULT_SYSTEM_PROMPT = "Vous êtes un assistant d'analyse pour une société de BTP spécialisée dans la construction et rénovation de bâtiments."
+
+# Champs du format texte : "Intention identifiée : ...", "2. Intention: ...", etc.
+FIELD_PATTERNS = {
+    "intention": re.compile(r"^\s*(?:\d+\.\s*)?Intention(?: identifiée)?\s*:\s*(.*)$", re.IGNORECASE | re.MULTILINE),
+    "agent": re.compile(r"^\s*(?:\d+\.\s*)?Agent(?: à utiliser| spécialisé)?\s*:\s*(.*)$", re.IGNORECASE | re.MULTILINE),
+    "query": re.compile(r"^\s*(?:\d+\.\s*)?(?:Type de requête|Requête générée|Requête|Action)\s*:\s*(.*)$", re.IGNORECASE | re.MULTILINE | re.DOTALL),
+}
+REFORMULATION_PATTERN = re.compile(r"^\s*(?:\d+\.\s*)?Reformulation\s*:\s*(.*)$", re.IGNORECASE | re.MULTILINE)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Évaluation du routage (agent, format) et benchmark de latence")
+    parser.add_argument("--model", type=str, default="hf-internal-testing/tiny-random-MistralForCausalLM",
+                        help="Modèle local (fusionné, PEFT ou petit modèle de test)")
+    parser.add_argument("--base_model", type=str, default=None, help="Modèle de base d'un modèle PEFT")
+    parser.add_argument("--url", type=str, default=None,
+                        help="URL de l'API (ex: http://localhost:8000) : évaluer via /generate_stream au lieu du modèle local")
+    parser.add_argument("--data", type=str, nargs="+", default=TRAINING_FILES, help="Fichiers JSONL d'exemples")
+    parser.add_argument("--eval_fraction", type=float, default=0.1,
+                        help="Fraction des exemples mis de côté et rejoués (1.0 = tous)")
+    parser.add_argument("--seed", type=str, default="42", help="Sel de l'empreinte du choix des exemples")
+    parser.add_argument("--limit", type=int, default=None, help="Nombre maximum d'exemples rejoués")
+    parser.add_argument("--max_length", type=int, default=1024, help="Longueur maximale (prompt compris)")
+    parser.add_argument("--temperature", type=float, default=0.1, help="Température de génération")
+    parser.add_argument("--warmup", type=int, default=1, help="Générations de préchauffage, non mesurées")
+    parser.add_argument("--output", type=str, default=None, help="Fichier JSONL des résultats par exemple")
+    parser.add_argument("--report", type=str, default=None, help="Fichier JSON du rapport agrégé")
+    parser.add_argument("--baseline", type=str, default=None, help="Rapport de référence pour détecter les régressions")
+    parser.add_argument("--max_accuracy_drop", type=float, default=0.02,
+                        help="Baisse tolérée de la précision et de la validité du format (en absolu)")
+    parser.add_argument("--max_slowdown", type=float, default=0.2,
+                        help="Hausse relative tolérée de la latence p95 et du temps jusqu'au premier token p95")
+    return parser.parse_args()
+
+
+def in_eval_split(prompt, fraction, seed):
+    """Exemple mis de côté pour l'évaluation, d'après l'empreinte stable de la question"""
+    digest = hashlib.sha1(f"{seed}:{prompt}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 < fraction
+
+
+def clean_field(value):
+    value = value.strip().strip("*").strip()
+    return value or None
+
+
+def parse_routing(response):
+    """
+    Extraire reformulation, intention, agent et requête d'une réponse, au format
+    texte du Modelfile (numéroté ou non) ou au format JSON. Les champs absents valent None.
+    """
+    text = response.strip()
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            data = None
+        if isinstance(data, dict):
+            query = data.get("requete")
+            if query and not isinstance(query, str):
+                query = json.dumps(query, ensure_ascii=False)
+            return {
+                "reformulation": clean_field(str(data.get("question_reformulee") or "")),
+                "intention": clean_field(str(data.get("intention") or "")),
+                "agent": clean_field(str(data.get("agent") or "")),
+                "query": clean_field(query or ""),
+            }
+
+    fields = {}
+    for name, pattern in FIELD_PATTERNS.items():
+        match = pattern.search(text)
+        fields[name] = clean_field(match.group(1)) if match else None
+
+    # La reformulation est soit explicite, soit la première ligne de la réponse
+    match = REFORMULATION_PATTERN.search(text)
+    if match:
+        fields["reformulation"] = clean_field(match.group(1))
+    else:
+        first_line = text.split("\n", 1)[0]
+        fields["reformulation"] = None if FIELD_PATTERNS["intention"].match(first_line) else clean_field(first_line)
+    return fields
+
+
+def normalize_agent(agent):
+    """Nom d'agent reconnu dans le champ agent, ou None"""
+    if not agent:
+        return None
+    agent = agent.lower().replace("`", "")
+    return next((name for name in AGENTS if name in agent), None)
+
+
+def format_valid(fields):
+    return all(fields[name] for name in ("reformulation", "intention", "query")) and normalize_agent(fields["agent"]) is not None
+
+
+def load_examples(paths, fraction, seed, limit=None):
+    """Exemples (prompt, system prompt, agent attendu) mis de côté des fichiers JSONL"""
+    examples = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    prompt, system_prompt, expected = record_prompt(json.loads(line), DEFAULT_SYSTEM_PROMPT)
+                except (json.JSONDecodeError, ValueError) as e:
+                    print(f"{path}:{line_number}: exemple ignoré ({e})")
+                    continue
+                if not in_eval_split(prompt, fraction, seed):
+                    continue
+                examples.append({
+                    "source": f"{path}:{line_number}",
+                    "prompt": prompt,
+                    "system_prompt": system_prompt,
+                    "expected_agent": normalize_agent(parse_routing(expected)["agent"]) if expected else None,
+                })
+                if limit is not None and len(examples) >= limit:
+                    return examples
+    return examples
+
+
+class TimingStreamer(BaseStreamer):
+    """Streamer qui relève l'heure du premier token généré et compte les tokens"""
+
+    def __init__(self):
+        self.prompt_seen = False
+        self.first_token_time = None
+        self.tokens = 0
+
+    def put(self, value):
+        # Le premier appel reçoit le prompt, les suivants les nouveaux tokens
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.tokens += value.numel()
+
+    def end(self):
+        pass
+
+
+def local_generator(args):
+    model, tokenizer = load_model(args.model, args.base_model, use_4bit=torch.cuda.is_available())
+    model.eval()
+
+    def generate(example):
+        streamer = TimingStreamer()
+        start = time.perf_counter()
+        response = generate_response(model, tokenizer, example["prompt"], example["system_prompt"],
+                                     max_length=args.max_length, temperature=args.temperature, streamer=streamer)
+        end = time.perf_counter()
+        first_token = streamer.first_token_time or end
+        return response, start, first_token, end, streamer.tokens
+
+    return generate
+
+
+def http_generator(args):
+    import requests
+    session = requests.Session()
+    url = args.url.rstrip("/") + "/generate_stream"
+
+    def generate(example):
+        payload = {
+            "prompt": example["prompt"],
+            "system_prompt": example["system_prompt"],
+            "max_length": args.max_length,
+            "temperature": args.temperature,
+            "greedy": args.temperature == 0,
+        }
+        chunks = []
+        first_token = None
+        start = time.perf_counter()
+        with session.post(url, json=payload, stream=True, timeout=300) as response:
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = line[len("data:"):].strip()
+                    if event == "error":
+                        raise RuntimeError(json.loads(data).get("detail", data))
+                    if data == '"[DONE]"' or data == "[DONE]":
+                        break
+                    text = json.loads(data).get("text", "")
+                    if text and first_token is None:
+                        first_token = time.perf_counter()
+                    chunks.append(text)
+                elif not line:
+                    event = None
+        end = time.perf_counter()
+        # Un événement par token décodé : le nombre de morceaux approche le nombre de tokens
+        return "".join(chunks), start, first_token or end, end, len(chunks)
+
+    return generate
+
+
+def percentile(values, q):
+    """Percentile par interpolation linéaire"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(results):
+    """Rapport agrégé : précision du routage, validité du format, latences et débit"""
+    ok = [r for r in results if r.get("error") is None]
+    scored = [r for r in ok if r["expected_agent"] is not None]
+    latencies = [r["latency"] for r in ok]
+    ttfts = [r["ttft"] for r in ok]
+    decode_rates = [r["tokens_per_second"] for r in ok if r["tokens_per_second"] is not None]
+    total_time = sum(latencies)
+
+    per_agent = {}
+    for agent in AGENTS:
+        expected = [r for r in scored if r["expected_agent"] == agent]
+        if expected:
+            per_agent[agent] = {
+                "examples": len(expected),
+                "recall": sum(r["predicted_agent"] == agent for r in expected) / len(expected),
+            }
+
+    report = {
+        "examples": len(results),
+        "errors": len(results) - len(ok),
+        "agent_accuracy": sum(r["predicted_agent"] == r["expected_agent"] for r in scored) / len(scored) if scored else None,
+        "format_validity": sum(r["format_valid"] for r in ok) / len(ok) if ok else None,
+        "per_agent": per_agent,
+        "tokens_per_second": sum(r["tokens"] for r in ok) / total_time if total_time else None,
+        "decode_tokens_per_second_p50": percentile(decode_rates, 50),
+    }
+    for q in (50, 95, 99):
+        report[f"latency_p{q}"] = percentile(latencies, q)
+        report[f"ttft_p{q}"] = percentile(ttfts, q)
+    return report
+
+
+def check_regressions(report, baseline, max_accuracy_drop, max_slowdown):
+    """Liste des régressions par rapport au rapport de référence"""
+    regressions = []
+    for key in ("agent_accuracy", "format_validity"):
+        if report.get(key) is not None and baseline.get(key) is not None \
+                and report[key] < baseline[key] - max_accuracy_drop:
+            regressions.append(f"{key}: {report[key]:.3f} < {baseline[key]:.3f}")
+    for key in ("latency_p95", "ttft_p95"):
+        if report.get(key) is not None and baseline.get(key) \
+                and report[key] > baseline[key] * (1 + max_slowdown):
+            regressions.append(f"{key}: {report[key]:.3f}s > {baseline[key]:.3f}s")
+    return regressions
+
+
+def format_value(value, pattern):
+    return "n/a" if value is None else pattern.format(value)
+
+
+def main():
+    args = parse_args()
+    torch.manual_seed(0)
+
+    examples = load_examples(args.data, args.eval_fraction, args.seed, args.limit)
+    if not examples:
+        print("Aucun exemple à évaluer (vérifiez --data et --eval_fraction)")
+        sys.exit(1)
+    print(f"{len(examples)} exemples à rejouer")
+
+    generate = http_generator(args) if args.url else local_generator(args)
+    for example in examples[:args.warmup]:
+        generate(example)
+
+    results = []
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    try:
+        for index, example in enumerate(examples, start=1):
+            result = {**example, "error": None}
+            try:
+                response, start, first_token, end, tokens = generate(example)
+            except Exception as e:
+                print(f"[{index}/{len(examples)}] erreur: {e}")
+                result["error"] = str(e)
+            else:
+                fields = parse_routing(response)
+                decode_time = end - first_token
+                result.update({
+                    "response": response,
+                    "predicted_agent": normalize_agent(fields["agent"]),
+                    "format_valid": format_valid(fields),
+                    "latency": end - start,
+                    "ttft": first_token - start,
+                    "tokens": tokens,
+                    # Le premier token est compté dans le temps jusqu'au premier token
+                    "tokens_per_second": (tokens - 1) / decode_time if tokens > 1 and decode_time > 0 else None,
+                })
+                print(f"[{index}/{len(examples)}] attendu: {result['expected_agent']}, prédit: {result['predicted_agent']}, "
+                      f"format {'valide' if result['format_valid'] else 'invalide'}, {result['latency']:.2f}s")
+            results.append(result)
+            if output:
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+    finally:
+        if output:
+            output.close()
+
+    report = summarize(results)
+    report["target"] = args.url or args.model
+
+    print(f"\nExemples: {report['examples']} (erreurs: {report['errors']})")
+    print(f"Précision du choix de l'agent: {format_value(report['agent_accuracy'], '{:.1%}')}")
+    print(f"Validité du format: {format_value(report['format_validity'], '{:.1%}')}")
+    for agent, stats in report["per_agent"].items():
+        print(f"  {agent}: rappel {stats['recall']:.1%} sur {stats['examples']} exemples")
+    print("Latence (s): " + ", ".join(f"p{q} {format_value(report[f'latency_p{q}'], '{:.3f}')}" for q in (50, 95, 99)))
+    print("Premier token (s): " + ", ".join(f"p{q} {format_value(report[f'ttft_p{q}'], '{:.3f}')}" for q in (50, 95, 99)))
+    print(f"Débit: {format_value(report['tokens_per_second'], '{:.1f}')} tokens/s "
+          f"(décodage p50: {format_value(report['decode_tokens_per_second_p50'], '{:.1f}')} tokens/s)")
+
+    if args.report:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = check_regressions(report, baseline, args.max_accuracy_drop, args.max_slowdown)
+        if regressions:
+            print("\nRégressions par rapport à la référence:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nAucune régression par rapport à la référence")
+
+if __name__ == "__main__":
+    main()
@@ -21,65 +21,72 @@ from transformers import (
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 from google.colab import drive
 
+# Parser JSON plus rapide si disponible
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # Configuration pour éviter la fragmentation de la mémoire CUDA
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
 
 # Configuration
 BASE_MODEL = "mistralai/Mistral-7B-Instruct-v0.2"
 OUTPUT_MODEL = "mistral-finetuned"
+MAX_LENGTH = 1024
 
 # Monter Google Drive pour sauvegarder le modèle et accéder aux données
 drive.mount('/content/drive')
 
+def length_grouping_args():
+    """Arguments de TrainingArguments pour batcher ensemble les exemples de longueur proche"""
+    # transformers >= 5 remplace group_by_length par train_sampling_strategy
+    if "group_by_length" in TrainingArguments.__dataclass_fields__:
+        return {"group_by_length": True, "length_column_name": "length"}
+    return {"train_sampling_strategy": "group_by_length", "length_column_name": "length"}
+
 # Fonction pour charger les données depuis Google Drive
-def load_training_data(file_paths):
-    """Charger et préparer les données d'entraînement"""
-    all_data = []
-    
+def iter_training_data(file_paths):
+    """Lire les fichiers JSONL ligne par ligne, sans les charger entièrement en mémoire"""
     for file_path in file_paths:
-        if os.path.exists(file_path):
-            print(f"Chargement du fichier: {file_path}")
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                
-                for line in lines:
-                    if line.strip():
-                        try:
-                            item = json.loads(line)
-                            all_data.append(item)
-                        except json.JSONDecodeError:
-                            print(f"Erreur de parsing pour la ligne: {line[:50]}...")
-            
-            print(f"Chargé {len(lines)} exemples d'entraînement depuis {os.path.basename(file_path)}")
-        else:
+        if not os.path.exists(file_path):
             print(f"Fichier non trouvé: {file_path}")
-    
-    print(f"Total: {len(all_data)} exemples d'entraînement chargés")
-    
-    if len(all_data) == 0:
-        raise ValueError("Aucune donnée d'entraînement valide trouvée")
-    
-    return all_data
-
-def format_data_for_training(data):
-    """Convertir les données au format attendu pour le fine-tuning"""
-    formatted_data = []
-    
-    for item in data:
-        messages = item.get("messages", [])
+            continue
         
-        system_message = next((msg["content"] for msg in messages if msg["role"] == "system"), "")
-        user_message = next((msg["content"] for msg in messages if msg["role"] == "user"), "")
-        assistant_message = next((msg["content"] for msg in messages if msg["role"] == "assistant"), "")
+        print(f"Chargement du fichier: {file_path}")
+        count = 0
+        with open(file_path, 'rb') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json_loads(line)
+                except ValueError as e:
+                    preview = line[:50].decode("utf-8", errors="replace").rstrip()
+                    print(f"{file_path}:{line_number}: erreur de parsing ({e}): {preview}...")
+                    continue
+                count += 1
+                yield item
         
-        # Format pour l'entraînement
-        formatted_text = f"<s>[INST] {system_message}\n\n{user_message} [/INST] {assistant_message}</s>"
-        
-        formatted_data.append({
-            "text": formatted_text
-        })
+        print(f"Chargé {count} exemples d'entraînement depuis {os.path.basename(file_path)}")
+
+def format_example(item):
+    """Convertir un exemple au format attendu pour le fine-tuning"""
+    messages = item.get("messages", [])
     
-    return formatted_data
+    system_message = next((msg["content"] for msg in messages if msg["role"] == "system"), "")
+    user_message = next((msg["content"] for msg in messages if msg["role"] == "user"), "")
+    assistant_message = next((msg["content"] for msg in messages if msg["role"] == "assistant"), "")
+    
+    # Format pour l'entraînement
+    return {"text": f"<s>[INST] {system_message}\n\n{user_message} [/INST] {assistant_message}</s>"}
+
+def generate_formatted_examples(file_paths, file_stats=None):
+    # file_stats (taille, date de modification) fait seulement partie de l'empreinte
+    # du cache de datasets : un fichier modifié sur le Drive est relu
+    for item in iter_training_data(file_paths):
+        yield format_example(item)
 
 def fine_tune_model():
     """Fonction principale pour le fine-tuning avec Hugging Face sur Colab"""
@@ -91,13 +98,13 @@ def fine_tune_model():
         "/content/drive/MyDrive/data/analyse_agent_data-set2.jsonl"
     ]
     
-    raw_data = load_training_data(TRAINING_FILES)
-    
-    # 2. Formater les données pour l'entraînement
-    formatted_data = format_data_for_training(raw_data)
-    
-    # 3. Créer un dataset Hugging Face
-    dataset = Dataset.from_list(formatted_data)
+    # 2-3. Formater les exemples et créer un dataset Hugging Face au fil de la lecture
+    file_stats = [(os.path.getsize(p), os.path.getmtime(p)) for p in TRAINING_FILES if os.path.exists(p)]
+    dataset = Dataset.from_generator(
+        generate_formatted_examples,
+        gen_kwargs={"file_paths": TRAINING_FILES, "file_stats": file_stats}
+    )
+    print(f"Total: {len(dataset)} exemples d'entraînement chargés")
     
     # 4. Charger le tokenizer et le modèle
     print(f"Chargement du modèle {BASE_MODEL}...")
@@ -106,11 +113,14 @@ def fine_tune_model():
     # Configurer le tokenizer
     tokenizer.pad_token = tokenizer.eos_token
     
-    # 5. Tokeniser les données
+    # 5. Tokeniser les données (sans padding : le data collator complète chaque
+    # batch à la longueur de son plus long exemple)
     def tokenize_function(examples):
-        return tokenizer(examples["text"], padding="max_length", truncation=True, max_length=1024)
+        tokenized = tokenizer(examples["text"], truncation=True, max_length=MAX_LENGTH)
+        tokenized["length"] = [sum(mask) for mask in tokenized["attention_mask"]]
+        return tokenized
     
-    tokenized_dataset = dataset.map(tokenize_function, batched=True)
+    tokenized_dataset = dataset.map(tokenize_function, batched=True, remove_columns=dataset.column_names)
     
     # 6. Configurer LoRA pour un fine-tuning efficace
     peft_config = LoraConfig(
@@ -159,10 +169,11 @@ def fine_tune_model():
         save_total_limit=3,
         gradient_checkpointing=True,
         optim="adamw_torch_fused",
+        **length_grouping_args(),
     )
     
     # 10. Créer le data collator
-    data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+    data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False, pad_to_multiple_of=8)
     
     # 11. Créer le trainer
     trainer = Trainer(
@@ -174,7 +185,12 @@ def fine_tune_model():
     
     # 12. Lancer l'entraînement
     print("Lancement de l'entraînement...")
-    trainer.train()
+    train_result = trainer.train()
+    
+    # Débit en tokens réels (hors padding)
+    runtime = train_result.metrics["train_runtime"]
+    real_tokens = sum(tokenized_dataset["length"]) * training_args.num_train_epochs
+    print(f"Débit d'entraînement: {real_tokens / runtime:.1f} tokens/s ({real_tokens} tokens réels en {runtime:.1f}s)")
     
     # 13. Sauvegarder le modèle
     print("Sauvegarde du modèle...")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Conversion des fichiers bruts de data/1st_data_txt en JSONL d'entraînement.
+
+Les fichiers mélangent tableaux JSON, objets séparés par des virgules et objets
+isolés. Le convertisseur lit chaque fichier en flux, extrait les
+enregistrements `{"messages": [...]}` quelle que soit leur forme, valide les
+rôles et contenus, puis écrit des shards JSONL normalisés (un objet par ligne)
+dans data/training/converted : ils sont proposés par retrain_interactive.py et
+peuvent être passés à huggingface_finetune.py avec --training_files.
+
+La conversion est incrémentale : un manifeste garde la date de modification,
+la taille et l'empreinte de chaque fichier source, seuls les fichiers modifiés
+sont retraités.
+"""
+
+import os
+import json
+import glob
+import hashlib
+import argparse
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "1st_data_txt")
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "training", "converted")
+MANIFEST_NAME = "manifest.json"
+
+VALID_ROLES = ("system", "user", "assistant")
+READ_SIZE = 1024 * 1024
+# Au-delà, un objet qui ne se termine pas est considéré comme invalide
+MAX_RECORD_BYTES = 16 * 1024 * 1024
+# Caractères ignorés entre deux objets (tableaux, virgules, espaces)
+SEPARATORS = " \t\r\n,[]"
+
+
+class InvalidRecord(ValueError):
+    """Enregistrement qui ne respecte pas le format attendu"""
+
+
+def iter_json_objects(file_path):
+    """
+    Extraire en flux les objets JSON de premier niveau d'un fichier, qu'ils
+    soient dans un tableau, séparés par des virgules ou simplement à la suite.
+
+    Retourne des tuples (numéro de ligne, objet ou None, erreur ou None).
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0  # Début de la partie non lue de `buffer`
+    line_number = 1  # Ligne de `position`
+    eof = False
+
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+
+        def read_more():
+            # Le texte déjà lu n'est retiré du buffer qu'à la lecture d'un nouveau morceau
+            nonlocal buffer, position, eof
+            chunk = f.read(READ_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+        while True:
+            # Sauter les séparateurs entre objets
+            start = position
+            while position < len(buffer) and buffer[position] in SEPARATORS:
+                position += 1
+            line_number += buffer.count("\n", start, position)
+
+            if position == len(buffer):
+                if eof:
+                    return
+                read_more()
+                continue
+
+            try:
+                obj, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                # Objet incomplet : lire la suite du fichier
+                if not eof and len(buffer) - position < MAX_RECORD_BYTES:
+                    read_more()
+                    continue
+                # Objet invalide : le signaler et reprendre au prochain objet
+                yield line_number, None, f"JSON invalide ({e.msg})"
+                next_object = buffer.find("{", position + 1)
+                end = len(buffer) if next_object == -1 else next_object
+                line_number += buffer.count("\n", position, end)
+                position = end
+                continue
+
+            yield line_number, obj, None
+            line_number += buffer.count("\n", position, end)
+            position = end
+
+
+def normalize_record(obj):
+    """Valider un enregistrement et le réduire à {"messages": [{"role", "content"}, ...]}"""
+    if not isinstance(obj, dict) or not isinstance(obj.get("messages"), list):
+        raise InvalidRecord("objet sans liste 'messages'")
+
+    messages = []
+    for index, msg in enumerate(obj["messages"]):
+        if not isinstance(msg, dict):
+            raise InvalidRecord(f"message {index} n'est pas un objet")
+        role = str(msg.get("role", "")).strip().lower()
+        content = msg.get("content")
+        if role not in VALID_ROLES:
+            raise InvalidRecord(f"message {index}: rôle inconnu '{role}'")
+        if not isinstance(content, str) or not content.strip():
+            raise InvalidRecord(f"message {index}: contenu vide ou non textuel")
+        messages.append({"role": role, "content": content.strip()})
+
+    roles = [msg["role"] for msg in messages]
+    if "user" not in roles or "assistant" not in roles:
+        raise InvalidRecord("conversation sans message utilisateur ou sans réponse de l'assistant")
+    return {"messages": messages}
+
+
+def iter_records(file_path, stats):
+    """Enregistrements valides et normalisés d'un fichier brut ; les erreurs sont signalées avec fichier:ligne"""
+    for line_number, obj, error in iter_json_objects(file_path):
+        if error is None:
+            # Les tableaux imbriqués ([[...]]) sont aplatis
+            candidates = obj if isinstance(obj, list) else [obj]
+            for candidate in candidates:
+                try:
+                    yield normalize_record(candidate)
+                    stats["records"] += 1
+                except InvalidRecord as e:
+                    stats["invalid"] += 1
+                    print(f"{file_path}:{line_number}: enregistrement ignoré ({e})")
+        else:
+            stats["invalid"] += 1
+            print(f"{file_path}:{line_number}: {error}")
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_shards(records, output_dir, stem, shard_size):
+    """Écrire les enregistrements dans des shards JSONL de `shard_size` lignes au plus"""
+    shards = []
+    out = None
+    tmp_path = None
+    count = 0
+
+    def close_shard():
+        out.close()
+        final_path = tmp_path[:-len(".tmp")]
+        os.replace(tmp_path, final_path)
+        shards.append(os.path.basename(final_path))
+
+    for record in records:
+        if out is None or count == shard_size:
+            if out is not None:
+                close_shard()
+            tmp_path = os.path.join(output_dir, f"{stem}-{len(shards):05d}.jsonl.tmp")
+            out = open(tmp_path, 'w', encoding='utf-8')
+            count = 0
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+
+    if out is not None:
+        close_shard()
+    return shards
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def remove_shards(output_dir, shards):
+    for shard in shards:
+        path = os.path.join(output_dir, shard)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def convert_directory(input_dir=INPUT_DIR, output_dir=OUTPUT_DIR, pattern="*.txt", shard_size=10000, force=False):
+    """Convertir les fichiers bruts modifiés depuis la dernière exécution et retourner le manifeste"""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    sources = sorted(glob.glob(os.path.join(input_dir, pattern)))
+    names = {os.path.basename(path) for path in sources}
+
+    # Fichiers sources supprimés : retirer leurs shards
+    for name in [name for name in manifest if name not in names]:
+        print(f"Source supprimée, retrait de ses shards: {name}")
+        remove_shards(output_dir, manifest.pop(name)["shards"])
+
+    for source in sources:
+        name = os.path.basename(source)
+        stat = os.stat(source)
+        entry = manifest.get(name)
+
+        if not force and entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            print(f"Inchangé: {name}")
+            continue
+
+        sha256 = file_sha256(source)
+        if not force and entry and entry["sha256"] == sha256:
+            # Seule la date de modification a changé
+            entry["mtime"] = stat.st_mtime
+            print(f"Inchangé (même contenu): {name}")
+            continue
+
+        print(f"Conversion: {name}")
+        stats = {"records": 0, "invalid": 0}
+        stem = os.path.splitext(name)[0]
+        if entry:
+            remove_shards(output_dir, entry["shards"])
+        shards = write_shards(iter_records(source, stats), output_dir, stem, shard_size)
+        manifest[name] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "sha256": sha256,
+            "shards": shards,
+            **stats,
+        }
+        print(f"  {stats['records']} conversations valides, {stats['invalid']} ignorées -> {', '.join(shards) or 'aucun shard'}")
+
+    save_manifest(output_dir, manifest)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convertir les fichiers bruts de data/1st_data_txt en JSONL d'entraînement")
+    parser.add_argument("--input_dir", type=str, default=INPUT_DIR, help="Dossier des fichiers bruts")
+    parser.add_argument("--output_dir", type=str, default=OUTPUT_DIR, help="Dossier des shards JSONL")
+    parser.add_argument("--pattern", type=str, default="*.txt", help="Motif des fichiers à convertir")
+    parser.add_argument("--shard_size", type=int, default=10000, help="Nombre maximum de conversations par shard")
+    parser.add_argument("--force", action="store_true", help="Tout reconvertir, même les fichiers inchangés")
+
+    args = parser.parse_args()
+
+    manifest = convert_directory(args.input_dir, args.output_dir, args.pattern, args.shard_size, args.force)
+    total = sum(entry["records"] for entry in manifest.values())
+    print(f"\nTotal: {total} conversations dans {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
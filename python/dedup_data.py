@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Déduplication des fichiers d'entraînement JSONL.
+
+Deux étapes sur le texte utilisateur + assistant de chaque conversation :
+- doublons exacts : empreinte du texte normalisé ;
+- quasi-doublons (reformulations) : signatures MinHash regroupées par LSH,
+  chaque exemple n'est comparé qu'aux exemples qui partagent une de ses bandes,
+  le coût reste donc linéaire en nombre d'exemples.
+
+Le premier exemple de chaque groupe (ordre des fichiers) est conservé et les
+lignes d'origine sont recopiées telles quelles dans le corpus dédupliqué.
+"""
+
+import os
+import json
+import hashlib
+import argparse
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from text_utils import normalize_prompt
+
+# Parser JSON plus rapide si disponible
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def conversation_text(item):
+    """Texte utilisateur + assistant d'une conversation, normalisé (le system prompt est ignoré)"""
+    messages = item.get("messages", []) if isinstance(item, dict) else []
+    text = " ".join(
+        msg.get("content", "") for msg in messages
+        if isinstance(msg, dict) and msg.get("role") in ("user", "assistant")
+    )
+    return normalize_prompt(text)
+
+
+def shingles(text, ngram=3):
+    """Empreintes 32 bits des n-grammes de mots du texte"""
+    words = text.split()
+    if len(words) < ngram:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + ngram]) for i in range(len(words) - ngram + 1)]
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in set(grams)), dtype=np.uint64)
+
+
+def lsh_params(num_perm, threshold):
+    """Nombre de bandes et de lignes par bande dont le seuil de collision est le plus proche de `threshold`"""
+    candidates = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(candidates, key=lambda c: abs((1 / c[0]) ** (1 / c[1]) - threshold))
+
+
+class MinHashLSH:
+    """Index LSH de signatures MinHash, avec vérification de la similarité estimée"""
+
+    def __init__(self, num_perm=128, threshold=0.8, seed=42):
+        self.num_perm = num_perm
+        self.threshold = threshold
+        self.bands, self.rows = lsh_params(num_perm, threshold)
+        rng = np.random.RandomState(seed)
+        # a, b < 2^32 et empreintes < 2^32 : a * x + b tient dans un uint64
+        self.a = rng.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = {}
+
+    def signature(self, hashes):
+        values = (hashes[None, :] * self.a[:, None] + self.b[:, None]) % MERSENNE_PRIME
+        return (values & MAX_HASH).min(axis=1).astype(np.uint32)
+
+    def query_insert(self, key, hashes):
+        """
+        Retourner la clé d'un représentant déjà indexé dont la similarité estimée
+        atteint le seuil (ou None). Sans correspondance, l'exemple devient un
+        représentant et est indexé dans chacune de ses bandes.
+        """
+        signature = self.signature(hashes)
+        band_keys = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+        checked = set()
+        for bucket, band_key in zip(self.buckets, band_keys):
+            for candidate in bucket.get(band_key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if np.mean(self.signatures[candidate] == signature) >= self.threshold:
+                    return candidate
+
+        # Seuls les représentants sont indexés et gardés en mémoire pour la vérification
+        for bucket, band_key in zip(self.buckets, band_keys):
+            bucket.setdefault(band_key, []).append(key)
+        self.signatures[key] = signature
+        return None
+
+
+def iter_jsonl(file_path):
+    """(numéro de ligne, objet) pour chaque ligne JSON valide du fichier"""
+    with open(file_path, 'rb') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json_loads(line)
+            except ValueError as e:
+                print(f"{file_path}:{line_number}: erreur de parsing ({e})")
+
+
+def deduplicate(input_paths, output_path, threshold=0.8, num_perm=128, ngram=3, near_duplicates=True):
+    """Dédupliquer les fichiers `input_paths` dans `output_path` et retourner les statistiques"""
+    lsh = MinHashLSH(num_perm=num_perm, threshold=threshold) if near_duplicates else None
+    exact_index = {}
+    keep = {}  # fichier -> numéros des lignes conservées
+    cluster_sizes = Counter()  # représentant -> taille du groupe
+    stats = Counter()
+
+    for file_path in input_paths:
+        print(f"Analyse du fichier: {file_path}")
+        kept_lines = keep.setdefault(file_path, set())
+        for line_number, item in iter_jsonl(file_path):
+            stats["rows"] += 1
+            text = conversation_text(item)
+            if not text:
+                stats["empty"] += 1
+                continue
+
+            key = (file_path, line_number)
+            digest = hashlib.sha1(text.encode("utf-8")).digest()
+            representative = exact_index.get(digest)
+            if representative is not None:
+                stats["exact_duplicates"] += 1
+                cluster_sizes[representative] += 1
+                continue
+            exact_index[digest] = key
+
+            if lsh is not None:
+                representative = lsh.query_insert(key, shingles(text, ngram))
+                if representative is not None:
+                    stats["near_duplicates"] += 1
+                    cluster_sizes[representative] += 1
+                    # Les doublons exacts de cet exemple rejoindront le même groupe
+                    exact_index[digest] = representative
+                    continue
+
+            cluster_sizes[key] += 1
+            kept_lines.add(line_number)
+
+    # Recopier les lignes conservées, dans l'ordre des fichiers. La sortie est
+    # écrite à côté puis renommée : elle peut être l'un des fichiers d'entrée
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    try:
+        with open(tmp_path, 'wb') as out:
+            for file_path in input_paths:
+                kept_lines = keep.get(file_path, set())
+                with open(file_path, 'rb') as f:
+                    for line_number, line in enumerate(f, start=1):
+                        if line_number in kept_lines:
+                            out.write(line if line.endswith(b"\n") else line + b"\n")
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    sizes = [size for size in cluster_sizes.values() if size > 1]
+    stats["kept"] = sum(len(lines) for lines in keep.values())
+    stats["clusters"] = len(sizes)
+    stats["largest_cluster"] = max(sizes, default=0)
+    stats["cluster_size_histogram"] = dict(sorted(Counter(sizes).items()))
+    if lsh is not None:
+        stats["lsh"] = {"bands": lsh.bands, "rows": lsh.rows, "threshold": threshold}
+    return dict(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dédupliquer des fichiers d'entraînement JSONL (doublons exacts et MinHash/LSH)")
+    parser.add_argument("inputs", nargs="+", help="Fichiers JSONL à dédupliquer")
+    parser.add_argument("--output", type=str, required=True, help="Fichier JSONL dédupliqué")
+    parser.add_argument("--threshold", type=float, default=0.8,
+                        help="Similarité de Jaccard à partir de laquelle deux exemples sont des quasi-doublons")
+    parser.add_argument("--num_perm", type=int, default=128, help="Nombre de permutations MinHash")
+    parser.add_argument("--ngram", type=int, default=3, help="Taille des n-grammes de mots")
+    parser.add_argument("--exact_only", action="store_true", help="Ne retirer que les doublons exacts")
+    parser.add_argument("--report", type=str, help="Fichier JSON où écrire les statistiques")
+
+    args = parser.parse_args()
+
+    stats = deduplicate(args.inputs, args.output, args.threshold, args.num_perm, args.ngram,
+                        near_duplicates=not args.exact_only)
+
+    print(f"\nExemples lus: {stats.get('rows', 0)} (vides ou sans conversation: {stats.get('empty', 0)})")
+    print(f"Doublons exacts retirés: {stats.get('exact_duplicates', 0)}")
+    print(f"Quasi-doublons retirés: {stats.get('near_duplicates', 0)}")
+    print(f"Groupes de doublons: {stats['clusters']} (plus grand: {stats['largest_cluster']} exemples)")
+    print(f"Répartition des tailles de groupe: {stats['cluster_size_histogram']}")
+    print(f"Exemples conservés: {stats['kept']} -> {args.output}")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,36 @@
 import os
+import gc
 import json
+import math
+import time
+import bisect
+import hashlib
 import argparse
+import shutil
+from dataclasses import dataclass, field, fields
+from typing import List, Optional
 from dotenv import load_dotenv
-from datasets import Dataset
+from datasets import Dataset, concatenate_datasets, load_from_disk
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
     TrainingArguments,
     Trainer,
-    DataCollatorForLanguageModeling,
+    DataCollatorForSeq2Seq,
     BitsAndBytesConfig
 )
 import torch
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 
+from training_metrics import ThroughputCallback
+
+# Parser JSON plus rapide si disponible
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # Configuration pour éviter la fragmentation de la mémoire CUDA
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
 
@@ -35,17 +52,55 @@ EPOCHS = os.getenv("EPOCHS", "")  # Vide par défaut, sera défini plus tard
 BATCH_SIZE = os.getenv("BATCH_SIZE", "")  # Vide par défaut, sera défini plus tard
 CLEAN_OUTPUT = os.getenv("CLEAN_OUTPUT", "false").lower() == "true"
 
+# Options de batching : longueur maximale, padding au plus long du batch et
+# regroupement des exemples de longueur proche (moins de calcul perdu en padding)
+MAX_LENGTH = int(os.getenv("MAX_LENGTH", "1024"))
+DYNAMIC_PADDING = os.getenv("DYNAMIC_PADDING", "true").lower() == "true"
+GROUP_BY_LENGTH = os.getenv("GROUP_BY_LENGTH", "true").lower() == "true"
+# Regrouper plusieurs exemples courts dans des blocs de MAX_LENGTH tokens
+PACKING = os.getenv("PACKING", "false").lower() == "true"
+
+# Cache disque des données tokenisées (format Arrow, mappé en mémoire au chargement)
+DATASET_CACHE = os.getenv("DATASET_CACHE", "true").lower() == "true"
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", os.path.join(os.path.dirname(__file__), "data", "cache"))
+
+# Ingestion parallèle : nombre de processus et taille des morceaux de fichier
+# traités par un même processus
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+INGEST_CHUNK_MB = int(os.getenv("INGEST_CHUNK_MB", "64"))
+# Nombre minimum d'exemples par processus de tokenisation (sinon le coût de
+# lancement des processus dépasse le gain)
+MIN_EXAMPLES_PER_WORKER = int(os.getenv("MIN_EXAMPLES_PER_WORKER", "5000"))
+
+# Format Mistral des conversations : le system prompt est placé dans le premier
+# message utilisateur, chaque tour est "[INST] question [/INST] réponse</s>"
+SYSTEM_TEMPLATE = "{system}\n\n{user}"
+USER_TEMPLATE = "[INST] {content} [/INST]"
+ASSISTANT_TEMPLATE = " {content}</s>"
+
+# Calculer la loss uniquement sur les réponses de l'assistant (pas sur les prompts)
+ASSISTANT_ONLY_LOSS = os.getenv("ASSISTANT_ONLY_LOSS", "true").lower() == "true"
+
+# Mesures de débit pendant l'entraînement (output_dir/throughput.jsonl et tensorboard)
+THROUGHPUT_METRICS = os.getenv("THROUGHPUT_METRICS", "true").lower() == "true"
+
+# Entraînement data-parallèle sur CPU (backend gloo) : lancer un processus par
+# rang avec torchrun, sur un ou plusieurs nœuds (voir run_finetune.sh --cpu)
+CPU_TRAINING = os.getenv("CPU_TRAINING", "false").lower() == "true"
+# Taille de batch globale visée, tous processus confondus (vide : celle d'un seul processus)
+GLOBAL_BATCH_SIZE = os.getenv("GLOBAL_BATCH_SIZE", "")
+
 # Option pour utiliser un modèle plus petit si la mémoire est insuffisante
 USE_SMALLER_MODEL = os.getenv("USE_SMALLER_MODEL", "false").lower() == "true"
 ALTERNATIVE_MODEL = os.getenv("ALTERNATIVE_MODEL", "false").lower() == "true"
 
-if USE_SMALLER_MODEL:
-    print("Utilisation d'un modèle plus petit pour économiser la mémoire...")
-    if ALTERNATIVE_MODEL:
-        print("Utilisation du modèle alternatif (GPT2)...")
-        BASE_MODEL = "gpt2"  # Modèle encore plus petit et plus simple
-    else:
-        BASE_MODEL = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"  # Modèle beaucoup plus petit (1.1B au lieu de 7B)
+def default_base_model(use_smaller_model, alternative_model):
+    """Modèle de base correspondant aux options use_smaller_model / alternative_model"""
+    if not use_smaller_model:
+        return BASE_MODEL
+    if alternative_model:
+        return "gpt2"  # Modèle encore plus petit et plus simple
+    return "TinyLlama/TinyLlama-1.1B-Chat-v1.0"  # Modèle beaucoup plus petit (1.1B au lieu de 7B)
 
 # Définir les chemins des fichiers d'entraînement
 TRAINING_FILES = [
@@ -57,27 +112,109 @@ TRAINING_FILES = [
     # os.path.join(os.path.dirname(__file__), "data", "training", "votre_nouveau_fichier.jsonl"),
 ]
 
-def load_training_data(file_paths):
-    """Charger et préparer les données d'entraînement"""
-    all_data = []
+@dataclass
+class FineTuneConfig:
+    """
+    Paramètres d'un entraînement. Les valeurs par défaut sont celles des
+    variables d'environnement ci-dessus ; sans base_model explicite, le modèle
+    de base dépend de use_smaller_model et alternative_model.
+    """
+    base_model: Optional[str] = None
+    output_model: str = OUTPUT_MODEL
+    model_id: str = MODEL_ID
+    training_files: List[str] = field(default_factory=lambda: list(TRAINING_FILES))
+    epochs: Optional[int] = int(EPOCHS) if EPOCHS else None  # None : valeur adaptée au modèle
+    batch_size: Optional[int] = int(BATCH_SIZE) if BATCH_SIZE else None
+    continue_training: bool = CONTINUE_TRAINING
+    existing_model: str = EXISTING_MODEL
+    clean_output: bool = CLEAN_OUTPUT
+    max_length: int = MAX_LENGTH
+    dynamic_padding: bool = DYNAMIC_PADDING
+    group_by_length: bool = GROUP_BY_LENGTH
+    packing: bool = PACKING
+    use_smaller_model: bool = USE_SMALLER_MODEL
+    alternative_model: bool = ALTERNATIVE_MODEL
+    cpu_training: bool = CPU_TRAINING
+    global_batch_size: Optional[int] = int(GLOBAL_BATCH_SIZE) if GLOBAL_BATCH_SIZE else None
+    
+    def __post_init__(self):
+        if self.base_model is None:
+            if self.use_smaller_model:
+                print("Utilisation d'un modèle plus petit pour économiser la mémoire...")
+                if self.alternative_model:
+                    print("Utilisation du modèle alternatif (GPT2)...")
+            self.base_model = default_base_model(self.use_smaller_model, self.alternative_model)
     
+    def model_key(self):
+        """Deux entraînements de même clé peuvent partager le modèle de base chargé"""
+        return (self.base_model, self.use_smaller_model, self.alternative_model, self.cpu_training)
+
+def count_lines(file_path, end):
+    """Nombre de lignes avant l'octet `end` (numéro de ligne d'un morceau de fichier)"""
+    count = 0
+    with open(file_path, 'rb') as f:
+        while f.tell() < end:
+            count += f.read(min(1024 * 1024, end - f.tell())).count(b"\n")
+    return count
+
+def iter_file_chunk(file_path, start=0, end=None):
+    """
+    Lire les exemples JSONL des lignes qui commencent entre les octets `start`
+    et `end` du fichier (tout le fichier par défaut).
+    """
+    first_line = None  # Calculé seulement si une erreur doit être signalée
+    with open(file_path, 'rb') as f:
+        if start > 0:
+            # Se placer au début de la première ligne qui commence à partir de `start`
+            f.seek(start - 1)
+            f.readline()
+        chunk_begin = f.tell()
+        line_index = 0
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            line_index += 1
+            if not line.strip():
+                continue
+            try:
+                yield json_loads(line)
+            except ValueError as e:
+                if first_line is None:
+                    first_line = count_lines(file_path, chunk_begin)
+                preview = line[:50].decode("utf-8", errors="replace").rstrip()
+                print(f"{file_path}:{first_line + line_index}: erreur de parsing ({e}): {preview}...", flush=True)
+
+def iter_training_data(file_paths):
+    """Lire les fichiers JSONL ligne par ligne, sans les charger entièrement en mémoire"""
     for file_path in file_paths:
-        if os.path.exists(file_path):
-            print(f"Chargement du fichier: {file_path}")
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                
-                for line in lines:
-                    if line.strip():
-                        try:
-                            item = json.loads(line)
-                            all_data.append(item)
-                        except json.JSONDecodeError:
-                            print(f"Erreur de parsing pour la ligne: {line[:50]}...")
-            
-            print(f"Chargé {len(lines)} exemples d'entraînement depuis {os.path.basename(file_path)}")
-        else:
+        if not os.path.exists(file_path):
+            print(f"Fichier non trouvé: {file_path}")
+            continue
+        
+        print(f"Chargement du fichier: {file_path}")
+        count = 0
+        for item in iter_file_chunk(file_path):
+            count += 1
+            yield item
+        
+        print(f"Chargé {count} exemples d'entraînement depuis {os.path.basename(file_path)}")
+
+def file_chunks(file_paths, chunk_bytes=INGEST_CHUNK_MB * 1024 * 1024):
+    """Découper les fichiers en morceaux (chemin, début, fin) à répartir entre les processus"""
+    chunks = []
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
             print(f"Fichier non trouvé: {file_path}")
+            continue
+        print(f"Chargement du fichier: {file_path}")
+        size = os.path.getsize(file_path)
+        chunks.extend((file_path, start, min(start + chunk_bytes, size)) for start in range(0, max(size, 1), chunk_bytes))
+    return chunks
+
+def load_training_data(file_paths):
+    """Charger et préparer les données d'entraînement"""
+    all_data = list(iter_training_data(file_paths))
     
     print(f"Total: {len(all_data)} exemples d'entraînement chargés")
     
@@ -86,90 +223,447 @@ def load_training_data(file_paths):
     
     return all_data
 
+def conversation_turns(messages):
+    """
+    Regrouper les messages en tours (question, réponse).
+    
+    Le system prompt est ajouté au premier message utilisateur, les messages
+    consécutifs d'un même rôle sont fusionnés, une réponse sans question et une
+    question sans réponse sont ignorées.
+    """
+    system_message = "\n\n".join(msg["content"] for msg in messages if msg["role"] == "system")
+    
+    merged = []
+    for msg in messages:
+        if msg["role"] not in ("user", "assistant"):
+            continue
+        if merged and merged[-1][0] == msg["role"]:
+            merged[-1][1] += "\n\n" + msg["content"]
+        else:
+            merged.append([msg["role"], msg["content"]])
+    
+    if merged and merged[0][0] == "assistant":
+        merged = merged[1:]
+    turns = [(merged[i][1], merged[i + 1][1]) for i in range(0, len(merged) - 1, 2)]
+    
+    if turns and system_message:
+        turns[0] = (SYSTEM_TEMPLATE.format(system=system_message, user=turns[0][0]), turns[0][1])
+    return turns
+
+def format_example(item):
+    """
+    Convertir une conversation (tous ses tours) au format attendu pour le
+    fine-tuning, avec la position des réponses de l'assistant dans le texte.
+    """
+    text = "<s>"
+    assistant_spans = []
+    for user_message, assistant_message in conversation_turns(item.get("messages", [])):
+        text += USER_TEMPLATE.format(content=user_message)
+        start = len(text)
+        text += ASSISTANT_TEMPLATE.format(content=assistant_message)
+        assistant_spans.append([start, len(text)])
+    
+    return {"text": text, "assistant_spans": assistant_spans}
+
 def format_data_for_training(data):
     """Convertir les données au format attendu pour le fine-tuning"""
-    formatted_data = []
+    return [format_example(item) for item in data]
+
+def file_digest(file_path):
+    """Empreinte du contenu d'un fichier d'entraînement"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def generate_formatted_examples(chunks, sources, content_digest=None):
+    """
+    Générateur pour Dataset.from_generator. Chaque exemple garde dans `source`
+    l'indice de son fichier (`sources` : chemin -> indice). `content_digest`
+    n'est pas utilisé ici : il fait partie de l'empreinte calculée par datasets,
+    pour ne pas réutiliser un ancien cache quand un fichier change sans changer
+    de nom.
+    """
+    for file_path, start, end in chunks:
+        for item in iter_file_chunk(file_path, start, end):
+            yield {**format_example(item), "source": sources[file_path]}
+
+def stream_training_dataset(file_paths, content_digest, num_proc=INGEST_WORKERS, cache_dir=None):
+    """
+    Construire le dataset des exemples formatés en streaming (écrit en Arrow au
+    fil de la lecture, dans `cache_dir` ou le cache de datasets par défaut).
+    `content_digest` est l'empreinte du contenu des fichiers ; la colonne
+    `source` donne l'indice du fichier de chaque exemple dans `file_paths`.
     
-    for item in data:
-        messages = item.get("messages", [])
-        
-        system_message = next((msg["content"] for msg in messages if msg["role"] == "system"), "")
-        user_message = next((msg["content"] for msg in messages if msg["role"] == "user"), "")
-        assistant_message = next((msg["content"] for msg in messages if msg["role"] == "assistant"), "")
-        
-        # Format pour l'entraînement
-        formatted_text = f"<s>[INST] {system_message}\n\n{user_message} [/INST] {assistant_message}</s>"
-        
-        formatted_data.append({
-            "text": formatted_text
-        })
+    Les morceaux de fichiers (un par fichier, plusieurs pour les gros fichiers)
+    sont répartis entre `num_proc` processus ; datasets leur attribue des
+    morceaux consécutifs et concatène les résultats dans l'ordre, le dataset
+    est donc identique à une lecture séquentielle.
+    """
+    chunks = file_chunks(file_paths)
+    num_proc = min(num_proc, len(chunks))
+    try:
+        dataset = Dataset.from_generator(
+            generate_formatted_examples,
+            gen_kwargs={
+                "chunks": chunks,
+                "sources": {file_path: index for index, file_path in enumerate(file_paths)},
+                "content_digest": content_digest
+            },
+            num_proc=num_proc if num_proc > 1 else None,
+            cache_dir=cache_dir
+        )
+    except Exception as e:
+        # datasets refuse de construire un dataset vide
+        raise ValueError(f"Aucune donnée d'entraînement valide trouvée ({e})") from e
+    
+    print(f"Total: {len(dataset)} exemples d'entraînement chargés")
+    
+    if len(dataset) == 0:
+        raise ValueError("Aucune donnée d'entraînement valide trouvée")
     
-    return formatted_data
+    return dataset
 
-def fine_tune_model():
-    """Fonction principale pour le fine-tuning avec Hugging Face"""
-    print("Démarrage du fine-tuning avec Hugging Face...")
+def assistant_labels(input_ids, attention_mask, offsets, assistant_spans, assistant_only=ASSISTANT_ONLY_LOSS):
+    """
+    Labels d'un exemple tokenisé : seuls les tokens qui recouvrent une réponse de
+    l'assistant (y compris son </s>) comptent dans la loss, les autres valent -100.
+    """
+    labels = []
+    for token_id, mask, (start, end) in zip(input_ids, attention_mask, offsets):
+        if not mask:
+            labels.append(-100)
+        elif not assistant_only or any(start < span_end and end > span_start for span_start, span_end in assistant_spans):
+            labels.append(token_id)
+        else:
+            labels.append(-100)
+    return labels
+
+def tokenize_dataset(dataset, tokenizer, max_length=MAX_LENGTH, dynamic_padding=DYNAMIC_PADDING,
+                     num_proc=INGEST_WORKERS):
+    """
+    Tokeniser le dataset et ajouter les colonnes `labels` (prompts masqués) et
+    `length` (nombre de tokens réels). Les colonnes autres que `text` et
+    `assistant_spans` (comme `source`) sont conservées.
     
-    # 1. Charger les données d'entraînement
-    raw_data = load_training_data(TRAINING_FILES)
+    Avec le padding dynamique, les exemples ne sont pas complétés ici : le data
+    collator les complète à la longueur du plus long exemple de chaque batch.
+    La tokenisation est répartie sur plusieurs processus selon le nombre total
+    d'exemples à tokeniser (tous fichiers confondus, voir load_tokenized_dataset) :
+    un processus par MIN_EXAMPLES_PER_WORKER exemples, `num_proc` au plus.
     
-    # 2. Formater les données pour l'entraînement
-    formatted_data = format_data_for_training(raw_data)
+    Les exemples dont la troncature à `max_length` a retiré toutes les réponses
+    de l'assistant (aucun label) sont supprimés : ils coûtent une passe avant et
+    arrière sans contribuer à la loss, et un batch qui n'en contient que donne
+    une loss nulle ou NaN.
+    """
+    if not getattr(tokenizer, "is_fast", False):
+        raise ValueError("Un tokenizer rapide (offsets des tokens) est nécessaire pour masquer les prompts")
     
-    # 3. Créer un dataset Hugging Face
-    dataset = Dataset.from_list(formatted_data)
+    def tokenize_function(examples):
+        tokenized = tokenizer(
+            examples["text"],
+            padding=False if dynamic_padding else "max_length",
+            truncation=True,
+            max_length=max_length,
+            return_offsets_mapping=True
+        )
+        tokenized["labels"] = [
+            assistant_labels(*token_info, spans)
+            for *token_info, spans in zip(
+                tokenized["input_ids"], tokenized["attention_mask"], tokenized.pop("offset_mapping"),
+                examples["assistant_spans"]
+            )
+        ]
+        tokenized["length"] = [sum(mask) for mask in tokenized["attention_mask"]]
+        return tokenized
+    
+    num_proc = max(1, min(num_proc, len(dataset) // MIN_EXAMPLES_PER_WORKER))
+    print(f"Tokenisation de {len(dataset)} exemples sur {num_proc} processus")
+    tokenized_dataset = dataset.map(
+        tokenize_function,
+        batched=True,
+        remove_columns=["text", "assistant_spans"],
+        num_proc=num_proc if num_proc > 1 else None
+    )
+    
+    trained = tokenized_dataset.filter(
+        lambda batch: [any(label != -100 for label in labels) for labels in batch],
+        batched=True,
+        input_columns="labels",
+        num_proc=num_proc if num_proc > 1 else None
+    )
+    dropped = len(tokenized_dataset) - len(trained)
+    if dropped:
+        print(f"{dropped} exemples ignorés: aucune réponse de l'assistant dans les {max_length} premiers tokens")
+    return trained
+
+def tokenization_digest(tokenizer, max_length=MAX_LENGTH, dynamic_padding=DYNAMIC_PADDING):
+    """
+    Empreinte des réglages de tokenisation : elle change dès que le tokenizer,
+    la longueur maximale ou le format des exemples change.
+    """
+    digest = hashlib.sha256()
     
-    # 4. Charger le tokenizer et le modèle
-    if CONTINUE_TRAINING:
-        print(f"Continuation de l'entraînement à partir du modèle: {EXISTING_MODEL}")
-        print(f"Chargement du tokenizer depuis le modèle de base: {BASE_MODEL}...")
-        tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, token=HF_API_KEY)
+    if getattr(tokenizer, "is_fast", False):
+        # Les réglages de troncature/padding changent après chaque appel : les ignorer
+        backend = json.loads(tokenizer.backend_tokenizer.to_str())
+        backend.pop("truncation", None)
+        backend.pop("padding", None)
+        digest.update(json.dumps(backend, sort_keys=True).encode("utf-8"))
     else:
-        print(f"Chargement du modèle {BASE_MODEL}...")
-        tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, token=HF_API_KEY)
+        digest.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode("utf-8"))
     
-    # Configurer le tokenizer
-    tokenizer.pad_token = tokenizer.eos_token
+    digest.update(json.dumps({
+        "special_tokens": tokenizer.special_tokens_map,
+        "max_length": max_length,
+        "dynamic_padding": dynamic_padding,
+        "template": [SYSTEM_TEMPLATE, USER_TEMPLATE, ASSISTANT_TEMPLATE],
+        "assistant_only_loss": ASSISTANT_ONLY_LOSS,
+        "drop_unlabeled": True,  # Exemples sans label supprimés (caches antérieurs invalidés)
+    }, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+def dataset_cache_key(content_digest, settings_digest):
+    """Clé du cache d'un fichier tokenisé : contenu du fichier et réglages de tokenisation"""
+    return hashlib.sha256(f"{content_digest}:{settings_digest}".encode("utf-8")).hexdigest()[:32]
+
+def split_by_source(tokenized_dataset, count):
+    """
+    Découper un dataset tokenisé en un dataset par fichier source (colonne
+    `source`, de 0 à `count` - 1). Les exemples d'un fichier sont consécutifs :
+    l'ingestion garde l'ordre des fichiers.
+    """
+    sources = tokenized_dataset["source"]
+    bounds = [0] * (count + 1)
+    for source in sources:
+        bounds[source + 1] += 1
+    for index in range(count):
+        bounds[index + 1] += bounds[index]
+    tokenized_dataset = tokenized_dataset.remove_columns("source")
+    return [tokenized_dataset.select(range(bounds[index], bounds[index + 1])) for index in range(count)]
+
+def save_dataset_cache(dataset, cache_path):
+    """Enregistrer un dataset tokenisé dans le cache et le recharger (mappé en mémoire)"""
+    # Écrire dans un dossier temporaire puis renommer : un cache interrompu n'est jamais lu
+    tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+    try:
+        dataset.save_to_disk(tmp_path)
+        shutil.rmtree(cache_path, ignore_errors=True)
+        os.replace(tmp_path, cache_path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    print(f"Données tokenisées enregistrées dans le cache: {cache_path}")
+    return load_from_disk(cache_path)
+
+def load_tokenized_dataset(file_paths, tokenizer, max_length=MAX_LENGTH, dynamic_padding=DYNAMIC_PADDING):
+    """
+    Charger les données d'entraînement tokenisées.
     
-    # 5. Tokeniser les données
-    def tokenize_function(examples):
-        return tokenizer(examples["text"], padding="max_length", truncation=True, max_length=1024)
+    Si DATASET_CACHE est activé, chaque fichier est tokenisé une fois et
+    enregistré au format Arrow dans DATASET_CACHE_DIR, sous une clé qui dépend
+    de son contenu et des réglages de tokenisation : seuls les fichiers
+    modifiés sont retokenisés. Les fichiers absents du cache sont lus et
+    tokenisés ensemble, en une passe répartie sur les processus d'ingestion,
+    puis découpés en un cache par fichier. Les caches (mappés en mémoire) sont
+    ensuite concaténés dans l'ordre des fichiers.
+    """
+    settings_digest = tokenization_digest(tokenizer, max_length, dynamic_padding)
+    datasets = {}
+    missing = {}  # Fichiers à tokeniser : chemin -> empreinte du contenu
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            print(f"Fichier non trouvé: {file_path}")
+            continue
+        
+        content_digest = file_digest(file_path)
+        if DATASET_CACHE:
+            cache_path = os.path.join(DATASET_CACHE_DIR, dataset_cache_key(content_digest, settings_digest))
+            if os.path.exists(cache_path):
+                print(f"Données tokenisées de {file_path} chargées depuis le cache: {cache_path}")
+                datasets[file_path] = load_from_disk(cache_path)
+                continue
+        missing[file_path] = content_digest
+    
+    if missing:
+        missing_paths = list(missing)
+        # Les fichiers intermédiaires de datasets (exemples formatés, tokenisation)
+        # sont construits à côté du cache puis supprimés
+        build_dir = os.path.join(DATASET_CACHE_DIR, f"build-{os.getpid()}") if DATASET_CACHE else None
+        try:
+            try:
+                dataset = stream_training_dataset(missing_paths, ":".join(missing.values()), cache_dir=build_dir)
+            except ValueError as e:
+                # Aucun exemple valide dans ces fichiers : les fichiers en cache suffisent
+                print(f"{', '.join(missing_paths)} ignoré(s): {e}")
+            else:
+                tokenized = tokenize_dataset(dataset, tokenizer, max_length, dynamic_padding)
+                for file_path, file_dataset in zip(missing_paths, split_by_source(tokenized, len(missing_paths))):
+                    if DATASET_CACHE:
+                        cache_key = dataset_cache_key(missing[file_path], settings_digest)
+                        file_dataset = save_dataset_cache(file_dataset, os.path.join(DATASET_CACHE_DIR, cache_key))
+                    datasets[file_path] = file_dataset
+        finally:
+            if build_dir is not None:
+                shutil.rmtree(build_dir, ignore_errors=True)
     
-    tokenized_dataset = dataset.map(tokenize_function, batched=True)
+    datasets = [datasets[file_path] for file_path in file_paths if file_path in datasets and len(datasets[file_path])]
+    if not datasets:
+        raise ValueError("Aucune donnée d'entraînement valide trouvée")
+    tokenized_dataset = datasets[0] if len(datasets) == 1 else concatenate_datasets(datasets)
+    print(f"Total: {len(tokenized_dataset)} exemples tokenisés")
+    return tokenized_dataset
+
+def length_grouping_args(enabled=GROUP_BY_LENGTH):
+    """Arguments de TrainingArguments pour batcher ensemble les exemples de longueur proche"""
+    if not enabled:
+        return {}
+    # transformers >= 5 remplace group_by_length par train_sampling_strategy
+    if "group_by_length" in TrainingArguments.__dataclass_fields__:
+        return {"group_by_length": True, "length_column_name": "length"}
+    return {"train_sampling_strategy": "group_by_length", "length_column_name": "length"}
+
+def pack_dataset(tokenized_dataset, block_size=MAX_LENGTH, batch_size=1000):
+    """
+    Regrouper les exemples tokenisés dans des blocs d'au plus `block_size` tokens.
+    
+    Les exemples sont placés du plus long au plus court dans le bloc ouvert dont
+    la place restante est la plus petite suffisante (best-fit decreasing, places
+    restantes triées et cherchées par bisection). Seule la colonne `length` est
+    lue pour cette répartition ; les tokens sont ensuite regroupés par un
+    Dataset.map par batches de `batch_size` blocs. Chaque bloc garde la longueur
+    de ses exemples (`example_lengths`) pour que PackedDataCollator empêche
+    l'attention entre exemples différents.
+    """
+    lengths = list(tokenized_dataset["length"])
+    
+    blocks = []  # Indices des exemples de chaque bloc
+    spaces = []  # (place restante, bloc) des blocs pas encore pleins, triés
+    for index in sorted(range(len(lengths)), key=lengths.__getitem__, reverse=True):
+        position = bisect.bisect_left(spaces, (lengths[index], -1))
+        if position < len(spaces):
+            space, block = spaces.pop(position)
+        else:
+            space, block = block_size, len(blocks)
+            blocks.append([])
+        blocks[block].append(index)
+        space -= lengths[index]
+        if space > 0:
+            bisect.insort(spaces, (space, block))
+    
+    def gather_blocks(batch):
+        rows = tokenized_dataset[[i for indices in batch["indices"] for i in indices]]
+        packed = {"input_ids": [], "labels": [], "example_lengths": [], "length": []}
+        row = 0
+        for indices in batch["indices"]:
+            example_lengths = [lengths[i] for i in indices]
+            input_ids, labels = [], []
+            for offset, length in enumerate(example_lengths, row):
+                input_ids.extend(rows["input_ids"][offset][:length])
+                labels.extend(rows["labels"][offset][:length])
+            row += len(indices)
+            packed["input_ids"].append(input_ids)
+            packed["labels"].append(labels)
+            packed["example_lengths"].append(example_lengths)
+            packed["length"].append(sum(example_lengths))
+        return packed
+    
+    packed_dataset = Dataset.from_dict({"indices": blocks}).map(
+        gather_blocks, batched=True, batch_size=batch_size, remove_columns=["indices"], desc="Packing"
+    )
+    
+    print(f"Packing: {len(lengths)} exemples regroupés en {len(blocks)} blocs de {block_size} tokens max "
+          f"(remplissage moyen: {sum(lengths) / (len(blocks) * block_size):.1%})")
+    return packed_dataset
+
+class PackedDataCollator:
+    """
+    Data collator pour les blocs produits par pack_dataset.
+    
+    Le masque d'attention 4D est causal et diagonal par blocs : un token ne voit
+    que les tokens précédents de son propre exemple. Les positions repartent de 0
+    à chaque exemple et le premier token d'un exemple n'est pas prédit à partir
+    de la fin de l'exemple précédent.
+    """
+    
+    def __init__(self, pad_token_id, dtype=torch.float32, pad_to_multiple_of=8):
+        self.pad_token_id = pad_token_id
+        self.dtype = dtype
+        self.pad_to_multiple_of = pad_to_multiple_of
+    
+    def __call__(self, features):
+        length = max(len(f["input_ids"]) for f in features)
+        length = -(-length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        
+        input_ids = torch.full((len(features), length), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((len(features), length), -100, dtype=torch.long)
+        position_ids = torch.zeros((len(features), length), dtype=torch.long)
+        example_ids = torch.full((len(features), length), -1, dtype=torch.long)  # -1 : padding
+        
+        for row, feature in enumerate(features):
+            tokens = torch.tensor(feature["input_ids"], dtype=torch.long)
+            input_ids[row, :len(tokens)] = tokens
+            labels[row, :len(tokens)] = torch.tensor(feature["labels"], dtype=torch.long)
+            offset = 0
+            for example, example_length in enumerate(feature["example_lengths"]):
+                labels[row, offset] = -100
+                position_ids[row, offset:offset + example_length] = torch.arange(example_length)
+                example_ids[row, offset:offset + example_length] = example
+                offset += example_length
+        
+        causal = torch.tril(torch.ones((length, length), dtype=torch.bool))
+        allowed = (example_ids[:, :, None] == example_ids[:, None, :]) & causal
+        # Masque additif (0 = autorisé), format accepté pour les masques 4D personnalisés
+        attention_mask = torch.zeros(allowed.shape, dtype=self.dtype).masked_fill(~allowed, torch.finfo(self.dtype).min)
+        
+        return {
+            "input_ids": input_ids,
+            "labels": labels,
+            "position_ids": position_ids,
+            "attention_mask": attention_mask[:, None],
+        }
+
+def report_throughput(tokenized_dataset, epochs, train_runtime):
+    """Afficher le débit d'entraînement en tokens réels (hors padding) par seconde"""
+    real_tokens = sum(tokenized_dataset["length"]) * epochs
+    tokens_per_second = real_tokens / train_runtime if train_runtime else 0.0
+    print(f"Débit d'entraînement: {tokens_per_second:.1f} tokens/s "
+          f"({real_tokens} tokens réels en {train_runtime:.1f}s)")
+    return tokens_per_second
+
+def load_base_model(config):
+    """Charger le modèle de base, quantifié en 4 bits sauf pour GPT2 et sur CPU"""
+    if config.cpu_training:
+        # Sur CPU : ni quantification bitsandbytes ni fp16, un modèle complet par processus
+        print(f"Chargement du modèle {config.base_model} en float32 pour l'entraînement sur CPU...")
+        return AutoModelForCausalLM.from_pretrained(
+            config.base_model,
+            token=HF_API_KEY,
+            torch_dtype=torch.float32,
+            low_cpu_mem_usage=True
+        )
     
-    # 6. Charger le modèle en fonction de la taille
-    if USE_SMALLER_MODEL:
-        if ALTERNATIVE_MODEL:
+    if config.use_smaller_model:
+        if config.alternative_model:
             # Pour GPT2, pas besoin de quantification
             print("Chargement du modèle GPT2 sans quantification...")
-            model = AutoModelForCausalLM.from_pretrained(
-                BASE_MODEL,
+            return AutoModelForCausalLM.from_pretrained(
+                config.base_model,
                 device_map="auto",
                 token=HF_API_KEY,
                 torch_dtype=torch.float16,
                 low_cpu_mem_usage=True
             )
-        else:
-            # Pour TinyLlama, utiliser QLoRA avec quantification 4-bit
-            print("Chargement du modèle TinyLlama avec QLoRA (quantification 4-bit)...")
-            bnb_config = BitsAndBytesConfig(
-                load_in_4bit=True,
-                bnb_4bit_use_double_quant=True,
-                bnb_4bit_quant_type="nf4",
-                bnb_4bit_compute_dtype=torch.float16
-            )
-            
-            model = AutoModelForCausalLM.from_pretrained(
-                BASE_MODEL,
-                quantization_config=bnb_config,
-                device_map="auto",
-                token=HF_API_KEY,
-                torch_dtype=torch.float16,
-                low_cpu_mem_usage=True
-            )
-            
-            # Préparer le modèle pour l'entraînement 4-bit
-            model = prepare_model_for_kbit_training(model)
+        
+        # Pour TinyLlama, utiliser QLoRA avec quantification 4-bit
+        print("Chargement du modèle TinyLlama avec QLoRA (quantification 4-bit)...")
+        bnb_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_use_double_quant=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.float16
+        )
     else:
         # Pour les grands modèles, utiliser QLoRA avec quantification 4-bit
         print("Chargement du modèle Mistral avec QLoRA (quantification 4-bit)...")
@@ -180,164 +674,341 @@ def fine_tune_model():
             bnb_4bit_compute_dtype=torch.float16,
             llm_int8_enable_fp32_cpu_offload=True
         )
-        
-        model = AutoModelForCausalLM.from_pretrained(
-            BASE_MODEL,
-            quantization_config=bnb_config,
-            device_map="auto",
-            token=HF_API_KEY,
-            torch_dtype=torch.float16,
-            low_cpu_mem_usage=True
-        )
-        
-        # Préparer le modèle pour l'entraînement 4-bit
-        model = prepare_model_for_kbit_training(model)
-    
-    # 7. Configurer LoRA pour un fine-tuning efficace
-    if USE_SMALLER_MODEL:
-        if ALTERNATIVE_MODEL:
-            # Configuration LoRA adaptée à GPT2
-            peft_config = LoraConfig(
-                r=8,
-                lora_alpha=16,
-                lora_dropout=0.05,
-                bias="none",
-                task_type="CAUSAL_LM",
-                target_modules=["c_attn", "c_proj", "c_fc"]  # Modules spécifiques à GPT2
-            )
-        else:
-            # Pour TinyLlama avec QLoRA
-            peft_config = LoraConfig(
-                r=8,  # Réduire pour économiser la mémoire
-                lora_alpha=16,
-                lora_dropout=0.05,
-                bias="none",
-                task_type="CAUSAL_LM",
-                target_modules=["q_proj", "v_proj", "k_proj", "o_proj"]
-            )
-    else:
-        # Pour les grands modèles avec QLoRA
-        peft_config = LoraConfig(
-            r=4,  # Valeur équilibrée pour QLoRA
+    
+    model = AutoModelForCausalLM.from_pretrained(
+        config.base_model,
+        quantization_config=bnb_config,
+        device_map="auto",
+        token=HF_API_KEY,
+        torch_dtype=torch.float16,
+        low_cpu_mem_usage=True
+    )
+    
+    # Préparer le modèle pour l'entraînement 4-bit
+    return prepare_model_for_kbit_training(model)
+
+def lora_config(config):
+    """Configuration LoRA adaptée au modèle"""
+    if config.use_smaller_model and config.alternative_model:
+        # Configuration LoRA adaptée à GPT2
+        return LoraConfig(
+            r=8,
             lora_alpha=16,
             lora_dropout=0.05,
             bias="none",
             task_type="CAUSAL_LM",
-            target_modules=["q_proj", "v_proj", "k_proj", "o_proj"]
+            target_modules=["c_attn", "c_proj", "c_fc"]  # Modules spécifiques à GPT2
+        )
+    return LoraConfig(
+        r=8 if config.use_smaller_model else 4,  # 8 pour TinyLlama, valeur équilibrée pour QLoRA sinon
+        lora_alpha=16,
+        lora_dropout=0.05,
+        bias="none",
+        task_type="CAUSAL_LM",
+        target_modules=["q_proj", "v_proj", "k_proj", "o_proj"]
+    )
+
+def world_size():
+    """Nombre de processus de l'entraînement distribué (défini par torchrun)"""
+    return int(os.getenv("WORLD_SIZE", "1"))
+
+def is_main_process():
+    """Premier processus de l'entraînement distribué (le seul hors torchrun)"""
+    return int(os.getenv("RANK", "0")) == 0
+
+def gradient_accumulation_steps(config, batch_size, default_steps):
+    """
+    Pas d'accumulation qui gardent la même taille de batch globale (batch par
+    processus x nombre de processus x accumulation) quel que soit le nombre de
+    processus. Sans GLOBAL_BATCH_SIZE, la taille visée est celle d'un seul processus.
+    """
+    global_batch_size = config.global_batch_size or batch_size * default_steps
+    return max(1, math.ceil(global_batch_size / (batch_size * world_size())))
+
+def training_arguments(config):
+    """Arguments d'entraînement adaptés au modèle et au nombre de processus"""
+    if config.use_smaller_model and config.alternative_model:
+        # Pour GPT2
+        batch_size, accumulation, epochs = config.batch_size or 4, 4, config.epochs or 3
+        model_args = dict(
+            learning_rate=5e-4,
+            save_steps=100,
+            save_total_limit=2,
+            gradient_checkpointing=False,  # Désactiver pour GPT2
+            optim="adamw_torch_fused",
+        )
+    elif config.use_smaller_model:
+        # Pour TinyLlama avec QLoRA
+        batch_size, accumulation, epochs = config.batch_size or 2, 8, config.epochs or 3
+        model_args = dict(
+            learning_rate=2e-4,
+            save_steps=100,
+            save_total_limit=2,
+            gradient_checkpointing=True,  # Activer pour QLoRA
+            optim="paged_adamw_8bit",  # Optimiseur optimisé pour QLoRA
+            max_grad_norm=0.3,
         )
-    
-    # 8. Préparer le modèle pour le fine-tuning avec LoRA
-    if not (USE_SMALLER_MODEL and ALTERNATIVE_MODEL):
-        # Pas besoin de préparer GPT2 pour l'entraînement 4-bit
-        print("Application de QLoRA au modèle...")
-    
-    model = get_peft_model(model, peft_config)
-    
-    # Afficher le nombre de paramètres entraînables vs total
-    model.print_trainable_parameters()
-    
-    # 9. Configurer l'entraînement
-    if USE_SMALLER_MODEL:
-        if ALTERNATIVE_MODEL:
-            # Pour GPT2
-            epochs = int(EPOCHS) if EPOCHS else 3
-            batch_size = int(BATCH_SIZE) if BATCH_SIZE else 4
-            
-            training_args = TrainingArguments(
-                output_dir=OUTPUT_MODEL,
-                per_device_train_batch_size=batch_size,
-                gradient_accumulation_steps=4,
-                num_train_epochs=epochs,
-                learning_rate=5e-4,
-                fp16=True,
-                logging_steps=10,
-                save_steps=100,
-                save_total_limit=2,
-                push_to_hub=False,
-                gradient_checkpointing=False,  # Désactiver pour GPT2
-                optim="adamw_torch_fused",
-                # Ajouter l'option pour continuer l'entraînement
-                resume_from_checkpoint=EXISTING_MODEL if CONTINUE_TRAINING else None,
-            )
-        else:
-            # Pour TinyLlama avec QLoRA
-            epochs = int(EPOCHS) if EPOCHS else 3
-            batch_size = int(BATCH_SIZE) if BATCH_SIZE else 2
-            
-            training_args = TrainingArguments(
-                output_dir=OUTPUT_MODEL,
-                per_device_train_batch_size=batch_size,
-                gradient_accumulation_steps=8,
-                num_train_epochs=epochs,
-                learning_rate=2e-4,
-                fp16=True,
-                logging_steps=10,
-                save_steps=100,
-                save_total_limit=2,
-                push_to_hub=False,
-                gradient_checkpointing=True,  # Activer pour QLoRA
-                optim="paged_adamw_8bit",  # Optimiseur optimisé pour QLoRA
-                max_grad_norm=0.3,
-                # Ajouter l'option pour continuer l'entraînement
-                resume_from_checkpoint=EXISTING_MODEL if CONTINUE_TRAINING else None,
-            )
     else:
         # Pour les grands modèles avec QLoRA
-        epochs = int(EPOCHS) if EPOCHS else 2
-        batch_size = int(BATCH_SIZE) if BATCH_SIZE else 1
-        
-        training_args = TrainingArguments(
-            output_dir=OUTPUT_MODEL,
-            per_device_train_batch_size=batch_size,
-            gradient_accumulation_steps=16,
-            num_train_epochs=epochs,
+        batch_size, accumulation, epochs = config.batch_size or 1, 16, config.epochs or 2
+        model_args = dict(
             learning_rate=1e-4,
-            fp16=True,
-            logging_steps=10,
             save_steps=200,
             save_total_limit=1,
-            push_to_hub=False,
             gradient_checkpointing=True,
             optim="paged_adamw_8bit",  # Optimiseur optimisé pour QLoRA
             max_grad_norm=0.3,
-            # Ajouter l'option pour continuer l'entraînement
-            resume_from_checkpoint=EXISTING_MODEL if CONTINUE_TRAINING else None,
         )
     
-    # 10. Créer le data collator
-    data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+    if config.cpu_training:
+        # Data-parallèle sur CPU : backend gloo, float32, optimiseur standard
+        # (les optimiseurs 8 bits de bitsandbytes demandent un GPU)
+        model_args.update(use_cpu=True, optim="adamw_torch")
+        if model_args["gradient_checkpointing"]:
+            model_args["gradient_checkpointing_kwargs"] = {"use_reentrant": False}
+    if world_size() > 1:
+        # Seuls les paramètres LoRA sont entraînés, tous utilisés à chaque pas
+        model_args["ddp_find_unused_parameters"] = False
+        if config.cpu_training:
+            # En un seul processus, aucun groupe de processus n'est créé : pas de backend
+            model_args["ddp_backend"] = "gloo"
+    
+    accumulation = gradient_accumulation_steps(config, batch_size, accumulation)
+    print(f"Batch global: {batch_size} exemples x {world_size()} processus x {accumulation} pas d'accumulation "
+          f"= {batch_size * world_size() * accumulation}")
+    
+    return TrainingArguments(
+        output_dir=config.output_model,
+        per_device_train_batch_size=batch_size,
+        gradient_accumulation_steps=accumulation,
+        num_train_epochs=epochs,
+        fp16=not config.cpu_training,
+        logging_steps=10,
+        push_to_hub=False,
+        # Ajouter l'option pour continuer l'entraînement
+        resume_from_checkpoint=config.existing_model if config.continue_training else None,
+        remove_unused_columns=not config.packing,  # example_lengths est lu par PackedDataCollator
+        **length_grouping_args(config.group_by_length),
+        **model_args
+    )
+
+def fine_tune_model(config=None, model=None):
+    """
+    Fine-tuning avec Hugging Face.
+    
+    `model` est un modèle de base déjà chargé par load_base_model (sinon il est
+    chargé ici). Dans ce cas, l'adaptateur LoRA est retiré après la sauvegarde
+    et `model` redevient le modèle de base, réutilisable pour un autre
+    entraînement. Retourne les métriques de l'entraînement, avec les durées de
+    préparation (`setup_time`) et de sauvegarde (`save_time`).
+    """
+    config = config or FineTuneConfig()
+    print("Démarrage du fine-tuning avec Hugging Face...")
+    setup_start = time.perf_counter()
+    
+    if config.clean_output and os.path.isdir(config.output_model):
+        if config.continue_training and os.path.abspath(config.existing_model) == os.path.abspath(config.output_model):
+            print(f"Dossier de sortie conservé (il contient le modèle à continuer): {config.output_model}")
+        else:
+            print(f"Nettoyage du dossier de sortie: {config.output_model}")
+            shutil.rmtree(config.output_model)
+    
+    # 1. Charger le tokenizer
+    if config.continue_training:
+        print(f"Continuation de l'entraînement à partir du modèle: {config.existing_model}")
+        print(f"Chargement du tokenizer depuis le modèle de base: {config.base_model}...")
+    else:
+        print(f"Chargement du modèle {config.base_model}...")
+    tokenizer = AutoTokenizer.from_pretrained(config.base_model, token=HF_API_KEY)
+    
+    # Configurer le tokenizer
+    tokenizer.pad_token = tokenizer.eos_token
+    
+    # 2. Configurer l'entraînement (initialise aussi le groupe de processus en mode distribué)
+    training_args = training_arguments(config)
+    
+    # 3. Charger, formater et tokeniser les données (ou les relire depuis le cache) ;
+    # le packing a besoin des exemples sans padding. En mode distribué, le
+    # premier processus de chaque nœud remplit le cache, les autres le relisent
+    # ensuite ; le Trainer répartit ensuite les batches entre les processus
+    with training_args.main_process_first(desc="préparation des données"):
+        tokenized_dataset = load_tokenized_dataset(
+            config.training_files, tokenizer, config.max_length, dynamic_padding=config.dynamic_padding or config.packing
+        )
+    if config.packing:
+        tokenized_dataset = pack_dataset(tokenized_dataset, config.max_length)
     
-    # 11. Créer le trainer avec device_map=None pour éviter les problèmes de déplacement
+    # 4. Charger le modèle en fonction de la taille (sauf s'il est déjà chargé)
+    keep_base_model = model is not None
+    if model is None:
+        model = load_base_model(config)
+    
+    # 5. Configurer LoRA pour un fine-tuning efficace
+    if not (config.use_smaller_model and config.alternative_model) and not config.cpu_training:
+        # Pas de quantification 4-bit pour GPT2 ni sur CPU
+        print("Application de QLoRA au modèle...")
+    
+    # 6. Préparer le modèle pour le fine-tuning avec LoRA
+    model = get_peft_model(model, lora_config(config))
+    
+    # Afficher le nombre de paramètres entraînables vs total
+    model.print_trainable_parameters()
+    
+    # 7. Créer le data collator (padding à la longueur du plus long exemple du batch)
+    if config.packing:
+        data_collator = PackedDataCollator(
+            tokenizer.pad_token_id, dtype=torch.float16 if training_args.fp16 else torch.float32
+        )
+    else:
+        # Les labels (prompts masqués) sont complétés avec -100
+        data_collator = DataCollatorForSeq2Seq(tokenizer=tokenizer, pad_to_multiple_of=8, label_pad_token_id=-100)
+    
+    # 8. Créer le trainer avec device_map=None pour éviter les problèmes de déplacement
     trainer = Trainer(
         model=model,
         args=training_args,
         train_dataset=tokenized_dataset,
         data_collator=data_collator,
     )
+    if THROUGHPUT_METRICS:
+        # Tokens/s réels et avec padding, répartition du temps par pas, pic mémoire
+        ThroughputCallback.attach(trainer)
     
-    # 12. Lancer l'entraînement
+    # 9. Lancer l'entraînement
     print("Lancement de l'entraînement...")
-    trainer.train()
+    setup_time = time.perf_counter() - setup_start
+    train_result = trainer.train()
+    if trainer.is_world_process_zero():
+        report_throughput(tokenized_dataset, training_args.num_train_epochs, train_result.metrics["train_runtime"])
     
-    # 13. Sauvegarder le modèle
+    # 10. Sauvegarder le modèle (l'adaptateur LoRA seul)
     print("Sauvegarde du modèle...")
+    save_start = time.perf_counter()
     trainer.save_model()
+    save_time = time.perf_counter() - save_start
     
-    # 14. Pousser le modèle sur Hugging Face Hub
+    # 11. Pousser le modèle sur Hugging Face Hub
     if training_args.push_to_hub:
-        print(f"Publication du modèle sur Hugging Face Hub: {MODEL_ID}")
+        print(f"Publication du modèle sur Hugging Face Hub: {config.model_id}")
         trainer.push_to_hub()
     else:
-        print(f"Le modèle est sauvegardé localement dans: {OUTPUT_MODEL}")
+        print(f"Le modèle est sauvegardé localement dans: {config.output_model}")
     
     print("Fine-tuning terminé avec succès !")
     if training_args.push_to_hub:
-        print(f"Votre modèle est disponible à l'adresse: https://huggingface.co/{MODEL_ID}")
+        print(f"Votre modèle est disponible à l'adresse: https://huggingface.co/{config.model_id}")
     else:
-        print(f"Votre modèle est disponible localement dans: {OUTPUT_MODEL}")
+        print(f"Votre modèle est disponible localement dans: {config.output_model}")
+    
+    if keep_base_model:
+        # Retirer les couches LoRA : le modèle de base reste chargé pour l'entraînement suivant
+        model.unload()
+    return {**train_result.metrics, "setup_time": setup_time, "save_time": save_time}
+
+def release_memory():
+    """Libérer la mémoire (optimiseur, activations) d'un entraînement terminé"""
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def run_training_queue(configs):
+    """
+    Enchaîner plusieurs entraînements dans le même processus (par exemple un
+    adaptateur par agent : sql, elasticsearch, workflow...).
+    
+    Le modèle de base quantifié reste chargé : chaque entraînement lui ajoute un
+    nouvel adaptateur LoRA, le sauvegarde puis le retire. Le modèle n'est
+    rechargé que lorsqu'il change d'un entraînement au suivant. Retourne les
+    métriques de chaque entraînement, avec le temps de chargement du modèle.
+    """
+    results = []
+    model, model_key = None, None
+    for index, config in enumerate(configs, 1):
+        print(f"\n=== Entraînement {index}/{len(configs)}: {config.output_model} ===")
+        load_time = 0.0
+        if config.model_key() != model_key:
+            model = None  # Libérer l'ancien modèle avant d'en charger un autre
+            release_memory()
+            load_start = time.perf_counter()
+            model, model_key = load_base_model(config), config.model_key()
+            load_time = time.perf_counter() - load_start
+        else:
+            print(f"Réutilisation du modèle de base déjà chargé: {config.base_model}")
+        
+        metrics = fine_tune_model(config, model=model)
+        metrics.update(output_model=config.output_model, load_time=load_time)
+        results.append(metrics)
+        if is_main_process():
+            print(f"Durées: chargement du modèle {load_time:.1f}s, préparation {metrics['setup_time']:.1f}s, "
+                  f"entraînement {metrics['train_runtime']:.1f}s, sauvegarde {metrics['save_time']:.1f}s")
+        release_memory()
+    
+    if is_main_process():
+        report_job_times(results)
+    return results
+
+def report_job_times(results):
+    """Afficher, pour chaque entraînement, le temps de mise en place et le temps d'entraînement"""
+    print(f"\n{'entraînement':>30} | {'chargement (s)':>14} | {'préparation (s)':>15} | "
+          f"{'entraînement (s)':>16} | {'sauvegarde (s)':>14}")
+    print("-" * 103)
+    for metrics in results:
+        print(f"{metrics['output_model'][-30:]:>30} | {metrics['load_time']:>14.1f} | {metrics['setup_time']:>15.1f} | "
+              f"{metrics['train_runtime']:>16.1f} | {metrics['save_time']:>14.1f}")
+    setup = sum(m["load_time"] + m["setup_time"] + m["save_time"] for m in results)
+    train = sum(m["train_runtime"] for m in results)
+    print(f"\nTotal: mise en place {setup:.1f}s, entraînement {train:.1f}s "
+          f"({train / (setup + train):.0%} du temps passé à entraîner)" if setup + train else "")
+
+def load_configs(config_path, overrides):
+    """
+    Configurations d'entraînement d'un fichier JSON (un objet ou une liste
+    d'objets avec les champs de FineTuneConfig), complétées par `overrides`.
+    """
+    entries = [{}]
+    if config_path:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = [entries]
+    
+    known = {f.name for f in fields(FineTuneConfig)}
+    configs = []
+    for entry in entries:
+        unknown = set(entry) - known
+        if unknown:
+            raise ValueError(f"Champs de configuration inconnus: {', '.join(sorted(unknown))}")
+        configs.append(FineTuneConfig(**{**entry, **overrides}))
+    return configs
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fine-tune a language model for construction company analysis")
+    parser.add_argument("--config", type=str,
+                        help="Fichier JSON : un objet ou une liste d'objets (entraînements enchaînés sans recharger le modèle de base), "
+                             "ex. [{\"output_model\": \"agents/sql\", \"training_files\": [\"data/training/sql.jsonl\"]}, ...]")
+    parser.add_argument("--report", type=str, help="Fichier JSON où écrire les métriques et durées de chaque entraînement")
+    parser.add_argument("--training_files", nargs="+", help="Fichiers JSONL d'entraînement")
+    parser.add_argument("--base_model", type=str, help="Modèle de base")
+    parser.add_argument("--output_model", type=str, help="Dossier de sortie du modèle")
+    parser.add_argument("--epochs", type=int, help="Nombre d'époques")
+    parser.add_argument("--batch_size", type=int, help="Taille du batch")
+    parser.add_argument("--max_length", type=int, help="Longueur maximale des exemples")
+    parser.add_argument("--continue_training", action=argparse.BooleanOptionalAction, help="Continuer un entraînement existant")
+    parser.add_argument("--existing_model", type=str, help="Modèle à continuer")
+    parser.add_argument("--clean_output", action=argparse.BooleanOptionalAction, help="Nettoyer le dossier de sortie")
+    parser.add_argument("--packing", action=argparse.BooleanOptionalAction, help="Regrouper les exemples courts")
+    parser.add_argument("--use_smaller_model", action=argparse.BooleanOptionalAction, help="Modèle TinyLlama (ou GPT2)")
+    parser.add_argument("--alternative_model", action=argparse.BooleanOptionalAction, help="Modèle GPT2 sans quantification")
+    parser.add_argument("--cpu_training", action=argparse.BooleanOptionalAction,
+                        help="Entraînement sur CPU, data-parallèle si lancé avec torchrun (backend gloo)")
+    parser.add_argument("--global_batch_size", type=int, help="Taille de batch globale, tous processus confondus")
     args = parser.parse_args()
     
-    fine_tune_model() 
\ No newline at end of file
+    # Les options de la ligne de commande s'appliquent à toutes les configurations du fichier
+    overrides = {key: value for key, value in vars(args).items() if key not in ("config", "report") and value is not None}
+    results = run_training_queue(load_configs(args.config, overrides))
+    
+    # En mode distribué, seul le premier processus écrit le rapport
+    if args.report and is_main_process():
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
@@ -4,6 +4,8 @@ Script pour utiliser le modèle fine-tuné pour l'inférence.
 """
 
 import os
+import json
+import time
 import argparse
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
@@ -17,8 +19,14 @@ load_dotenv()
 MODEL_PATH = os.getenv("MODEL_PATH", "jordanS/agent_router")
 BASE_MODEL = os.getenv("BASE_MODEL", "TinyLlama/TinyLlama-1.1B-Chat-v1.0")
 
-def load_model(model_path, base_model=None, use_8bit=False, use_4bit=True):
-    """Charger le modèle fine-tuné"""
+def load_model(model_path, base_model=None, use_8bit=False, use_4bit=True, fast_load=False):
+    """
+    Charger le modèle fine-tuné.
+    
+    Avec `fast_load`, le modèle est un modèle fusionné par merge_adapter.py :
+    ses shards safetensors sont chargés dans le type où ils ont été sauvegardés,
+    sans quantification ni conversion en float16.
+    """
     print(f"Chargement du modèle depuis {model_path}...")
     
     # Vérifier si le modèle est un modèle PEFT (LoRA)
@@ -32,6 +40,15 @@ def load_model(model_path, base_model=None, use_8bit=False, use_4bit=True):
         base_model_path = model_path
         print(f"Modèle standard détecté: {base_model_path}")
     
+    load_kwargs = {}
+    if fast_load:
+        if is_peft_model:
+            print("ATTENTION: le chargement rapide est prévu pour un modèle fusionné (voir merge_adapter.py)")
+        if use_4bit or use_8bit:
+            print("Quantification désactivée: le modèle fusionné est chargé dans son type de sauvegarde")
+            use_4bit = use_8bit = False
+        load_kwargs = {"use_safetensors": True}
+    
     # Configurer la quantification si nécessaire
     if use_4bit:
         from transformers import BitsAndBytesConfig
@@ -56,20 +73,24 @@ def load_model(model_path, base_model=None, use_8bit=False, use_4bit=True):
                 base_model_path,
                 quantization_config=quantization_config,
                 device_map="auto",
-                torch_dtype=torch.float16
+                torch_dtype=torch.float16,
+                **load_kwargs
             )
         else:
             model = AutoModelForCausalLM.from_pretrained(
                 base_model_path,
                 load_in_8bit=True,
                 device_map="auto",
-                torch_dtype=torch.float16
+                torch_dtype=torch.float16,
+                **load_kwargs
             )
     else:
         model = AutoModelForCausalLM.from_pretrained(
             base_model_path,
             device_map="auto",
-            torch_dtype=torch.float16
+            # Les poids fusionnés sont déjà sauvegardés dans le type voulu
+            torch_dtype="auto" if fast_load else torch.float16,
+            **load_kwargs
         )
     
     # Charger les adaptateurs LoRA si c'est un modèle PEFT
@@ -78,13 +99,15 @@ def load_model(model_path, base_model=None, use_8bit=False, use_4bit=True):
     
     return model, tokenizer
 
-def generate_response(model, tokenizer, prompt, system_prompt=None, max_length=1024, temperature=0.7):
-    """Générer une réponse à partir du prompt"""
-    # Formater le prompt avec le format Mistral
+def format_prompt(prompt, system_prompt=None):
+    """Formater le prompt avec le format Mistral"""
     if system_prompt:
-        formatted_prompt = f"<s>[INST] {system_prompt}\n\n{prompt} [/INST]"
-    else:
-        formatted_prompt = f"<s>[INST] {prompt} [/INST]"
+        return f"<s>[INST] {system_prompt}\n\n{prompt} [/INST]"
+    return f"<s>[INST] {prompt} [/INST]"
+
+def generate_response(model, tokenizer, prompt, system_prompt=None, max_length=1024, temperature=0.7, streamer=None):
+    """Générer une réponse à partir du prompt (`streamer` reçoit les tokens au fil de la génération)"""
+    formatted_prompt = format_prompt(prompt, system_prompt)
     
     # Tokeniser le prompt
     inputs = tokenizer(formatted_prompt, return_tensors="pt").to(model.device)
@@ -98,7 +121,8 @@ def generate_response(model, tokenizer, prompt, system_prompt=None, max_length=1
             do_sample=True,
             top_p=0.95,
             top_k=50,
-            repetition_penalty=1.1
+            repetition_penalty=1.1,
+            streamer=streamer
         )
     
     # Décoder la réponse
@@ -112,6 +136,148 @@ def generate_response(model, tokenizer, prompt, system_prompt=None, max_length=1
     
     return response
 
+def generate_batch(model, tokenizer, formatted_prompts, max_new_tokens=512, temperature=0.7):
+    """
+    Générer les réponses d'un batch de prompts formatés, complétés à gauche pour
+    que la génération de tous les prompts reprenne à la même position.
+    Avec temperature=0, le décodage est glouton (résultats reproductibles).
+    """
+    inputs = tokenizer(formatted_prompts, return_tensors="pt", padding=True).to(model.device)
+    sampling = {"do_sample": True, "temperature": temperature, "top_p": 0.95, "top_k": 50} if temperature > 0 else {"do_sample": False}
+    
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            repetition_penalty=1.1,
+            pad_token_id=tokenizer.pad_token_id,
+            **sampling
+        )
+    
+    # Ne décoder que les tokens générés
+    generated = outputs[:, inputs.input_ids.shape[1]:]
+    return [response.strip() for response in tokenizer.batch_decode(generated, skip_special_tokens=True)]
+
+def record_prompt(record, system_prompt=None):
+    """
+    Prompt d'une ligne du fichier d'entrée : {"prompt": ..., "system_prompt": ...}
+    ou conversation {"messages": [...]} (dernier message utilisateur, la réponse
+    de l'assistant qui le suit est gardée comme réponse attendue).
+    Retourne (prompt, system_prompt, réponse attendue ou None).
+    """
+    if "prompt" in record:
+        return record["prompt"], record.get("system_prompt", system_prompt), record.get("expected")
+    
+    messages = record.get("messages") or []
+    system = next((msg["content"] for msg in messages if msg.get("role") == "system"), system_prompt)
+    users = [i for i, msg in enumerate(messages) if msg.get("role") == "user"]
+    if not users:
+        raise ValueError("ni 'prompt' ni message utilisateur")
+    expected = next((msg["content"] for msg in messages[users[-1] + 1:] if msg.get("role") == "assistant"), None)
+    return messages[users[-1]]["content"], system, expected
+
+def completed_lines(output_file):
+    """
+    Nombre de résultats déjà écrits dans le fichier de sortie (reprise après
+    interruption). Une dernière ligne incomplète est supprimée.
+    """
+    if not os.path.exists(output_file):
+        return 0
+    with open(output_file, 'rb+') as f:
+        content = f.read()
+        complete = content.rfind(b"\n") + 1
+        if complete < len(content):
+            f.truncate(complete)
+    return content[:complete].count(b"\n")
+
+def iter_input_records(input_file, skip=0):
+    """(index, objet ou message d'erreur) pour chaque ligne non vide du fichier d'entrée"""
+    index = 0
+    with open(input_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if index >= skip:
+                try:
+                    yield index, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield index, f"erreur de parsing ({e})"
+            index += 1
+
+def batch_inference(model, tokenizer, input_file, output_file, system_prompt=None, batch_size=8,
+                    window=1024, max_new_tokens=512, temperature=0.7):
+    """
+    Générer les réponses de tous les prompts d'un fichier JSONL.
+    
+    Le fichier est lu par fenêtres de `window` lignes ; dans une fenêtre, les
+    prompts sont triés par nombre de tokens pour former des batches de longueurs
+    proches (peu de padding). Les résultats sont écrits dans l'ordre du fichier
+    d'entrée, au fur et à mesure : une exécution interrompue reprend après le
+    dernier résultat écrit.
+    """
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    
+    skip = completed_lines(output_file)
+    if skip:
+        print(f"Reprise après {skip} résultats déjà écrits dans {output_file}")
+    
+    start = time.time()
+    done = 0
+    records = iter_input_records(input_file, skip)
+    with open(output_file, 'a', encoding='utf-8') as out:
+        while True:
+            chunk = [record for _, record in zip(range(window), records)]
+            if not chunk:
+                break
+            
+            results = {}  # index -> résultat terminé, en attente d'écriture
+            prompts = {}  # index -> (début du résultat, prompt formaté)
+            for index, record in chunk:
+                result = {"index": index}
+                try:
+                    if not isinstance(record, dict):
+                        raise ValueError(record)
+                    if "id" in record:
+                        result["id"] = record["id"]
+                    prompt, system, expected = record_prompt(record, system_prompt)
+                    result["prompt"] = prompt
+                    if expected is not None:
+                        result["expected"] = expected
+                    prompts[index] = (result, format_prompt(prompt, system))
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    result["error"] = f"entrée invalide: {e}"
+                    results[index] = result
+            
+            # Trier par longueur en tokens pour limiter le padding dans chaque batch
+            order = list(prompts)
+            if order:
+                token_ids = tokenizer([prompts[index][1] for index in order])["input_ids"]
+                lengths = dict(zip(order, map(len, token_ids)))
+                order.sort(key=lengths.get)
+            
+            next_index = chunk[0][0]
+            for i in range(0, max(len(order), 1), batch_size):
+                batch = order[i:i + batch_size]
+                if batch:
+                    responses = generate_batch(
+                        model, tokenizer, [prompts[index][1] for index in batch], max_new_tokens, temperature
+                    )
+                    for index, response in zip(batch, responses):
+                        results[index] = {**prompts.pop(index)[0], "response": response}
+                
+                # Écrire les résultats dont tous les prédécesseurs sont écrits
+                while next_index in results:
+                    out.write(json.dumps(results.pop(next_index), ensure_ascii=False) + "\n")
+                    next_index += 1
+                out.flush()
+            
+            done += len(chunk)
+            print(f"{skip + done} prompts traités ({done / (time.time() - start):.1f} prompts/s)")
+    
+    print(f"Résultats écrits dans {output_file}")
+
 def interactive_mode(model, tokenizer, system_prompt=None):
     """Mode interactif pour discuter avec le modèle"""
     print("\n" + "="*50)
@@ -140,21 +306,32 @@ def main():
     parser.add_argument("--system_prompt", type=str, default="Tu es un assistant IA expert en analyse de documents pour une entreprise de construction.", help="System prompt")
     parser.add_argument("--interactive", action="store_true", help="Mode interactif")
     parser.add_argument("--use_8bit", action="store_true", help="Utiliser la quantification 8-bit")
-    parser.add_argument("--use_4bit", action="store_true", default=True, help="Utiliser la quantification 4-bit")
+    parser.add_argument("--use_4bit", action=argparse.BooleanOptionalAction, default=True,
+                        help="Utiliser la quantification 4-bit (--no-use_4bit pour la désactiver, ignorée avec --fast_load)")
+    parser.add_argument("--fast_load", action="store_true", help="Chargement rapide d'un modèle fusionné (shards safetensors)")
+    parser.add_argument("--input_file", type=str, help="Fichier JSONL de prompts ({\"prompt\": ...} ou {\"messages\": [...]}) à traiter en batch")
+    parser.add_argument("--output_file", type=str, help="Fichier JSONL des réponses (dans l'ordre du fichier d'entrée, reprise possible)")
+    parser.add_argument("--batch_size", type=int, default=8, help="Nombre de prompts générés ensemble en mode batch")
+    parser.add_argument("--max_new_tokens", type=int, default=512, help="Nombre maximum de tokens générés par réponse en mode batch")
+    parser.add_argument("--temperature", type=float, default=0.7, help="Température d'échantillonnage (0 = décodage glouton)")
     
     args = parser.parse_args()
     
     # Charger le modèle
-    model, tokenizer = load_model(args.model_path, args.base_model, args.use_8bit, args.use_4bit)
+    model, tokenizer = load_model(args.model_path, args.base_model, args.use_8bit, args.use_4bit and not args.use_8bit, args.fast_load)
     
-    # Mode interactif ou génération unique
-    if args.interactive:
+    # Mode batch, interactif ou génération unique
+    if args.input_file:
+        output_file = args.output_file or os.path.splitext(args.input_file)[0] + ".responses.jsonl"
+        batch_inference(model, tokenizer, args.input_file, output_file, args.system_prompt, args.batch_size,
+                        max_new_tokens=args.max_new_tokens, temperature=args.temperature)
+    elif args.interactive:
         interactive_mode(model, tokenizer, args.system_prompt)
     elif args.prompt:
         response = generate_response(model, tokenizer, args.prompt, args.system_prompt)
         print(f"\nRéponse: {response}")
     else:
-        print("Veuillez spécifier un prompt avec --prompt ou utiliser le mode interactif avec --interactive")
+        print("Veuillez spécifier un prompt avec --prompt, un fichier avec --input_file ou utiliser le mode interactif avec --interactive")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
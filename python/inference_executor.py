@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Exécuteur dédié aux appels bloquants du modèle.
+
+Les générations s'exécutent dans un thread de travail unique, derrière une
+file bornée, pour que la boucle asyncio de FastAPI reste disponible pour
+`/health`, `/status` et l'admission des nouvelles requêtes.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(RuntimeError):
+    """La file d'attente de l'exécuteur est pleine"""
+
+
+class InferenceExecutor:
+    """Thread de travail unique avec une file d'attente bornée"""
+
+    def __init__(self, max_queue_size=32, name="inference"):
+        self.max_queue_size = max_queue_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+
+    @property
+    def queue_depth(self):
+        """Nombre de tâches en attente (hors tâche en cours)"""
+        return self._pending - self._running
+
+    @property
+    def in_flight(self):
+        """Nombre total de tâches acceptées et non terminées"""
+        return self._pending
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "running": self._running,
+            "max_queue_size": self.max_queue_size
+        }
+
+    def submit(self, fn, *args, **kwargs):
+        """Soumettre une tâche bloquante et retourner un concurrent.futures.Future"""
+        with self._lock:
+            if self._pending >= self.max_queue_size:
+                raise QueueFullError(f"File d'inférence pleine ({self.max_queue_size} requêtes en attente)")
+            self._pending += 1
+
+        def task():
+            with self._lock:
+                self._running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._pending -= 1
+
+        try:
+            return self._executor.submit(task)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    async def run(self, fn, *args, **kwargs):
+        """Exécuter une tâche bloquante sans bloquer la boucle asyncio"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
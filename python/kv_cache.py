@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Gestion du cache KV (past_key_values) : conversion entre les formats de
+transformers et cache des préfixes de prompt (system prompt) réutilisables.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def to_legacy_cache(past_key_values):
+    """Convertir un cache KV transformers en tuple ((k, v), ...) par couche"""
+    if isinstance(past_key_values, (tuple, list)):
+        return tuple((layer[0], layer[1]) for layer in past_key_values)
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    # transformers >= 5 : le cache est une liste de couches
+    return tuple((layer.keys, layer.values) for layer in past_key_values.layers)
+
+
+def from_legacy_cache(legacy_cache):
+    """Reconstruire un cache utilisable par le modèle à partir des tuples (k, v)"""
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        return legacy_cache
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(legacy_cache)
+    return DynamicCache(legacy_cache)
+
+
+def cache_size_bytes(legacy_cache):
+    """Mémoire occupée par un cache KV au format tuple"""
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in legacy_cache)
+
+
+def common_prefix_length(prefix_ids, input_ids):
+    """
+    Nombre de tokens communs en tête de `prefix_ids` et `input_ids`.
+
+    Le system prompt tokenisé seul et le prompt complet peuvent différer sur le
+    dernier token (fusion avec le texte qui suit) : seule la partie commune est
+    réutilisable.
+    """
+    length = 0
+    for a, b in zip(prefix_ids, input_ids):
+        if a != b:
+            break
+        length += 1
+    # Il faut toujours au moins un token à encoder après le préfixe
+    return min(length, len(input_ids) - 1)
+
+
+class PrefixCache:
+    """
+    Cache LRU des past_key_values calculés pour des préfixes de prompt.
+
+    La clé est la séquence de token ids du préfixe et l'adaptateur LoRA utilisé
+    (le cache KV dépend des poids de l'adaptateur) ; la taille totale est bornée
+    en octets.
+    """
+
+    def __init__(self, model, max_bytes=512 * 1024 * 1024, min_prefix_tokens=16):
+        self.model = model
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def get(self, prefix_ids, adapter_name=None):
+        """Retourner le cache KV (format tuple) du préfixe, en le calculant si nécessaire"""
+        key = (adapter_name, tuple(prefix_ids))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        legacy_cache = self._compute(prefix_ids, adapter_name)
+        size = cache_size_bytes(legacy_cache)
+
+        with self._lock:
+            if size <= self.max_bytes and key not in self._entries:
+                self._entries[key] = (legacy_cache, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self._bytes -= evicted_size
+        return legacy_cache
+
+    def clear(self, adapter_name=None):
+        """Vider le cache (ou seulement les entrées d'un adaptateur)"""
+        with self._lock:
+            for key in [k for k in self._entries if adapter_name is None or k[0] == adapter_name]:
+                _, size = self._entries.pop(key)
+                self._bytes -= size
+
+    @torch.no_grad()
+    def _compute(self, prefix_ids, adapter_name=None):
+        input_ids = torch.tensor([list(prefix_ids)], device=self.model.device)
+        adapter_kwargs = {"adapter_names": [adapter_name]} if adapter_name is not None else {}
+        outputs = self.model(input_ids=input_ids, use_cache=True, **adapter_kwargs)
+        return to_legacy_cache(outputs.past_key_values)
+
+    def split(self, tokenizer, prefix_text, input_ids):
+        """
+        Longueur du préfixe réutilisable de `input_ids` pour le texte `prefix_text`,
+        ou 0 si le préfixe est trop court pour valoir la peine d'être mis en cache.
+        """
+        prefix_ids = tokenizer(prefix_text).input_ids
+        length = common_prefix_length(prefix_ids, input_ids)
+        return length if length >= self.min_prefix_tokens else 0
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Fusionner un adaptateur LoRA dans les poids du modèle de base.
+
+Le modèle fusionné est sauvegardé en shards safetensors : il se charge ensuite
+comme un modèle standard (sans `PeftModel`), avec `load_model(..., fast_load=True)`
+dans inference.py, et n'a plus le surcoût LoRA à chaque passe avant.
+"""
+
+import os
+import json
+import argparse
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from peft import PeftModel, PeftConfig
+
+# Charger les variables d'environnement
+from dotenv import load_dotenv
+load_dotenv()
+
+# Configuration
+MODEL_PATH = os.getenv("MODEL_PATH", "jordanS/agent_router")
+BASE_MODEL = os.getenv("BASE_MODEL", "")
+
+DTYPES = {
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "float32": torch.float32,
+}
+
+def merge_adapter(adapter_path, output_dir, base_model=None, max_shard_size="2GB", dtype="float16"):
+    """
+    Fusionner l'adaptateur `adapter_path` dans son modèle de base et sauvegarder
+    le résultat dans `output_dir` (shards safetensors + tokenizer).
+    """
+    config = PeftConfig.from_pretrained(adapter_path)
+    base_model_path = base_model or config.base_model_name_or_path
+    print(f"Chargement du modèle de base: {base_model_path}")
+
+    # La fusion se fait sur des poids non quantifiés : fusionner dans un modèle
+    # 4-bit dégraderait les poids (la quantification peut se faire au chargement)
+    model = AutoModelForCausalLM.from_pretrained(
+        base_model_path,
+        torch_dtype=DTYPES[dtype],
+        low_cpu_mem_usage=True
+    )
+    tokenizer = AutoTokenizer.from_pretrained(base_model_path)
+
+    print(f"Fusion de l'adaptateur: {adapter_path}")
+    model = PeftModel.from_pretrained(model, adapter_path)
+    model = model.merge_and_unload()
+
+    print(f"Sauvegarde du modèle fusionné dans {output_dir} (shards de {max_shard_size} max)")
+    model.save_pretrained(output_dir, safe_serialization=True, max_shard_size=max_shard_size)
+    tokenizer.save_pretrained(output_dir)
+
+    # Garder la trace de l'origine du modèle fusionné
+    with open(os.path.join(output_dir, "merge_info.json"), "w", encoding="utf-8") as f:
+        json.dump({"base_model": base_model_path, "adapter": adapter_path, "dtype": dtype}, f, indent=2)
+
+    return output_dir
+
+def main():
+    parser = argparse.ArgumentParser(description="Fusionner un adaptateur LoRA dans le modèle de base")
+    parser.add_argument("--model_path", type=str, default=MODEL_PATH, help="Chemin vers l'adaptateur LoRA")
+    parser.add_argument("--base_model", type=str, default=BASE_MODEL or None,
+                        help="Modèle de base (par défaut celui de la configuration de l'adaptateur)")
+    parser.add_argument("--output_dir", type=str, default="./merged_model", help="Dossier de sortie du modèle fusionné")
+    parser.add_argument("--max_shard_size", type=str, default="2GB", help="Taille maximale d'un shard safetensors")
+    parser.add_argument("--dtype", type=str, default="float16", choices=list(DTYPES),
+                        help="Type des poids du modèle fusionné")
+
+    args = parser.parse_args()
+
+    merge_adapter(args.model_path, args.output_dir, args.base_model, args.max_shard_size, args.dtype)
+    print(f"Modèle fusionné disponible dans {args.output_dir}")
+    print(f"Utilisation: python inference.py --model_path {args.output_dir} --fast_load --prompt \"...\"")
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,26 @@ API FastAPI pour exposer le modèle fine-tuné
 """
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional, Union
 import uvicorn
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteriaList, TextIteratorStreamer
 from peft import PeftModel, PeftConfig
+import asyncio
 import os
 import logging
+import threading
+import itertools
+import time
+
+from batch_generation import generate_isolated, group_by_params, padded_generate
+from batch_scheduler import ContinuousBatchScheduler
+from inference_executor import InferenceExecutor, QueueFullError
+from kv_cache import PrefixCache, from_legacy_cache
+from response_cache import ResponseCache, make_cache_key
+from streaming import CancelledCriteria, IncrementalDecoder, StreamCleaner, iterate_in_thread, sse_event
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
@@ -21,20 +34,89 @@ app = FastAPI(title="API Modèle Fine-tuné", description="API pour le modèle M
 # Configuration
 MODEL_PATH = os.getenv("MODEL_PATH", "jordanS/analyse_agent")
 BASE_MODEL = os.getenv("BASE_MODEL", "mistralai/Mistral-7B-v0.1")
+CONTINUOUS_BATCHING = os.getenv("CONTINUOUS_BATCHING", "true").lower() == "true"
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "8"))
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "64"))
+PREFIX_CACHE = os.getenv("PREFIX_CACHE", "true").lower() == "true"
+PREFIX_CACHE_MB = int(os.getenv("PREFIX_CACHE_MB", "512"))
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Nombre maximum de prompts par requête /generate_batch
+MAX_BATCH_PROMPTS = int(os.getenv("MAX_BATCH_PROMPTS", "1024"))
+# Adaptateurs LoRA servis sur le même modèle de base : MODEL_PATH est chargé sous
+# le nom DEFAULT_ADAPTER, ADAPTERS en ajoute d'autres ("nom=chemin,nom2=chemin2")
+# (un modèle fusionné par merge_adapter.py n'a plus d'adaptateur à choisir : il se
+# sert avec inference.py --fast_load ou deploy.py --merged_model)
+DEFAULT_ADAPTER = os.getenv("DEFAULT_ADAPTER", "default")
+ADAPTERS = os.getenv("ADAPTERS", "")
+
+# Réponse retournée quand la génération est vide
+EMPTY_RESPONSE = "Je n'ai pas pu générer une réponse appropriée. Veuillez reformuler votre question de manière plus détaillée."
 
 # Variables globales pour le modèle et le tokenizer
 model = None
 tokenizer = None
+scheduler = None
+prefix_cache = None
+adapters = {}  # nom de l'adaptateur -> chemin
+# Nom de l'adaptateur -> nom de sa version chargée dans le modèle : un
+# remplacement charge une nouvelle version ("nom@2") avant de retirer l'ancienne
+model_adapters = {}
+adapter_versions = itertools.count(2)
+executor = InferenceExecutor(max_queue_size=MAX_QUEUE_SIZE)
+# Cache des réponses, utilisé uniquement pour les requêtes en décodage glouton
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL) if RESPONSE_CACHE else None
 
 class QueryRequest(BaseModel):
     prompt: str
     system_prompt: str = "Tu es un assistant IA expert en analyse de documents pour une entreprise de construction."
     max_length: int = 1024
     temperature: float = 0.7
+    greedy: bool = False  # Décodage déterministe, requis pour utiliser le cache de réponses
+    adapter: Optional[str] = None  # Adaptateur LoRA à utiliser (DEFAULT_ADAPTER si absent)
+
+class BatchItem(BaseModel):
+    """Prompt d'un lot ; les paramètres absents sont ceux du lot"""
+    prompt: str
+    system_prompt: Optional[str] = None
+    max_length: Optional[int] = None
+    temperature: Optional[float] = None
+    greedy: Optional[bool] = None
+    adapter: Optional[str] = None
+
+class BatchQueryRequest(BaseModel):
+    prompts: List[Union[str, BatchItem]]
+    # Paramètres partagés par les prompts du lot (valeurs de QueryRequest si absents)
+    system_prompt: Optional[str] = None
+    max_length: Optional[int] = None
+    temperature: Optional[float] = None
+    greedy: Optional[bool] = None
+    adapter: Optional[str] = None
+
+class AdapterRequest(BaseModel):
+    name: str
+    path: str
+
+class AdapterError(Exception):
+    """Opération impossible sur un adaptateur (introuvable, protégé ou en cours d'utilisation)"""
+    
+    def __init__(self, message, status_code=409):
+        super().__init__(message)
+        self.status_code = status_code
+
+def parse_adapters(spec):
+    """Lire une liste d'adaptateurs au format nom=chemin,nom2=chemin2"""
+    parsed = {}
+    for item in spec.split(","):
+        if item.strip():
+            name, path = item.split("=", 1)
+            parsed[name.strip()] = path.strip()
+    return parsed
 
 @app.on_event("startup")
 async def startup_event():
-    global model, tokenizer
+    global model, tokenizer, scheduler, prefix_cache
     logger.info(f"Chargement du modèle depuis {MODEL_PATH}...")
     
     try:
@@ -64,21 +146,267 @@ async def startup_event():
             torch_dtype=torch.float16
         )
         
-        # Charger les adaptateurs LoRA
-        model = PeftModel.from_pretrained(model_base, MODEL_PATH)
-        logger.info("Modèle chargé avec succès!")
+        # Charger les adaptateurs LoRA sur le même modèle de base
+        model = PeftModel.from_pretrained(model_base, MODEL_PATH, adapter_name=DEFAULT_ADAPTER)
+        adapters[DEFAULT_ADAPTER] = MODEL_PATH
+        model_adapters[DEFAULT_ADAPTER] = DEFAULT_ADAPTER
+        for name, path in parse_adapters(ADAPTERS).items():
+            logger.info(f"Chargement de l'adaptateur '{name}' depuis {path}")
+            model.load_adapter(path, adapter_name=name)
+            adapters[name] = path
+            model_adapters[name] = name
+        model.eval()
+        logger.info(f"Modèle chargé avec succès! Adaptateurs: {', '.join(adapters)}")
+        
+        # Cache KV des system prompts, partagé par toutes les requêtes
+        if PREFIX_CACHE:
+            prefix_cache = PrefixCache(model, max_bytes=PREFIX_CACHE_MB * 1024 * 1024)
+        
+        # Démarrer la boucle de décodage partagée entre les requêtes
+        if CONTINUOUS_BATCHING:
+            scheduler = ContinuousBatchScheduler(
+                model, tokenizer, max_batch_size=MAX_BATCH_SIZE, prefix_cache=prefix_cache
+            )
+            scheduler.start()
         
     except Exception as e:
         logger.error(f"Erreur lors du chargement du modèle: {e}")
         raise e
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if scheduler is not None:
+        scheduler.stop()
+    executor.shutdown(wait=False)
+
+def extract_response(full_response):
+    """Extraire la réponse de l'assistant du texte décodé"""
+    # Extraire la partie après [/INST]
+    if "[/INST]" in full_response:
+        response = full_response.split("[/INST]")[-1].strip()
+    else:
+        response = full_response.strip()
+    
+    # Supprimer le token de fin de séquence
+    return response.replace("</s>", "").strip()
+
+def expand_batch(request):
+    """Requêtes individuelles d'un lot, avec les paramètres partagés et ceux de chaque prompt"""
+    shared = request.model_dump(exclude={"prompts"}, exclude_none=True)
+    return [
+        QueryRequest(**shared, prompt=item) if isinstance(item, str)
+        else QueryRequest(**{**shared, **item.model_dump(exclude_none=True)})
+        for item in request.prompts
+    ]
+
+def resolve_adapter(request):
+    """Nom de l'adaptateur demandé par la requête"""
+    name = request.adapter or DEFAULT_ADAPTER
+    if name not in adapters:
+        raise HTTPException(status_code=404, detail=f"Adaptateur inconnu: {name}")
+    return name
+
+def load_adapter(name, path):
+    """
+    Charger (ou remplacer) un adaptateur ; exécuté entre deux générations.
+    
+    Un remplacement charge la nouvelle version sous un autre nom dans le modèle
+    et ne retire l'ancienne qu'une fois le chargement réussi : en cas d'échec,
+    l'adaptateur servi reste inchangé.
+    """
+    previous = model_adapters.get(name)
+    if previous is not None and scheduler is not None and scheduler.uses_adapter(previous):
+        raise AdapterError(f"L'adaptateur '{name}' est utilisé par des requêtes en cours")
+    
+    model_name = name if previous is None else f"{name}@{next(adapter_versions)}"
+    try:
+        model.load_adapter(path, adapter_name=model_name)
+    except Exception:
+        # Retirer un éventuel chargement partiel
+        if model_name in model.peft_config:
+            model.delete_adapter(model_name)
+        raise
+    model.eval()
+    
+    if previous is not None:
+        model.delete_adapter(previous)
+        if prefix_cache is not None:
+            prefix_cache.clear(adapter_name=previous)
+    model_adapters[name] = model_name
+    adapters[name] = path
+    logger.info(f"Adaptateur '{name}' chargé depuis {path}")
+
+def unload_adapter(name):
+    """Décharger un adaptateur ; exécuté entre deux générations"""
+    if name not in adapters:
+        raise AdapterError(f"Adaptateur inconnu: {name}", status_code=404)
+    if name == DEFAULT_ADAPTER:
+        raise AdapterError("L'adaptateur par défaut ne peut pas être déchargé")
+    model_name = model_adapters[name]
+    if scheduler is not None and scheduler.uses_adapter(model_name):
+        raise AdapterError(f"L'adaptateur '{name}' est utilisé par des requêtes en cours")
+    model.delete_adapter(model_name)
+    del adapters[name]
+    del model_adapters[name]
+    if prefix_cache is not None:
+        prefix_cache.clear(adapter_name=model_name)
+    logger.info(f"Adaptateur '{name}' déchargé")
+
+async def run_on_model(fn, *args):
+    """Exécuter une opération qui modifie le modèle sans course avec la génération"""
+    if scheduler is not None:
+        return await asyncio.wrap_future(scheduler.run_exclusive(fn, *args))
+    return await executor.run(fn, *args)
+
+def format_prompt(request):
+    """Prompt d'une requête au format Mistral, et son préfixe (system prompt)"""
+    system_prefix = f"<s>[INST] {request.system_prompt}\n\n"
+    return system_prefix, f"{system_prefix}{request.prompt} [/INST]"
+
+def response_cache_key(request, adapter):
+    """Clé du cache de réponses (None si le cache ne s'applique pas à la requête)"""
+    if response_cache is None or not request.greedy:
+        return None
+    # La version chargée fait partie de la clé : un remplacement invalide les réponses de l'ancienne
+    return make_cache_key(
+        f"{model_adapters[adapter]}:{adapters[adapter]}",
+        request.system_prompt,
+        request.prompt,
+        max_length=min(request.max_length, 512)
+    )
+
+def prepare_inputs(request):
+    """Formater et tokeniser le prompt d'une requête"""
+    logger.info(f"Génération pour prompt: '{request.prompt[:100]}...' avec system_prompt: '{request.system_prompt[:50]}...'")
+    
+    # Formater le prompt avec le format Mistral
+    system_prefix, formatted_prompt = format_prompt(request)
+    logger.info(f"Prompt formaté: '{formatted_prompt[:150]}...'")
+    
+    # Tokeniser le prompt
+    inputs = tokenizer(formatted_prompt, return_tensors="pt").to(model.device)
+    max_length = min(request.max_length, 512)  # Réduire la longueur maximale
+    
+    # Partie du prompt (system prompt) dont le cache KV peut être réutilisé
+    prefix_length = 0
+    if prefix_cache is not None:
+        prefix_length = prefix_cache.split(tokenizer, system_prefix, inputs.input_ids[0].tolist())
+    return inputs, max_length, prefix_length
+
+def submit_to_scheduler(request, adapter, inputs, max_length, prefix_length, token_callback=None):
+    """Ajouter une requête à la boucle de décodage partagée"""
+    if scheduler.waiting_count >= MAX_QUEUE_SIZE:
+        raise QueueFullError(f"File d'inférence pleine ({MAX_QUEUE_SIZE} requêtes en attente)")
+    
+    prompt_length = inputs.input_ids.shape[1]
+    return scheduler.submit(
+        inputs.input_ids[0].tolist(),
+        token_callback=token_callback,
+        prefix_length=prefix_length,
+        adapter_name=model_adapters[adapter],
+        max_new_tokens=max(max_length - prompt_length, 1),
+        temperature=request.temperature,
+        do_sample=not request.greedy,
+        top_p=0.95,
+        top_k=50,
+        repetition_penalty=1.1,
+        min_new_tokens=max(10 - prompt_length, 0),  # Assurer une longueur minimale
+        no_repeat_ngram_size=3  # Éviter les répétitions
+    )
+
+def generate_batch_with_model(params, requests):
+    """
+    Génération bloquante d'un sous-batch de requêtes de mêmes paramètres
+    d'échantillonnage, complétées à gauche ; chaque ligne utilise son adaptateur
+    """
+    temperature, greedy = params
+    generated = padded_generate(
+        model,
+        tokenizer,
+        [format_prompt(request)[1] for request, _ in requests],
+        [min(request.max_length, 512) for request, _ in requests],
+        adapter_names=[model_adapters[adapter] for _, adapter in requests],
+        temperature=temperature,
+        do_sample=not greedy,
+        top_p=0.95,
+        top_k=50,
+        repetition_penalty=1.1,
+        no_repeat_ngram_size=3
+    )
+    return [extract_response(tokenizer.decode(ids, skip_special_tokens=False)) for ids in generated]
+
+def generate_with_model(inputs, adapter, max_length, prefix_length, temperature, greedy=False,
+                        streamer=None, stopping_criteria=None):
+    """Génération bloquante avec model.generate (exécutée hors de la boucle asyncio)"""
+    input_ids = inputs.input_ids
+    adapter = model_adapters[adapter]  # Version chargée, résolue au moment de générer
+    past_key_values = None
+    if prefix_length > 0:
+        past_key_values = from_legacy_cache(
+            prefix_cache.get(input_ids[0, :prefix_length].tolist(), adapter_name=adapter)
+        )
+    
+    # Générer la réponse avec des paramètres optimisés pour la vitesse
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids,
+            attention_mask=inputs.attention_mask,
+            past_key_values=past_key_values,
+            adapter_names=[adapter],
+            max_length=max_length,
+            temperature=temperature,
+            do_sample=not greedy,
+            top_p=0.95,
+            top_k=50,
+            repetition_penalty=1.1,
+            min_length=10,  # Assurer une longueur minimale
+            no_repeat_ngram_size=3,  # Éviter les répétitions
+            early_stopping=True,  # Arrêter dès qu'une séquence valide est générée
+            streamer=streamer,
+            stopping_criteria=stopping_criteria
+        )
+    
+    # Décoder la réponse
+    full_response = tokenizer.decode(outputs[0], skip_special_tokens=False)
+    logger.info(f"Réponse complète décodée: '{full_response[:150]}...'")
+    
+    if "[/INST]" not in full_response:
+        logger.warning("Balise [/INST] non trouvée dans la réponse")
+    return extract_response(full_response)
+
 @app.get("/")
 async def root():
     return {"message": "API du modèle fine-tuné", "status": "active"}
 
 @app.get("/status")
 async def status():
-    return {"model_loaded": model is not None, "model_path": MODEL_PATH}
+    status_info = {"model_loaded": model is not None, "model_path": MODEL_PATH, "adapters": adapters}
+    if scheduler is not None:
+        status_info["batching"] = {
+            "active_sequences": scheduler.active_count,
+            "waiting_requests": scheduler.waiting_count,
+            "max_batch_size": scheduler.max_batch_size
+        }
+    else:
+        status_info["executor"] = executor.stats()
+    if prefix_cache is not None:
+        status_info["prefix_cache"] = prefix_cache.stats()
+    if response_cache is not None:
+        status_info["response_cache"] = response_cache.stats()
+    return status_info
+
+@app.get("/cache")
+async def cache_stats():
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
+@app.get("/health")
+async def health():
+    if model is None or tokenizer is None:
+        raise HTTPException(status_code=503, detail="Le modèle n'est pas chargé")
+    queue_depth = scheduler.waiting_count if scheduler is not None else executor.queue_depth
+    return {"status": "healthy", "queue_depth": queue_depth}
 
 @app.post("/generate")
 async def generate(request: QueryRequest):
@@ -87,56 +415,225 @@ async def generate(request: QueryRequest):
     if model is None or tokenizer is None:
         raise HTTPException(status_code=500, detail="Le modèle n'est pas chargé")
     
+    adapter = resolve_adapter(request)
+    cache_key = response_cache_key(request, adapter)
+    if cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Réponse trouvée dans le cache")
+            return {"response": cached}
+    
     try:
-        logger.info(f"Génération pour prompt: '{request.prompt[:100]}...' avec system_prompt: '{request.system_prompt[:50]}...'")
-        
-        # Formater le prompt avec le format Mistral
-        formatted_prompt = f"<s>[INST] {request.system_prompt}\n\n{request.prompt} [/INST]"
-        logger.info(f"Prompt formaté: '{formatted_prompt[:150]}...'")
+        inputs, max_length, prefix_length = prepare_inputs(request)
+        start_time = time.perf_counter()
         
-        # Tokeniser le prompt
-        inputs = tokenizer(formatted_prompt, return_tensors="pt").to(model.device)
-        
-        # Générer la réponse avec des paramètres optimisés pour la vitesse
-        with torch.no_grad():
-            outputs = model.generate(
-                inputs.input_ids,
-                max_length=min(request.max_length, 512),  # Réduire la longueur maximale
-                temperature=request.temperature,
-                do_sample=True,
-                top_p=0.95,
-                top_k=50,
-                repetition_penalty=1.1,
-                min_length=10,  # Assurer une longueur minimale
-                no_repeat_ngram_size=3,  # Éviter les répétitions
-                early_stopping=True  # Arrêter dès qu'une séquence valide est générée
-            )
-        
-        # Décoder la réponse
-        full_response = tokenizer.decode(outputs[0], skip_special_tokens=False)
-        logger.info(f"Réponse complète décodée: '{full_response[:150]}...'")
-        
-        # Extraire la partie après [/INST]
-        if "[/INST]" in full_response:
-            response = full_response.split("[/INST]")[-1].strip()
+        if scheduler is not None:
+            # Décodage partagé avec les autres requêtes en vol
+            future = submit_to_scheduler(request, adapter, inputs, max_length, prefix_length)
+            generated_ids = await asyncio.wrap_future(future)
+            response = extract_response(tokenizer.decode(generated_ids, skip_special_tokens=False))
         else:
-            response = full_response.strip()
-            logger.warning("Balise [/INST] non trouvée dans la réponse")
-        
-        # Supprimer le token de fin de séquence
-        response = response.replace("</s>", "").strip()
+            response = await executor.run(
+                generate_with_model, inputs, adapter, max_length, prefix_length, request.temperature, request.greedy
+            )
         
         # Vérifier si la réponse est vide
         if not response:
             logger.warning("Réponse vide générée, utilisation d'une réponse par défaut")
-            response = "Je n'ai pas pu générer une réponse appropriée. Veuillez reformuler votre question de manière plus détaillée."
+            response = EMPTY_RESPONSE
         
         logger.info(f"Réponse finale: '{response[:100]}...'")
+        if cache_key is not None:
+            response_cache.put(cache_key, response, time.perf_counter() - start_time)
         return {"response": response}
     
+    except QueueFullError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Erreur lors de la génération: {e}")
         raise HTTPException(status_code=500, detail=f"Erreur lors de la génération: {str(e)}")
 
+@app.post("/generate_batch")
+async def generate_batch(request: BatchQueryRequest):
+    """
+    Générer les réponses d'un lot de prompts, dans l'ordre. Une erreur sur un
+    prompt (adaptateur inconnu, file pleine, échec de génération) est retournée
+    dans son résultat sans faire échouer le lot.
+    """
+    if model is None or tokenizer is None:
+        raise HTTPException(status_code=500, detail="Le modèle n'est pas chargé")
+    if len(request.prompts) > MAX_BATCH_PROMPTS:
+        raise HTTPException(status_code=413, detail=f"Trop de prompts dans le lot (maximum {MAX_BATCH_PROMPTS})")
+    
+    requests = expand_batch(request)
+    results = [None] * len(requests)
+    pending = []  # (indice, requête, adaptateur, clé du cache)
+    for index, item in enumerate(requests):
+        try:
+            adapter = resolve_adapter(item)
+        except HTTPException as e:
+            results[index] = {"response": None, "error": e.detail}
+            continue
+        cache_key = response_cache_key(item, adapter)
+        cached = response_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            results[index] = {"response": cached, "error": None}
+        else:
+            pending.append((index, item, adapter, cache_key))
+    
+    def store(index, cache_key, response, error, generation_time):
+        if error is not None:
+            results[index] = {"response": None, "error": error}
+            return
+        if cache_key is not None and response:
+            response_cache.put(cache_key, response, generation_time)
+        results[index] = {"response": response or EMPTY_RESPONSE, "error": None}
+    
+    logger.info(f"Lot de {len(requests)} prompts ({len(requests) - len(pending)} déjà résolus)")
+    if scheduler is not None:
+        # Chaque prompt rejoint la boucle de décodage partagée ; le nombre de prompts
+        # du lot en vol est limité pour laisser de la place aux autres requêtes
+        semaphore = asyncio.Semaphore(MAX_BATCH_SIZE)
+        
+        async def run_item(index, item, adapter, cache_key):
+            async with semaphore:
+                start_time = time.perf_counter()
+                try:
+                    inputs, max_length, prefix_length = prepare_inputs(item)
+                    future = submit_to_scheduler(item, adapter, inputs, max_length, prefix_length)
+                    generated_ids = await asyncio.wrap_future(future)
+                    response = extract_response(tokenizer.decode(generated_ids, skip_special_tokens=False))
+                except Exception as e:
+                    logger.warning(f"Erreur sur le prompt {index} du lot: {e}")
+                    store(index, cache_key, None, str(e), 0)
+                    return
+                store(index, cache_key, response, None, time.perf_counter() - start_time)
+        
+        await asyncio.gather(*(run_item(*entry) for entry in pending))
+    else:
+        # Sous-batches complétés à gauche, un appel à l'exécuteur chacun pour que
+        # les requêtes individuelles puissent passer entre deux sous-batches
+        sub_batches = group_by_params(
+            pending, key=lambda entry: (entry[1].temperature, entry[1].greedy), batch_size=MAX_BATCH_SIZE
+        )
+        for params, indices in sub_batches:
+            entries = [pending[i] for i in indices]
+            start_time = time.perf_counter()
+            try:
+                outcomes = await executor.run(
+                    generate_isolated, generate_batch_with_model, params, [(item, adapter) for _, item, adapter, _ in entries]
+                )
+            except QueueFullError as e:
+                outcomes = [(None, str(e))] * len(entries)
+            generation_time = (time.perf_counter() - start_time) / len(entries)
+            for (index, _, _, cache_key), (response, error) in zip(entries, outcomes):
+                store(index, cache_key, response, error, generation_time)
+    
+    return {"results": results}
+
+@app.post("/generate_stream")
+async def generate_stream(request: QueryRequest):
+    """Variante de /generate qui envoie la réponse token par token (Server-Sent Events)"""
+    if model is None or tokenizer is None:
+        raise HTTPException(status_code=500, detail="Le modèle n'est pas chargé")
+    
+    adapter = resolve_adapter(request)
+    loop = asyncio.get_running_loop()
+    cancelled = threading.Event()
+    inputs, max_length, prefix_length = prepare_inputs(request)
+    
+    try:
+        if scheduler is not None:
+            token_queue = asyncio.Queue()
+            
+            def on_token(token_id):
+                loop.call_soon_threadsafe(token_queue.put_nowait, token_id)
+                return not cancelled.is_set()
+            
+            future = submit_to_scheduler(request, adapter, inputs, max_length, prefix_length, token_callback=on_token)
+            future.add_done_callback(lambda _: loop.call_soon_threadsafe(token_queue.put_nowait, None))
+            
+            async def raw_chunks():
+                decoder = IncrementalDecoder(tokenizer)
+                while True:
+                    token_id = await token_queue.get()
+                    if token_id is None:
+                        break
+                    yield decoder.push(token_id)
+                future.result()  # Propager une éventuelle erreur de génération
+        else:
+            streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=False)
+            
+            def run_generation():
+                try:
+                    generate_with_model(
+                        inputs, adapter, max_length, prefix_length, request.temperature, request.greedy,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([CancelledCriteria(cancelled)])
+                    )
+                except Exception:
+                    streamer.end()
+                    raise
+            
+            future = executor.submit(run_generation)
+            
+            async def raw_chunks():
+                async for text in iterate_in_thread(iter(streamer)):
+                    yield text
+                await asyncio.wrap_future(future)
+    except QueueFullError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    async def events():
+        cleaner = StreamCleaner()
+        try:
+            async for chunk in raw_chunks():
+                text = cleaner.feed(chunk)
+                if text:
+                    yield sse_event({"text": text})
+            text = cleaner.flush()
+            if text:
+                yield sse_event({"text": text})
+            yield sse_event("[DONE]")
+        except Exception as e:
+            logger.error(f"Erreur lors de la génération en streaming: {e}")
+            yield sse_event({"detail": str(e)}, event="error")
+        finally:
+            # Client déconnecté ou flux terminé : arrêter la génération
+            cancelled.set()
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/admin/adapters")
+async def list_adapters():
+    return {"default": DEFAULT_ADAPTER, "adapters": adapters}
+
+@app.post("/admin/adapters")
+async def add_adapter(request: AdapterRequest):
+    """Charger un adaptateur LoRA à chaud (ou remplacer un adaptateur existant)"""
+    if model is None:
+        raise HTTPException(status_code=500, detail="Le modèle n'est pas chargé")
+    try:
+        await run_on_model(load_adapter, request.name, request.path)
+    except AdapterError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        logger.error(f"Erreur lors du chargement de l'adaptateur {request.name}: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur lors du chargement de l'adaptateur: {str(e)}")
+    return {"loaded": request.name, "adapters": adapters}
+
+@app.delete("/admin/adapters/{name}")
+async def remove_adapter(name: str):
+    """Décharger un adaptateur LoRA pour libérer la mémoire"""
+    if model is None:
+        raise HTTPException(status_code=500, detail="Le modèle n'est pas chargé")
+    try:
+        await run_on_model(unload_adapter, name)
+    except AdapterError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {"unloaded": name, "adapters": adapters}
+
 if __name__ == "__main__":
     uvicorn.run("model_api:app", host="0.0.0.0", port=8000, reload=False) 
\ No newline at end of file
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Cache des réponses générées pour les appels déterministes (décodage glouton).
+
+Les clés combinent le modèle/adaptateur, le system prompt, le prompt normalisé
+et les paramètres de génération ; les entrées expirent après un TTL et le cache
+est borné en nombre d'entrées (éviction LRU).
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from text_utils import normalize_prompt
+
+
+def make_cache_key(model_id, system_prompt, prompt, **generation_params):
+    """Construire la clé de cache d'une requête"""
+    payload = json.dumps(
+        {
+            "model": model_id,
+            "system_prompt": system_prompt.strip(),
+            "prompt": normalize_prompt(prompt),
+            "params": generation_params
+        },
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Cache LRU avec expiration des réponses générées"""
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key):
+        """Retourner la réponse en cache ou None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            response, generation_time, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += generation_time
+            return response
+
+    def put(self, key, response, generation_time=0.0):
+        """Enregistrer une réponse et le temps qu'a pris sa génération"""
+        with self._lock:
+            self._entries[key] = (response, generation_time, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "saved_generation_seconds": round(self.saved_seconds, 3)
+        }
@@ -1,18 +1,19 @@
 #!/usr/bin/env python3
 import os
 import glob
-import subprocess
 import sys
-import json
+
+from huggingface_finetune import FineTuneConfig, fine_tune_model, load_base_model
 
 def clear_screen():
     """Nettoie l'écran du terminal"""
     os.system('cls' if os.name == 'nt' else 'clear')
 
 def list_training_files():
-    """Liste tous les fichiers d'entraînement disponibles"""
+    """Liste tous les fichiers d'entraînement disponibles, dont les shards de convert_raw_data.py"""
     training_dir = os.path.join(os.path.dirname(__file__), "data", "training")
     files = glob.glob(os.path.join(training_dir, "*.jsonl"))
+    files += sorted(glob.glob(os.path.join(training_dir, "converted", "*.jsonl")))
     return files
 
 def select_files(files):
@@ -24,7 +25,7 @@ def select_files(files):
         print("=== SÉLECTION DES FICHIERS D'ENTRAÎNEMENT ===\n")
         
         for i, file in enumerate(files, 1):
-            filename = os.path.basename(file)
+            filename = os.path.relpath(file, os.path.join(os.path.dirname(__file__), "data", "training"))
             status = "[X]" if file in selected else "[ ]"
             print(f"{i}. {status} {filename}")
         
@@ -92,24 +93,27 @@ def select_model():
         print("Entrée invalide. Utilisation du modèle par défaut.")
         return models[0]  # Utiliser Mistral-7B-v0.1 comme modèle par défaut
 
-def configure_training():
+def configure_training(selected_files):
     """Configure les paramètres d'entraînement"""
     clear_screen()
     print("=== CONFIGURATION DE L'ENTRAÎNEMENT ===\n")
     
     # Modèle de base
     base_model = select_model()
+    small_model = "TinyLlama" in base_model or "gpt2" in base_model
     
     # Nombre d'époques
     epochs = input("\nNombre d'époques (défaut: 3 pour petits modèles, 2 pour grands): ").strip()
     if not epochs:
-        epochs = "3" if "TinyLlama" in base_model or "gpt2" in base_model else "2"
+        epochs = "3" if small_model else "2"
     
     # Taille du batch
     batch_size = input("\nTaille du batch (défaut: 4 pour GPT2, 2 pour TinyLlama, 1 pour Mistral): ").strip()
     if not batch_size:
-        if "TinyLlama" in base_model or "gpt2" in base_model:
+        if "gpt2" in base_model:
             batch_size = "4"
+        elif "TinyLlama" in base_model:
+            batch_size = "2"
         else:
             batch_size = "1"
     
@@ -119,130 +123,63 @@ def configure_training():
         output_model = "jordanS/agent_router"
     
     # Continuer l'entraînement
-    continue_training = input("\nContinuer l'entraînement à partir d'un modèle existant? (o/n, défaut: n): ").strip().lower()
-    continue_training = "true" if continue_training == "o" else "false"
+    continue_training = input("\nContinuer l'entraînement à partir d'un modèle existant? (o/n, défaut: n): ").strip().lower() == "o"
     
     # Modèle existant si continuation
     existing_model = ""
-    if continue_training == "true":
+    if continue_training:
         existing_model = input("\nChemin du modèle existant: ").strip()
         if not existing_model:
             existing_model = output_model
     
     # Nettoyer le dossier de sortie
-    clean_output = input("\nNettoyer le dossier de sortie? (o/n, défaut: n): ").strip().lower()
-    clean_output = "true" if clean_output == "o" else "false"
-    
-    return {
-        "BASE_MODEL": base_model,
-        "EPOCHS": epochs,
-        "BATCH_SIZE": batch_size,
-        "OUTPUT_MODEL": output_model,
-        "CONTINUE_TRAINING": continue_training,
-        "EXISTING_MODEL": existing_model,
-        "CLEAN_OUTPUT": clean_output
-    }
-
-def create_training_file(selected_files):
-    """Crée un fichier temporaire avec les chemins des fichiers sélectionnés"""
-    temp_file = os.path.join(os.path.dirname(__file__), "selected_training_files.py")
-    
-    with open(temp_file, 'w') as f:
-        f.write("# Fichier généré automatiquement par retrain_interactive.py\n")
-        f.write("# Ne pas modifier manuellement\n\n")
-        f.write("import os\n\n")
-        f.write("# Fichiers d'entraînement sélectionnés\n")
-        f.write("TRAINING_FILES = [\n")
-        
-        for file in selected_files:
-            f.write(f"    \"{file}\",\n")
-        
-        f.write("]\n")
-    
-    return temp_file
+    clean_output = input("\nNettoyer le dossier de sortie? (o/n, défaut: n): ").strip().lower() == "o"
+    
+    return FineTuneConfig(
+        base_model=base_model,
+        output_model=output_model,
+        training_files=[os.path.abspath(file) for file in selected_files],
+        epochs=int(epochs),
+        batch_size=int(batch_size),
+        continue_training=continue_training,
+        existing_model=existing_model,
+        clean_output=clean_output,
+        # Réglages (quantification, LoRA) propres aux petits modèles
+        use_smaller_model=small_model,
+        alternative_model="gpt2" in base_model
+    )
 
-def run_training(config, training_files_module, selected_files):
-    """Exécute l'entraînement avec les paramètres configurés"""
+def run_training(config, model=None):
+    """
+    Exécute l'entraînement dans ce processus. `model` est le modèle de base
+    chargé par un entraînement précédent, réutilisé s'il correspond à `config`.
+    Retourne le modèle de base chargé (ou None en cas d'erreur).
+    """
     clear_screen()
     print("=== DÉMARRAGE DE L'ENTRAÎNEMENT ===\n")
     
-    # Définir les variables d'environnement
-    env = os.environ.copy()
-    for key, value in config.items():
-        env[key] = value
-    
-    # Modifier le code pour utiliser notre module de fichiers sélectionnés
-    env["SELECTED_TRAINING_FILES"] = training_files_module
-    
-    # Exécuter le script de fine-tuning
     print("Lancement de l'entraînement avec les paramètres suivants:")
-    for key, value in config.items():
-        if value:  # Ne pas afficher les valeurs vides
+    for key, value in vars(config).items():
+        if value and key != "training_files":  # Ne pas afficher les valeurs vides
             print(f"- {key}: {value}")
     
     print("\nFichiers d'entraînement sélectionnés:")
-    for file in selected_files:
+    for file in config.training_files:
         print(f"- {os.path.basename(file)}")
     
     print("\nDémarrage de l'entraînement...")
     
-    # Créer un script temporaire qui utilise les fichiers sélectionnés
-    temp_script = os.path.join(os.path.dirname(__file__), "temp_finetune.py")
-    
-    # Lire le contenu du fichier original
-    with open(os.path.join(os.path.dirname(__file__), "huggingface_finetune.py"), 'r') as src:
-        content = src.read()
-    
-    # Trouver la position de la définition de TRAINING_FILES
-    training_files_start = content.find("# Définir les chemins des fichiers d'entraînement\nTRAINING_FILES = [")
-    training_files_end = content.find("]", training_files_start)
-    
-    if training_files_start != -1 and training_files_end != -1:
-        # Créer le nouveau contenu
-        new_content = content[:training_files_start]
-        new_content += "# Utiliser les fichiers sélectionnés\nimport json\nwith open('" + training_files_module + "', 'r') as f:\n    TRAINING_FILES = json.load(f)\n\n"
-        new_content += content[training_files_end+1:]
-        
-        # Écrire le nouveau contenu dans le fichier temporaire
-        with open(temp_script, 'w') as dst:
-            dst.write(new_content)
-    else:
-        print("Erreur: Impossible de trouver la définition de TRAINING_FILES dans le fichier source.")
-        return
-    
     try:
-        # Écrire les fichiers sélectionnés dans un fichier JSON temporaire
-        with open(training_files_module, 'w') as f:
-            # Ne pas redemander la sélection des fichiers, utiliser ceux déjà sélectionnés
-            print("DEBUG: selected_files =", selected_files)
-            json.dump([os.path.abspath(file) for file in selected_files], f)
-        
-        # Exécuter le script temporaire
-        process = subprocess.Popen(
-            [sys.executable, temp_script],
-            env=env,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True
-        )
-        
-        # Afficher la sortie en temps réel
-        for line in iter(process.stdout.readline, ''):
-            print(line, end='')
-        
-        process.wait()
-        
-        if process.returncode == 0:
-            print("\nL'entraînement s'est terminé avec succès!")
+        if model is None:
+            model = load_base_model(config)
         else:
-            print(f"\nL'entraînement s'est terminé avec le code d'erreur: {process.returncode}")
-    
-    finally:
-        # Nettoyer les fichiers temporaires
-        if os.path.exists(temp_script):
-            os.remove(temp_script)
-        if os.path.exists(training_files_module):
-            os.remove(training_files_module)
+            print("Réutilisation du modèle de base déjà chargé")
+        fine_tune_model(config, model=model)
+        print("\nL'entraînement s'est terminé avec succès!")
+        return model
+    except Exception as e:
+        print(f"\nL'entraînement s'est terminé avec une erreur: {e}")
+        return None
 
 def main():
     """Fonction principale"""
@@ -253,17 +190,24 @@ def main():
         print("Aucun fichier d'entraînement trouvé dans le répertoire data/training.")
         sys.exit(1)
     
-    # Sélectionner les fichiers
-    selected_files = select_files(files)
-    
-    # Configurer l'entraînement
-    config = configure_training()
-    
-    # Créer un fichier temporaire avec les chemins des fichiers sélectionnés
-    training_files_module = os.path.join(os.path.dirname(__file__), "selected_files.json")
-    
-    # Exécuter l'entraînement
-    run_training(config, training_files_module, selected_files)
+    # Le modèle de base reste chargé d'un entraînement à l'autre
+    model, model_key = None, None
+    while True:
+        # Sélectionner les fichiers
+        selected_files = select_files(files)
+        
+        # Configurer l'entraînement
+        config = configure_training(selected_files)
+        
+        # Exécuter l'entraînement
+        if config.model_key() != model_key:
+            model = None
+        model = run_training(config, model)
+        model_key = config.model_key() if model is not None else None
+        
+        again = input("\nLancer un autre entraînement? (o/n, défaut: n): ").strip().lower()
+        if again != "o":
+            break
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
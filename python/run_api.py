@@ -1,31 +1,71 @@
 # model_api.py
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+from typing import List, Optional, Union
 import uvicorn
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from peft import PeftModel, PeftConfig
 import os
+import time
+
+from batch_generation import generate_isolated, group_by_params, padded_generate
+from inference_executor import InferenceExecutor, QueueFullError
+from kv_cache import PrefixCache, from_legacy_cache
+from response_cache import ResponseCache, make_cache_key
 
 app = FastAPI()
 
 # Configuration
 MODEL_PATH = os.getenv("MODEL_PATH", "jordanS/analyse_agent")
 BASE_MODEL = os.getenv("BASE_MODEL", "mistralai/Mistral-7B-v0.1")
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "32"))
+PREFIX_CACHE = os.getenv("PREFIX_CACHE", "true").lower() == "true"
+PREFIX_CACHE_MB = int(os.getenv("PREFIX_CACHE_MB", "512"))
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# /generate_batch : prompts par sous-batch et nombre maximum de prompts par requête
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "8"))
+MAX_BATCH_PROMPTS = int(os.getenv("MAX_BATCH_PROMPTS", "1024"))
 
 # Modèle global
 model = None
 tokenizer = None
+prefix_cache = None
+
+# Les générations bloquantes passent par un thread dédié
+executor = InferenceExecutor(max_queue_size=MAX_QUEUE_SIZE)
+
+# Cache des réponses, utilisé uniquement pour les requêtes en décodage glouton
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL) if RESPONSE_CACHE else None
 
 class QueryRequest(BaseModel):
     prompt: str
     system_prompt: str = "Tu es un assistant IA expert en analyse de documents pour une entreprise de construction."
     max_length: int = 1024
     temperature: float = 0.1
+    greedy: bool = False  # Décodage déterministe, requis pour utiliser le cache de réponses
+
+class BatchItem(BaseModel):
+    """Prompt d'un lot ; les paramètres absents sont ceux du lot"""
+    prompt: str
+    system_prompt: Optional[str] = None
+    max_length: Optional[int] = None
+    temperature: Optional[float] = None
+    greedy: Optional[bool] = None
+
+class BatchQueryRequest(BaseModel):
+    prompts: List[Union[str, BatchItem]]
+    # Paramètres partagés par les prompts du lot (valeurs de QueryRequest si absents)
+    system_prompt: Optional[str] = None
+    max_length: Optional[int] = None
+    temperature: Optional[float] = None
+    greedy: Optional[bool] = None
 
 @app.on_event("startup")
 async def startup_event():
-    global model, tokenizer
+    global model, tokenizer, prefix_cache
     # Charger le modèle au démarrage
     try:
         # Vérifier si le modèle est un modèle PEFT (LoRA)
@@ -56,10 +96,113 @@ async def startup_event():
         # Charger les adaptateurs LoRA
         model = PeftModel.from_pretrained(model_base, MODEL_PATH)
         
+        # Cache KV des system prompts, réutilisé d'une requête à l'autre
+        if PREFIX_CACHE:
+            prefix_cache = PrefixCache(model, max_bytes=PREFIX_CACHE_MB * 1024 * 1024)
+        
     except Exception as e:
         print(f"Erreur lors du chargement du modèle: {e}")
         raise e
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    executor.shutdown(wait=False)
+
+@app.get("/health")
+async def health():
+    if model is None or tokenizer is None:
+        raise HTTPException(status_code=503, detail="Le modèle n'est pas chargé")
+    health_info = {"status": "healthy", **executor.stats()}
+    if prefix_cache is not None:
+        health_info["prefix_cache"] = prefix_cache.stats()
+    return health_info
+
+@app.get("/cache")
+async def cache_stats():
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
+def format_prompt(request):
+    """Prompt d'une requête au format Mistral, et son préfixe (system prompt)"""
+    system_prefix = f"<s>[INST] {request.system_prompt}\n\n"
+    return system_prefix, f"{system_prefix}{request.prompt} [/INST]"
+
+def response_cache_key(request):
+    """Clé du cache de réponses (None si le cache ne s'applique pas à la requête)"""
+    if response_cache is None or not request.greedy:
+        return None
+    return make_cache_key(
+        MODEL_PATH,
+        request.system_prompt,
+        request.prompt,
+        max_length=request.max_length
+    )
+
+def generate_response(request):
+    """Génération bloquante, exécutée dans le thread d'inférence"""
+    # Formater le prompt avec le format Mistral
+    system_prefix, formatted_prompt = format_prompt(request)
+    
+    # Tokeniser le prompt
+    inputs = tokenizer(formatted_prompt, return_tensors="pt").to(model.device)
+    
+    # Reprendre le cache KV du system prompt s'il a déjà été encodé
+    past_key_values = None
+    if prefix_cache is not None:
+        input_ids = inputs.input_ids[0].tolist()
+        prefix_length = prefix_cache.split(tokenizer, system_prefix, input_ids)
+        if prefix_length > 0:
+            past_key_values = from_legacy_cache(prefix_cache.get(input_ids[:prefix_length]))
+    
+    # Générer la réponse
+    with torch.no_grad():
+        outputs = model.generate(
+            inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            past_key_values=past_key_values,
+            max_length=request.max_length,
+            temperature=request.temperature,
+            do_sample=not request.greedy,
+            top_p=0.95,
+            top_k=50,
+            repetition_penalty=1.1
+        )
+    
+    # Décoder la réponse
+    response = tokenizer.decode(outputs[0], skip_special_tokens=False)
+    
+    # Extraire la partie après [/INST]
+    response = response.split("[/INST]")[-1].strip()
+    
+    # Supprimer le token de fin de séquence
+    return response.replace("</s>", "").strip()
+
+def generate_batch_responses(params, requests):
+    """
+    Génération bloquante d'un sous-batch de requêtes de mêmes paramètres
+    d'échantillonnage, complétées à gauche
+    """
+    temperature, greedy = params
+    generated = padded_generate(
+        model,
+        tokenizer,
+        [format_prompt(request)[1] for request in requests],
+        [request.max_length for request in requests],
+        temperature=temperature,
+        do_sample=not greedy,
+        top_p=0.95,
+        top_k=50,
+        repetition_penalty=1.1
+    )
+    return [tokenizer.decode(ids, skip_special_tokens=False).replace("</s>", "").strip() for ids in generated]
+
+def timed_generate_response(request):
+    """Génération avec mesure du temps de calcul (hors attente dans la file)"""
+    start_time = time.perf_counter()
+    response = generate_response(request)
+    return response, time.perf_counter() - start_time
+
 @app.post("/generate")
 async def generate(request: QueryRequest):
     global model, tokenizer
@@ -67,38 +210,76 @@ async def generate(request: QueryRequest):
     if model is None or tokenizer is None:
         raise HTTPException(status_code=500, detail="Le modèle n'est pas chargé")
     
+    cache_key = response_cache_key(request)
+    if cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return {"response": cached}
+    
     try:
-        # Formater le prompt avec le format Mistral
-        formatted_prompt = f"<s>[INST] {request.system_prompt}\n\n{request.prompt} [/INST]"
-        
-        # Tokeniser le prompt
-        inputs = tokenizer(formatted_prompt, return_tensors="pt").to(model.device)
-        
-        # Générer la réponse
-        with torch.no_grad():
-            outputs = model.generate(
-                inputs.input_ids,
-                max_length=request.max_length,
-                temperature=request.temperature,
-                do_sample=True,
-                top_p=0.95,
-                top_k=50,
-                repetition_penalty=1.1
-            )
-        
-        # Décoder la réponse
-        response = tokenizer.decode(outputs[0], skip_special_tokens=False)
-        
-        # Extraire la partie après [/INST]
-        response = response.split("[/INST]")[-1].strip()
-        
-        # Supprimer le token de fin de séquence
-        response = response.replace("</s>", "").strip()
+        response, generation_time = await executor.run(timed_generate_response, request)
         
+        if cache_key is not None:
+            response_cache.put(cache_key, response, generation_time)
         return {"response": response}
     
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la génération: {str(e)}")
 
+@app.post("/generate_batch")
+async def generate_batch(request: BatchQueryRequest):
+    """
+    Générer les réponses d'un lot de prompts, dans l'ordre, par sous-batches
+    complétés à gauche. Une erreur sur un prompt est retournée dans son
+    résultat sans faire échouer le lot.
+    """
+    if model is None or tokenizer is None:
+        raise HTTPException(status_code=500, detail="Le modèle n'est pas chargé")
+    if len(request.prompts) > MAX_BATCH_PROMPTS:
+        raise HTTPException(status_code=413, detail=f"Trop de prompts dans le lot (maximum {MAX_BATCH_PROMPTS})")
+    
+    shared = request.model_dump(exclude={"prompts"}, exclude_none=True)
+    requests = [
+        QueryRequest(**shared, prompt=item) if isinstance(item, str)
+        else QueryRequest(**{**shared, **item.model_dump(exclude_none=True)})
+        for item in request.prompts
+    ]
+    results = [None] * len(requests)
+    pending = []
+    for index, item in enumerate(requests):
+        cache_key = response_cache_key(item)
+        cached = response_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            results[index] = {"response": cached, "error": None}
+        else:
+            pending.append(index)
+    
+    # Un appel à l'exécuteur par sous-batch : les requêtes individuelles passent entre deux
+    sub_batches = group_by_params(
+        [requests[index] for index in pending],
+        key=lambda item: (item.temperature, item.greedy),
+        batch_size=MAX_BATCH_SIZE
+    )
+    for params, positions in sub_batches:
+        indices = [pending[position] for position in positions]
+        start_time = time.perf_counter()
+        try:
+            outcomes = await executor.run(
+                generate_isolated, generate_batch_responses, params, [requests[index] for index in indices]
+            )
+        except QueueFullError as e:
+            outcomes = [(None, str(e))] * len(indices)
+        generation_time = (time.perf_counter() - start_time) / len(indices)
+        
+        for index, (response, error) in zip(indices, outcomes):
+            results[index] = {"response": response, "error": error}
+            cache_key = response_cache_key(requests[index])
+            if error is None and cache_key is not None:
+                response_cache.put(cache_key, response, generation_time)
+    
+    return {"results": results}
+
 if __name__ == "__main__":
-    uvicorn.run("model_api:app", host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run("run_api:app", host="0.0.0.0", port=8000)
\ No newline at end of file
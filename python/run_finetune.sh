@@ -38,6 +38,11 @@ show_help() {
     echo "  --clean           Nettoyer le dossier de sortie avant l'entraînement"
     echo "  --continue        Continuer l'entraînement à partir d'un modèle existant"
     echo "  --from PATH       Spécifier le modèle existant à partir duquel continuer (avec --continue)"
+    echo "  --cpu N           Entraîner sur CPU avec N processus data-parallèles par nœud (gloo, via torchrun)"
+    echo "  --nnodes N        Nombre de nœuds pour l'entraînement sur CPU (par défaut: 1)"
+    echo "  --node_rank R     Rang de ce nœud (0 sur le nœud principal)"
+    echo "  --master_addr IP  Adresse du nœud principal (par défaut: 127.0.0.1)"
+    echo "  --master_port P   Port du nœud principal (par défaut: 29500)"
     echo "  --help            Afficher cette aide"
     echo ""
     echo "Exemples:"
@@ -45,6 +50,8 @@ show_help() {
     echo "  ./run_finetune.sh --large --epochs 3           # Fine-tuner Mistral (7B) avec 3 époques"
     echo "  ./run_finetune.sh --gpt2 --output mon_modele   # Fine-tuner GPT2 et sauvegarder dans mon_modele"
     echo "  ./run_finetune.sh --continue --from jordanS/analyse_agent  # Continuer l'entraînement"
+    echo "  ./run_finetune.sh --gpt2 --cpu 4               # GPT2 sur 4 processus CPU"
+    echo "  ./run_finetune.sh --small --cpu 8 --nnodes 2 --node_rank 0 --master_addr 10.0.0.1  # 2 nœuds CPU"
 }
 
 # Traiter les arguments
@@ -56,6 +63,11 @@ OUTPUT_PATH=""
 CLEAN_OUTPUT="false"
 CONTINUE_TRAINING="false"
 EXISTING_MODEL=""
+CPU_PROCESSES=""
+NNODES="1"
+NODE_RANK="0"
+MASTER_ADDR="127.0.0.1"
+MASTER_PORT="29500"
 
 while [[ $# -gt 0 ]]; do
     case "$1" in
@@ -101,6 +113,27 @@ while [[ $# -gt 0 ]]; do
             echo "Modèle existant: $EXISTING_MODEL"
             shift
             ;;
+        --cpu)
+            CPU_PROCESSES="$2"
+            echo "Entraînement sur CPU: $CPU_PROCESSES processus par nœud"
+            shift
+            ;;
+        --nnodes)
+            NNODES="$2"
+            shift
+            ;;
+        --node_rank)
+            NODE_RANK="$2"
+            shift
+            ;;
+        --master_addr)
+            MASTER_ADDR="$2"
+            shift
+            ;;
+        --master_port)
+            MASTER_PORT="$2"
+            shift
+            ;;
         --help)
             show_help
             exit 0
@@ -167,7 +200,16 @@ pip install -r requirements.txt
 
 # Exécuter le fine-tuning
 echo "Démarrage du fine-tuning..."
-python huggingface_finetune.py
+if [ ! -z "$CPU_PROCESSES" ]; then
+    # Un processus par rang ; les cœurs du nœud sont partagés entre les processus
+    export CPU_TRAINING="true"
+    export OMP_NUM_THREADS=$(( $(nproc) / CPU_PROCESSES > 0 ? $(nproc) / CPU_PROCESSES : 1 ))
+    echo "- $NNODES nœud(s) x $CPU_PROCESSES processus, $OMP_NUM_THREADS threads par processus"
+    torchrun --nnodes="$NNODES" --node_rank="$NODE_RANK" --nproc_per_node="$CPU_PROCESSES" \
+        --master_addr="$MASTER_ADDR" --master_port="$MASTER_PORT" huggingface_finetune.py
+else
+    python huggingface_finetune.py
+fi
 
 # Désactiver l'environnement virtuel
 echo "Fin du script. Désactivation de l'environnement virtuel..."
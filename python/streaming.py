@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Outils pour le streaming token par token des réponses (Server-Sent Events).
+"""
+
+import asyncio
+import json
+
+import torch
+from transformers import StoppingCriteria
+
+# Marqueurs du format Mistral à retirer du flux
+STREAM_MARKERS = ("[/INST]", "</s>")
+
+
+class IncrementalDecoder:
+    """
+    Décode les tokens générés au fil de l'eau.
+
+    Le texte est re-décodé à partir d'une petite fenêtre de tokens pour que les
+    caractères multi-octets et les espaces de type SentencePiece soient corrects.
+    """
+
+    def __init__(self, tokenizer, skip_special_tokens=False):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.token_ids = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def push(self, token_id):
+        """Ajouter un token et retourner le nouveau texte stable (éventuellement vide)"""
+        self.token_ids.append(token_id)
+        prefix_text = self.tokenizer.decode(
+            self.token_ids[self.prefix_offset:self.read_offset],
+            skip_special_tokens=self.skip_special_tokens
+        )
+        new_text = self.tokenizer.decode(
+            self.token_ids[self.prefix_offset:],
+            skip_special_tokens=self.skip_special_tokens
+        )
+        # Caractère incomplet : attendre le token suivant
+        if len(new_text) <= len(prefix_text) or new_text.endswith("�"):
+            return ""
+        self.prefix_offset = self.read_offset
+        self.read_offset = len(self.token_ids)
+        return new_text[len(prefix_text):]
+
+
+class StreamCleaner:
+    """
+    Retire à la volée les marqueurs `[/INST]` et `</s>` du texte streamé.
+
+    Un suffixe qui pourrait être le début d'un marqueur est retenu jusqu'à ce
+    que le morceau suivant permette de trancher.
+    """
+
+    def __init__(self, markers=STREAM_MARKERS):
+        self.markers = markers
+        self.buffer = ""
+        self.started = False
+
+    def feed(self, text):
+        """Ajouter du texte brut et retourner la partie nettoyée publiable"""
+        self.buffer += text
+        for marker in self.markers:
+            self.buffer = self.buffer.replace(marker, "")
+
+        held = self._partial_marker_length(self.buffer)
+        ready, self.buffer = self.buffer[:len(self.buffer) - held], self.buffer[len(self.buffer) - held:]
+        return self._strip_leading(ready)
+
+    def flush(self):
+        """Retourner le texte restant en fin de génération"""
+        ready, self.buffer = self.buffer, ""
+        return self._strip_leading(ready).rstrip()
+
+    def _partial_marker_length(self, text):
+        longest = 0
+        for marker in self.markers:
+            for size in range(1, len(marker)):
+                if size > longest and text.endswith(marker[:size]):
+                    longest = size
+        return longest
+
+    def _strip_leading(self, text):
+        # Équivalent du .strip() appliqué au début de la réponse complète
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+
+class CancelledCriteria(StoppingCriteria):
+    """Arrête model.generate quand le client du flux s'est déconnecté (`cancelled` : threading.Event)"""
+
+    def __init__(self, cancelled):
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancelled.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+def sse_event(data, event=None):
+    """Formater un évènement Server-Sent Events"""
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {payload}\n\n"
+
+
+async def iterate_in_thread(iterator):
+    """Parcourir un itérateur bloquant (ex: TextIteratorStreamer) sans bloquer la boucle asyncio"""
+    sentinel = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, sentinel)
+        if item is sentinel:
+            return
+        yield item
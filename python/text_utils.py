@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+Normalisation de texte partagée par le cache de réponses (service) et la
+déduplication des données d'entraînement (hors ligne).
+"""
+
+import re
+import unicodedata
+
+
+def normalize_prompt(text):
+    """
+    Normaliser un prompt pour que les variantes triviales partagent la même clé :
+    casse, accents, ponctuation et espaces multiples sont ignorés.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
@@ -0,0 +1,252 @@
+"""
+Mesure du débit d'entraînement pendant Trainer.train().
+
+ThroughputCallback relève, entre deux journalisations du Trainer :
+- les tokens/s réels (hors padding) et totaux (padding compris), et la part de padding ;
+- la répartition du temps d'un pas : chargement des données (dont la
+  collation), forward, backward (clipping compris), optimiseur ;
+- le pic de mémoire (GPU si disponible, sinon mémoire du processus).
+
+Les mesures sont ajoutées à un fichier JSONL et au dossier tensorboard de
+l'entraînement. En data-parallèle, les tokens sont additionnés sur tous les
+processus et le pic de mémoire est le plus haut des processus.
+
+Les tokens sont comptés par le data collator, qui doit donc tourner dans le
+processus principal (dataloader_num_workers=0, valeur par défaut). Le module
+sert aussi à Agent_Analyse/train.py, qui l'importe depuis ce dossier.
+"""
+
+import os
+import json
+import time
+import resource
+
+import torch
+import torch.distributed as dist
+from transformers import TrainerCallback
+
+# tensorboard est optionnel : sans lui, seules les mesures JSONL sont écrites
+try:
+    from torch.utils.tensorboard import SummaryWriter
+except ImportError:
+    SummaryWriter = None
+
+PHASES = ("data", "forward", "backward", "optimizer")
+
+
+def feature_tokens(feature):
+    """Nombre de tokens réels d'un exemple avant collation"""
+    if "attention_mask" in feature:
+        return int(sum(feature["attention_mask"]))
+    if "length" in feature:
+        return int(feature["length"])
+    return len(feature["input_ids"])
+
+
+class TimedCollator:
+    """Data collator qui mesure son temps d'exécution et compte les tokens des batches"""
+
+    def __init__(self, collator, callback):
+        self.collator = collator
+        self.callback = callback
+
+    def __call__(self, features):
+        start = time.perf_counter()
+        batch = self.collator(features)
+        self.callback.record_batch(
+            real_tokens=sum(feature_tokens(feature) for feature in features),
+            padded_tokens=batch["input_ids"].numel(),
+            collate_time=time.perf_counter() - start
+        )
+        return batch
+
+
+class ThroughputCallback(TrainerCallback):
+    """
+    Callback de mesure du débit. À brancher avec `ThroughputCallback.attach(trainer)`
+    pour que le data collator soit aussi instrumenté.
+    """
+
+    def __init__(self, output_file=None, logging_dir=None):
+        self.output_file = output_file
+        self.logging_dir = logging_dir
+        self.writer = None
+        self.hooks = []
+        self.cuda = torch.cuda.is_available()
+        self.peak_memory = 0.0
+        self.evaluating = False
+        self.reset_window()
+        self.totals = self.new_counters()
+
+    @classmethod
+    def attach(cls, trainer, **kwargs):
+        callback = cls(**kwargs)
+        trainer.data_collator = TimedCollator(trainer.data_collator, callback)
+        trainer.add_callback(callback)
+        return callback
+
+    @staticmethod
+    def new_counters():
+        return {"steps": 0, "real_tokens": 0, "padded_tokens": 0, "collate": 0.0, "step": 0.0,
+                **{phase: 0.0 for phase in PHASES}}
+
+    def reset_window(self):
+        self.window = self.new_counters()
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+
+    def window_peak_memory(self):
+        """Pic de mémoire (Mo) depuis le début de la fenêtre (GPU) ou du processus (CPU)"""
+        if self.cuda:
+            peak = torch.cuda.max_memory_allocated() / 2**20
+        else:
+            # ru_maxrss est en Ko sous Linux
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.peak_memory = max(self.peak_memory, peak)
+        return peak
+
+    def now(self):
+        # Les noyaux CUDA sont asynchrones : attendre leur fin avant de mesurer
+        if self.cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def add(self, key, value):
+        self.window[key] += value
+        self.totals[key] += value
+
+    def record_batch(self, real_tokens, padded_tokens, collate_time):
+        if self.evaluating:
+            # Batches d'évaluation (même data collator) : hors mesure du débit d'entraînement
+            return
+        self.add("real_tokens", real_tokens)
+        self.add("padded_tokens", padded_tokens)
+        self.add("collate", collate_time)
+
+    # Hooks du modèle : début et fin du forward de chaque micro-batch
+
+    def forward_begin(self, module, args):
+        self.mark = self.now()
+
+    def forward_end(self, module, args, output):
+        self.lap("forward")
+
+    def lap(self, phase):
+        """Attribuer à `phase` le temps écoulé depuis la dernière mesure"""
+        now = self.now()
+        self.add(phase, now - self.mark)
+        self.mark = now
+
+    # Événements du Trainer
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        if self.output_file is None:
+            self.output_file = os.path.join(args.output_dir, "throughput.jsonl")
+        if self.logging_dir is None:
+            self.logging_dir = getattr(args, "logging_dir", None) or os.path.join(args.output_dir, "runs")
+        if SummaryWriter is not None and state.is_world_process_zero:
+            self.writer = SummaryWriter(log_dir=self.logging_dir)
+        self.hooks = [
+            model.register_forward_pre_hook(self.forward_begin),
+            model.register_forward_hook(self.forward_end),
+        ]
+        self.skip_gap = False
+        self.mark = self.now()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        # Les batches du pas sont chargés juste avant ce point ; après une
+        # sauvegarde ou une évaluation, l'attente n'est pas comptée
+        if self.skip_gap:
+            self.mark = self.now()
+            self.skip_gap = False
+        else:
+            self.lap("data")
+        self.step_start = self.mark
+
+    def on_substep_end(self, args, state, control, **kwargs):
+        # Fin du backward d'un micro-batch (accumulation de gradient)
+        self.lap("backward")
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        # Fin du backward du dernier micro-batch et du clipping des gradients
+        self.lap("backward")
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.lap("optimizer")
+        self.add("step", self.mark - self.step_start)
+        self.add("steps", 1)
+        self.skip_gap = control.should_save or control.should_evaluate
+        self.evaluating = control.should_evaluate
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        self.evaluating = control.should_evaluate
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        self.evaluating = False
+
+    def reduce(self, counters, peak_memory):
+        """Tokens de tous les processus et pic de mémoire maximal (entraînement distribué)"""
+        if not (dist.is_available() and dist.is_initialized()) or dist.get_world_size() == 1:
+            return counters, peak_memory
+        tokens = torch.tensor([counters["real_tokens"], counters["padded_tokens"]], dtype=torch.float64)
+        peak = torch.tensor([peak_memory], dtype=torch.float64)
+        if dist.get_backend() == "nccl":
+            tokens, peak = tokens.cuda(), peak.cuda()
+        dist.all_reduce(tokens)
+        dist.all_reduce(peak, op=dist.ReduceOp.MAX)
+        counters = {**counters, "real_tokens": int(tokens[0]), "padded_tokens": int(tokens[1])}
+        return counters, peak.item()
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        # Tous les processus journalisent au même pas : la réduction est appelée partout
+        if self.window["steps"]:
+            window, peak_memory = self.reduce(self.window, self.window_peak_memory())
+            if state.is_world_process_zero:
+                self.write(self.summary(window, peak_memory), state.global_step, "step")
+        self.reset_window()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        for hook in self.hooks:
+            hook.remove()
+        self.hooks = []
+        self.window_peak_memory()
+        totals, peak_memory = self.reduce(self.totals, self.peak_memory)
+        if totals["steps"] and state.is_world_process_zero:
+            summary = self.summary(totals, peak_memory)
+            self.write(summary, state.global_step, "train")
+            print(f"Débit: {summary['real_tokens_per_second']:.1f} tokens réels/s, "
+                  f"{summary['padded_tokens_per_second']:.1f} tokens/s avec padding "
+                  f"(padding: {summary['padding_ratio']:.1%}) ; temps par pas: "
+                  + ", ".join(f"{phase} {summary[f'{phase}_fraction']:.0%}" for phase in PHASES))
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def summary(self, counters, peak_memory):
+        """Mesures agrégées d'une fenêtre de pas"""
+        elapsed = counters["step"] + counters["data"]
+        summary = {
+            "steps": counters["steps"],
+            "real_tokens": counters["real_tokens"],
+            "padded_tokens": counters["padded_tokens"],
+            "real_tokens_per_second": counters["real_tokens"] / elapsed if elapsed else 0.0,
+            "padded_tokens_per_second": counters["padded_tokens"] / elapsed if elapsed else 0.0,
+            "padding_ratio": 1 - counters["real_tokens"] / counters["padded_tokens"] if counters["padded_tokens"] else 0.0,
+            "step_time": elapsed / counters["steps"],
+            "collate_time": counters["collate"] / counters["steps"],
+            # Temps non attribué (préparation des entrées, journalisation...)
+            "other_time": (elapsed - sum(counters[phase] for phase in PHASES)) / counters["steps"],
+        }
+        for phase in PHASES:
+            summary[f"{phase}_time"] = counters[phase] / counters["steps"]
+            summary[f"{phase}_fraction"] = counters[phase] / elapsed if elapsed else 0.0
+        summary["peak_memory_mb"] = peak_memory
+        return summary
+
+    def write(self, summary, global_step, kind):
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_file)), exist_ok=True)
+        with open(self.output_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"type": kind, "global_step": global_step, "time": time.time(), **summary}) + "\n")
+        if self.writer is not None:
+            for key, value in summary.items():
+                self.writer.add_scalar(f"throughput/{key}", value, global_step)